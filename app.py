@@ -1,7 +1,8 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Request, Response, request, jsonify, render_template, stream_with_context, send_file, redirect, g
 from flask_cors import CORS
 from flask_compress import Compress
 import os
+import sys
 import json
 import requests
 from datetime import datetime
@@ -10,22 +11,41 @@ import hashlib
 import time
 import secrets
 import tempfile
-import mimetypes
+import io
+import csv
+import shutil
 from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from http.cookiejar import DefaultCookiePolicy
 import re
+from array import array
 from PIL import Image, UnidentifiedImageError
 import random
+import bisect
+import math
 import logging
+import multiprocessing
 from channels import channel_manager
+from channels.base import cancel_scope
+import image_optimizer
+import metrics
 import sqlite3
+import threading
+import base64
+from collections import OrderedDict, deque
 from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 
 app = Flask(__name__, static_folder='static')
 CORS(app)
 Compress(app)  # 启用Gzip压缩
 
-# 创建数据存储目录
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+# 创建数据存储目录（可通过环境变量 DATA_DIR 指定其他目录）
+DATA_DIR = os.environ.get('DATA_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+if not os.path.exists(DATA_DIR):
+    os.makedirs(DATA_DIR)
 DATABASE_FILE = os.path.join(DATA_DIR, 'app.db')  # SQLite数据库文件
 LOG_FILE = os.path.join(DATA_DIR, 'app.log')
 # 旧JSON文件路径（用于数据迁移）
@@ -43,8 +63,71 @@ logging.basicConfig(
 )
 logger = logging.getLogger('image_uploader')
 
-if not os.path.exists(DATA_DIR):
-    os.makedirs(DATA_DIR)
+# ==================== 运行指标 ====================
+
+# 设置后访问 /metrics 需要请求头 Authorization: Bearer <METRICS_TOKEN>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# 数据库操作耗时的分桶（秒），大多数操作在毫秒以内
+DB_DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+# 上传字节数的分桶
+UPLOAD_SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024)
+
+# 单独的数据库文件，写入指标不与业务数据争用写锁
+metrics_registry = metrics.MetricsRegistry(os.path.join(DATA_DIR, 'metrics.db'))
+HTTP_REQUEST_DURATION = metrics_registry.histogram(
+    'fusionpic_http_request_duration_seconds', '各路由的请求处理耗时（秒），流式响应只计到开始返回', ('route', 'method', 'status'))
+HTTP_REQUESTS_IN_FLIGHT = metrics_registry.gauge(
+    'fusionpic_http_requests_in_flight', '正在处理的请求数')
+CHANNEL_UPLOAD_DURATION = metrics_registry.histogram(
+    'fusionpic_channel_upload_duration_seconds', '调用渠道上传的耗时（秒）', ('channel', 'result'))
+CHANNEL_UPLOAD_SIZE = metrics_registry.histogram(
+    'fusionpic_channel_upload_size_bytes', '成功上传到渠道的文件大小（字节）', ('channel',), buckets=UPLOAD_SIZE_BUCKETS)
+CHANNEL_UPLOAD_BYTES = metrics_registry.counter(
+    'fusionpic_channel_upload_bytes_total', '成功上传到渠道的总字节数', ('channel',))
+CHANNEL_UPLOAD_FAILURES = metrics_registry.counter(
+    'fusionpic_channel_upload_failures_total', '渠道上传失败次数（不含被取消的上传）', ('channel',))
+CHANNEL_UPLOADS_IN_FLIGHT = metrics_registry.gauge(
+    'fusionpic_channel_uploads_in_flight', '各渠道正在进行的上传数', ('channel',),
+    callback=lambda: {(name,): count for name, count in channel_manager.get_in_flight().items()})
+DB_OPERATION_DURATION = metrics_registry.histogram(
+    'fusionpic_db_operation_duration_seconds', '按调用函数统计的数据库连接使用时长（秒）', ('operation',),
+    buckets=DB_DURATION_BUCKETS)
+RANDOM_POOL_SIZE = metrics_registry.gauge(
+    'fusionpic_random_pool_size', '随机图片各筛选条件下的候选数量', ('channel', 'orientation'), aggregate='max',
+    callback=lambda: {(channel or 'all', orientation or 'all'): size
+                      for (channel, orientation), size in random_image_index.stats().items()})
+SPOOL_FILES = metrics_registry.gauge(
+    'fusionpic_spool_files', '打开中的上传临时文件数（memory=内存中，disk=已转存到磁盘）', ('storage',))
+
+def record_channel_upload_metrics(channel, outcome, duration, size):
+    """渠道上传完成后记录指标（见 ChannelManager.add_upload_observer）"""
+    CHANNEL_UPLOAD_DURATION.observe(duration, channel=channel, result=outcome)
+    if outcome == 'success':
+        CHANNEL_UPLOAD_SIZE.observe(size, channel=channel)
+        CHANNEL_UPLOAD_BYTES.inc(size, channel=channel)
+    elif outcome == 'failure':
+        CHANNEL_UPLOAD_FAILURES.inc(channel=channel)
+
+channel_manager.add_upload_observer(record_channel_upload_metrics)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_start = time.perf_counter()
+    HTTP_REQUESTS_IN_FLIGHT.add(1)
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        # 按路由规则而不是实际路径统计，未匹配的请求合并为一项
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, route=route, method=request.method,
+                                      status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    HTTP_REQUESTS_IN_FLIGHT.add(-1)
 
 # ==================== SQLite 数据库操作 ====================
 
@@ -66,15 +149,19 @@ def init_database():
             height INTEGER DEFAULT 0,
             file_size INTEGER DEFAULT 0,
             channel TEXT,
-            upload_time TEXT NOT NULL
+            upload_time TEXT NOT NULL,
+            aspect_ratio REAL,
+            orientation TEXT,
+            content_hash TEXT,
+            original_size INTEGER,
+            mirrors TEXT,
+            optimize_key TEXT NOT NULL DEFAULT ''
         )
     ''')
     # 创建按上传时间降序的索引，加速查询
-    conn.execute('CREATE INDEX IF NOT EXISTS idx_upload_time ON upload_history(upload_time DESC)')
-    # 创建渠道索引，加速按渠道筛选
-    conn.execute('CREATE INDEX IF NOT EXISTS idx_channel ON upload_history(channel)')
-    # 创建宽高索引，加速按图片方向筛选
-    conn.execute('CREATE INDEX IF NOT EXISTS idx_dimensions ON upload_history(width, height)')
+    # 索引包含 id 作为第二键，使 (upload_time, id) 游标分页可以直接在索引上定位和排序
+    conn.execute('DROP INDEX IF EXISTS idx_upload_time')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_upload_time_id ON upload_history(upload_time DESC, id DESC)')
 
     # 数据库迁移：为已存在的表添加 file_size 列（如果不存在）
     cursor = conn.execute('PRAGMA table_info(upload_history)')
@@ -82,6 +169,201 @@ def init_database():
     if 'file_size' not in columns:
         conn.execute('ALTER TABLE upload_history ADD COLUMN file_size INTEGER DEFAULT 0')
 
+    # 数据库迁移：添加宽高比和方向列，并一次性回填已有记录
+    if 'orientation' not in columns:
+        conn.execute('ALTER TABLE upload_history ADD COLUMN aspect_ratio REAL')
+        conn.execute('ALTER TABLE upload_history ADD COLUMN orientation TEXT')
+        conn.execute('''
+            UPDATE upload_history SET
+                aspect_ratio = CAST(width AS REAL) / height,
+                orientation = CASE
+                    WHEN CAST(width AS REAL) / height >= ? THEN 'landscape'
+                    WHEN CAST(height AS REAL) / width >= ? THEN 'portrait'
+                    ELSE 'square'
+                END
+            WHERE width > 0 AND height > 0
+        ''', (ORIENTATION_RATIO_THRESHOLD, ORIENTATION_RATIO_THRESHOLD))
+        logging.info("已为上传历史回填宽高比和方向")
+
+    # 按渠道+方向的复合索引，覆盖按渠道及按方向的筛选，
+    # 取代原先的 idx_channel 和按宽高计算方向的 idx_dimensions
+    conn.execute('DROP INDEX IF EXISTS idx_channel')
+    conn.execute('DROP INDEX IF EXISTS idx_dimensions')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_channel_orientation ON upload_history(channel, orientation)')
+
+    # 数据库迁移：添加内容哈希列（SHA-256），同一渠道内同一内容只保存一次
+    # 迁移前的旧记录没有哈希值（NULL），不参与唯一性约束
+    if 'content_hash' not in columns:
+        conn.execute('ALTER TABLE upload_history ADD COLUMN content_hash TEXT')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_channel_content_hash ON upload_history(channel, content_hash)')
+
+    # 数据库迁移：添加原图大小列，上传前经过压缩/转码时 file_size 为实际保存的大小，未处理时为NULL
+    if 'original_size' not in columns:
+        conn.execute('ALTER TABLE upload_history ADD COLUMN original_size INTEGER')
+
+    # 数据库迁移：添加镜像列，多渠道镜像上传时保存其他渠道的链接（JSON数组 [{channel, file_url}]）
+    if 'mirrors' not in columns:
+        conn.execute('ALTER TABLE upload_history ADD COLUMN mirrors TEXT')
+
+    # 数据库迁移：添加压缩选项标识列（见 optimize_fingerprint），同一原图按不同选项压缩的结果分别保存，
+    # 唯一性约束改为 (渠道, 内容哈希, 压缩选项)
+    if 'optimize_key' not in columns:
+        conn.execute("ALTER TABLE upload_history ADD COLUMN optimize_key TEXT NOT NULL DEFAULT ''")
+    conn.execute('DROP INDEX IF EXISTS idx_channel_content_hash')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_channel_content_hash_optimize '
+                 'ON upload_history(channel, content_hash, optimize_key)')
+
+    # 统计计数表（去重命中率等），各worker共享
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS upload_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # 历史记录变更日志：由触发器按顺序记录新增和删除的rowid，各worker据此增量同步内存索引
+    # （rowid 可能被复用，所以新增也要记录，按日志顺序重放才能区分同一rowid的新旧记录）
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS history_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            row_id INTEGER NOT NULL,
+            deleted INTEGER NOT NULL
+        )
+    ''')
+    # 旧版本的版本号表只能判断“有删除”，删除时需要整体重建索引
+    conn.execute('DROP TRIGGER IF EXISTS trg_history_insert')
+    conn.execute('DROP TRIGGER IF EXISTS trg_history_delete')
+    conn.execute('DROP TABLE IF EXISTS history_meta')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_history_insert_log AFTER INSERT ON upload_history
+        BEGIN
+            INSERT INTO history_changes (row_id, deleted) VALUES (NEW.rowid, 0);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_history_delete_log AFTER DELETE ON upload_history
+        BEGIN
+            INSERT INTO history_changes (row_id, deleted) VALUES (OLD.rowid, 1);
+        END
+    ''')
+
+    # 异步上传任务表：文件内容保存在 DATA_DIR/jobs 下，任务状态在这里持久化，worker重启后继续执行
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS upload_jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            img_info TEXT NOT NULL,
+            options TEXT,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_by TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    # 按状态+创建时间的索引，用于按顺序领取排队中的任务
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_upload_jobs_status ON upload_jobs(status, created_at)')
+    # 数据库迁移：添加上传选项列（压缩/转码参数）
+    cursor = conn.execute('PRAGMA table_info(upload_jobs)')
+    if 'options' not in [column[1] for column in cursor.fetchall()]:
+        conn.execute('ALTER TABLE upload_jobs ADD COLUMN options TEXT')
+
+    # 批量链接导入表：每个导入任务一行，逐条链接的处理结果保存在 url_import_items 中，
+    # 中断后只需继续处理 pending 状态的链接
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS url_imports (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            succeeded INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            claimed_by TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS url_import_items (
+            import_id TEXT NOT NULL,
+            idx INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            file_url TEXT,
+            error TEXT,
+            PRIMARY KEY (import_id, idx)
+        )
+    ''')
+
+    # 链接上传结果缓存：规范化后的源链接+渠道+压缩选项 -> 图床链接，保存源站的 ETag/Last-Modified 用于条件请求
+    # 旧版本的缓存表没有压缩选项列，主键不同，直接丢弃重建
+    url_cache_columns = [column[1] for column in conn.execute('PRAGMA table_info(url_cache)').fetchall()]
+    if url_cache_columns and 'optimize_key' not in url_cache_columns:
+        conn.execute('DROP TABLE url_cache')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS url_cache (
+            url_key TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            optimize_key TEXT NOT NULL DEFAULT '',
+            file_url TEXT NOT NULL,
+            width INTEGER DEFAULT 0,
+            height INTEGER DEFAULT 0,
+            etag TEXT,
+            last_modified TEXT,
+            validated_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (url_key, channel, optimize_key)
+        )
+    ''')
+    # 按最近使用时间的索引，用于LRU淘汰
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_url_cache_last_used ON url_cache(last_used)')
+    # 按图床链接的索引，删除上传历史时使对应的缓存项失效
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_url_cache_file_url ON url_cache(file_url)')
+
+    # 缩略图缓存表：缩略图文件按原图内容哈希保存在 DATA_DIR/thumbs 下，这里记录大小和最近使用时间用于LRU淘汰
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS thumbnails (
+            content_hash TEXT PRIMARY KEY,
+            format TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_thumbnails_last_used ON thumbnails(last_used)')
+
+    # 多渠道并发上传中各渠道的结果，用于比较渠道的耗时和成功率
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS channel_uploads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id TEXT NOT NULL,
+            mode TEXT NOT NULL,
+            channel TEXT NOT NULL,
+            status TEXT NOT NULL,
+            duration REAL,
+            file_url TEXT,
+            error TEXT,
+            created_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_channel_uploads_channel ON channel_uploads(channel, created_at)')
+
+    # 随机图片牌组：记录每个客户端在哈希环上的游标，所有worker共享
+    # 旧版本保存已抽到的rowid集合，无法转换，直接重建
+    deck_columns = [column[1] for column in conn.execute('PRAGMA table_info(random_decks)').fetchall()]
+    if deck_columns and 'cursor' not in deck_columns:
+        conn.execute('DROP TABLE random_decks')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS random_decks (
+            deck_key TEXT PRIMARY KEY,
+            cursor INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_random_decks_updated_at ON random_decks(updated_at)')
+
     # 验证配置表（存储验证码哈希和盐值）
     conn.execute('''
         CREATE TABLE IF NOT EXISTS verification_config (
@@ -101,6 +383,22 @@ def init_database():
     ''')
     # 创建过期时间索引，方便清理过期token
     conn.execute('CREATE INDEX IF NOT EXISTS idx_expires_at ON valid_tokens(expires_at)')
+
+    # token版本号表：删除尚未过期的token（撤销）时递增，通知各worker清空token缓存
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS token_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            generation INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO token_meta (id) VALUES (1)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_token_revoke AFTER DELETE ON valid_tokens
+        WHEN OLD.expires_at > (julianday('now') - 2440587.5) * 86400.0
+        BEGIN
+            UPDATE token_meta SET generation = generation + 1 WHERE id = 1;
+        END
+    ''')
     
     conn.commit()
     conn.close()
@@ -127,18 +425,22 @@ def migrate_from_json():
         migrated_count = 0
         for item in history:
             try:
+                width = item.get('width', 0)
+                height = item.get('height', 0)
                 conn.execute('''
                     INSERT OR IGNORE INTO upload_history 
-                    (id, file_name, file_url, width, height, channel, upload_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    (id, file_name, file_url, width, height, channel, upload_time, aspect_ratio, orientation)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (
                     item['id'], 
                     item['file_name'], 
                     item['file_url'],
-                    item.get('width', 0), 
-                    item.get('height', 0), 
+                    width, 
+                    height, 
                     item.get('channel', ''),
-                    item['upload_time']
+                    item['upload_time'],
+                    compute_aspect_ratio(width, height),
+                    classify_orientation(width, height)
                 ))
                 migrated_count += 1
             except Exception as e:
@@ -193,56 +495,740 @@ def migrate_verification_from_json():
     except Exception as e:
         logging.error(f"迁移验证配置失败: {str(e)}")
 
+# 每个连接建立时执行一次的调优参数（journal_mode=WAL 持久化在数据库文件中，无需重复设置）
+DB_CONNECTION_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=10000',
+    'PRAGMA temp_store=MEMORY',
+)
+DB_CACHED_STATEMENTS = 256  # 每个连接缓存的预编译语句数量
+
+# 线程本地连接池：gunicorn 的每个线程复用自己的连接
+_db_local = threading.local()
+# fork 前继承下来的连接，子进程中不能再使用也不能关闭，只保留引用
+_inherited_db_connections = []
+
+def _open_db_connection():
+    """创建一个新的数据库连接并应用调优参数"""
+    conn = sqlite3.connect(DATABASE_FILE, timeout=10, cached_statements=DB_CACHED_STATEMENTS)
+    conn.row_factory = sqlite3.Row  # 返回字典形式的结果
+    for pragma in DB_CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
 @contextmanager
 def get_db_connection():
-    """获取数据库连接的上下文管理器"""
-    conn = sqlite3.connect(DATABASE_FILE, timeout=10)
-    conn.row_factory = sqlite3.Row  # 返回字典形式的结果
+    """获取当前线程复用的数据库连接的上下文管理器"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or _db_local.pid != os.getpid():
+        if conn is not None:
+            _inherited_db_connections.append(conn)
+        conn = _open_db_connection()
+        _db_local.conn = conn
+        _db_local.pid = os.getpid()
+    # 调用方的函数名，两层分别是 contextmanager 的 __enter__ 和调用方
+    operation = sys._getframe(2).f_code.co_name
+    start = time.perf_counter()
     try:
         yield conn
+    except Exception:
+        # 连接会被复用，出错时回滚未提交的写入，避免事务泄漏到下一次使用
+        conn.rollback()
+        raise
     finally:
-        conn.close()
+        DB_OPERATION_DURATION.observe(time.perf_counter() - start, operation=operation)
+
+# 历史记录分页配置
+HISTORY_PAGE_SIZE = 6  # 默认每页条数
+HISTORY_MAX_PAGE_SIZE = 100  # 每页条数上限，防止一次拉取过多数据
+HISTORY_COUNT_CACHE_TTL = 30  # 总数缓存有效期（秒），其他worker的写入最多延迟这么久可见
 
-def get_upload_history():
-    """获取所有上传历史"""
+# 历史记录总数缓存（本进程写入时立即失效）
+_history_count_cache = {'value': None, 'expires_at': 0}
+_history_count_lock = threading.Lock()
+
+def encode_history_cursor(upload_time, item_id):
+    """将 (upload_time, id) 编码为不透明的游标字符串"""
+    raw = json.dumps([upload_time, item_id], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_history_cursor(cursor):
+    """解析游标字符串，返回 (upload_time, id)，无效时返回None"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        upload_time, item_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if isinstance(upload_time, str) and isinstance(item_id, str):
+            return upload_time, item_id
+    except Exception:
+        pass
+    return None
+
+def get_upload_history_page(cursor=None, limit=HISTORY_PAGE_SIZE, page=None, thumb_size=None):
+    """
+    按 (upload_time, id) 键集分页获取上传历史
+    
+    参数:
+        cursor: 上一页返回的游标，为None时从最新的记录开始
+        limit: 每页条数
+        page: 页码（从1开始），仅在没有游标时使用，用于跳页
+        thumb_size: (宽, 高) - 客户端的缩略图显示尺寸，见 history_thumbnail_url
+    
+    返回:
+        tuple - (记录列表, 下一页游标或None)
+    """
+    sql = ('SELECT h.id, h.file_name, h.file_url, h.width, h.height, h.file_size, h.original_size, h.channel, '
+           'h.upload_time, h.mirrors, t.content_hash IS NOT NULL AS has_thumb '
+           'FROM upload_history h LEFT JOIN thumbnails t ON t.content_hash = h.content_hash')
+    params = []
+    
+    position = decode_history_cursor(cursor) if cursor else None
+    if position:
+        # 行值比较可以直接使用 idx_upload_time_id 索引定位，与页数无关
+        sql += ' WHERE (h.upload_time, h.id) < (?, ?)'
+        params.extend(position)
+    
+    # 多取一条用于判断是否还有下一页
+    sql += ' ORDER BY h.upload_time DESC, h.id DESC LIMIT ?'
+    params.append(limit + 1)
+    
+    if not position and page and page > 1:
+        sql += ' OFFSET ?'
+        params.append((page - 1) * limit)
+    
     with get_db_connection() as conn:
-        cursor = conn.execute(
-            'SELECT id, file_name, file_url, width, height, file_size, channel, upload_time '
-            'FROM upload_history ORDER BY upload_time DESC'
-        )
-        return [dict(row) for row in cursor.fetchall()]
+        cursor_obj = conn.execute(sql, params)
+        items = [dict(row) for row in cursor_obj.fetchall()]
+    for item in items:
+        item['thumb_url'] = history_thumbnail_url(item, item.pop('has_thumb'), thumb_size)
+        item['mirrors'] = json.loads(item['mirrors']) if item['mirrors'] else []
+    
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_history_cursor(items[-1]['upload_time'], items[-1]['id'])
+    return items, next_cursor
+
+def get_history_total_count():
+    """获取上传历史总数（带缓存）"""
+    now = time.time()
+    with _history_count_lock:
+        if _history_count_cache['value'] is not None and _history_count_cache['expires_at'] > now:
+            return _history_count_cache['value']
+    
+    with get_db_connection() as conn:
+        total = conn.execute('SELECT COUNT(*) FROM upload_history').fetchone()[0]
+    
+    with _history_count_lock:
+        _history_count_cache['value'] = total
+        _history_count_cache['expires_at'] = now + HISTORY_COUNT_CACHE_TTL
+    return total
+
+def invalidate_history_count():
+    """使历史记录总数缓存失效"""
+    with _history_count_lock:
+        _history_count_cache['value'] = None
+        _history_count_cache['expires_at'] = 0
 
 def add_upload_history(item):
-    """添加一条上传历史"""
+    """
+    添加一条上传历史
+    
+    返回:
+        bool - 是否写入成功；同一渠道已存在相同内容哈希的记录时返回False
+    """
+    return add_upload_history_batch([item]) > 0
+
+def add_upload_history_batch(items):
+    """
+    在一个事务中添加多条上传历史
+    
+    返回:
+        int - 实际写入的条数；同一渠道已存在相同内容哈希和压缩选项的记录会被跳过
+    """
+    added = []
     with get_db_connection() as conn:
-        conn.execute('''
-            INSERT INTO upload_history
-            (id, file_name, file_url, width, height, file_size, channel, upload_time)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            item['id'],
-            item['file_name'],
-            item['file_url'],
-            item.get('width', 0),
-            item.get('height', 0),
-            item.get('file_size', 0),
-            item.get('channel', ''),
-            item['upload_time']
-        ))
+        for item in items:
+            width = item.get('width', 0)
+            height = item.get('height', 0)
+            item['aspect_ratio'] = compute_aspect_ratio(width, height)
+            item['orientation'] = classify_orientation(width, height)
+            # 并发上传相同内容时，后写入的一方被唯一索引忽略
+            cursor = conn.execute('''
+                INSERT OR IGNORE INTO upload_history
+                (id, file_name, file_url, width, height, file_size, channel, upload_time, aspect_ratio, orientation,
+                 content_hash, original_size, mirrors, optimize_key)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                item['id'],
+                item['file_name'],
+                item['file_url'],
+                width,
+                height,
+                item.get('file_size', 0),
+                item.get('channel', ''),
+                item['upload_time'],
+                item['aspect_ratio'],
+                item['orientation'],
+                item.get('content_hash'),
+                item.get('original_size'),
+                json.dumps(item['mirrors'], ensure_ascii=False) if item.get('mirrors') else None,
+                item.get('optimize_key', '')
+            ))
+            if cursor.rowcount:
+                added.append((cursor.lastrowid, item))
+        conn.commit()
+    if added:
+        invalidate_history_count()
+        for rowid, item in added:
+            random_image_index.add(rowid, item)
+    return len(added)
+
+def find_upload_by_hash(channels, content_hash, optimize_key=''):
+    """
+    按内容哈希查找已上传的图片
+    
+    参数:
+        channels: list - 渠道名列表，在这些渠道中查找
+        content_hash: str - 内容哈希
+        optimize_key: str - 压缩选项标识（见 optimize_fingerprint），只匹配按相同选项上传的记录
+    
+    返回:
+        dict or None - {file_url, width, height, channel}，未找到返回None
+    """
+    placeholders = ', '.join('?' * len(channels))
+    with get_db_connection() as conn:
+        # 渠道在 idx_channel_content_hash_optimize 的第一列，IN 查询会逐个渠道在索引上定位
+        row = conn.execute(
+            f'SELECT file_url, width, height, channel FROM upload_history '
+            f'WHERE channel IN ({placeholders}) AND content_hash = ? AND optimize_key = ? LIMIT 1',
+            (*channels, content_hash, optimize_key)
+        ).fetchone()
+    return dict(row) if row else None
+
+def find_uploads_by_hash(channels, content_hash, optimize_key=''):
+    """
+    按内容哈希和压缩选项查找各渠道已上传的图片
+    
+    返回:
+        dict - {渠道名: {file_url, width, height, channel}}，只包含已上传过的渠道
+    """
+    placeholders = ', '.join('?' * len(channels))
+    with get_db_connection() as conn:
+        rows = conn.execute(
+            f'SELECT file_url, width, height, channel FROM upload_history '
+            f'WHERE channel IN ({placeholders}) AND content_hash = ? AND optimize_key = ?',
+            (*channels, content_hash, optimize_key)
+        ).fetchall()
+    return {row['channel']: dict(row) for row in rows}
+
+def increment_stat(name, amount=1):
+    """累加一个统计计数"""
+    with get_db_connection() as conn:
+        conn.execute(
+            'INSERT INTO upload_stats (name, value) VALUES (?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+            (name, amount)
+        )
         conn.commit()
 
+def get_stats():
+    """获取所有统计计数"""
+    with get_db_connection() as conn:
+        return {row['name']: row['value'] for row in conn.execute('SELECT name, value FROM upload_stats')}
+
 def delete_history_by_id(item_id):
     """删除一条上传历史，返回是否删除成功"""
     with get_db_connection() as conn:
-        cursor = conn.execute('DELETE FROM upload_history WHERE id = ?', (item_id,))
+        row = conn.execute('SELECT rowid, file_url, mirrors FROM upload_history WHERE id = ?', (item_id,)).fetchone()
+        if not row:
+            return False
+        conn.execute('DELETE FROM upload_history WHERE rowid = ?', (row[0],))
+        # 链接缓存命中时不会写入上传历史，删除后再次提交相同链接需要重新上传
+        file_urls = [row[1]] + [mirror['file_url'] for mirror in json.loads(row[2] or '[]')]
+        conn.executemany('DELETE FROM url_cache WHERE file_url = ?', [(file_url,) for file_url in file_urls])
         conn.commit()
-        return cursor.rowcount > 0
+    invalidate_history_count()
+    random_image_index.remove(row[0])
+    return True
 
 def clear_all_history():
     """清空所有上传历史"""
     with get_db_connection() as conn:
         conn.execute('DELETE FROM upload_history')
+        conn.execute('DELETE FROM url_cache')
         conn.commit()
+    invalidate_history_count()
+    random_image_index.clear()
+
+# ==================== 随机图片索引 ====================
+
+# 宽高比阈值，用于过滤接近方形的图片
+# - 横屏：宽/高 >= 1.2
+# - 竖屏：高/宽 >= 1.2
+ORIENTATION_RATIO_THRESHOLD = 1.2
+RANDOM_INDEX_SYNC_INTERVAL = 2  # 检查其他worker写入的间隔（秒）
+RANDOM_INDEX_CHANGE_LOG_SIZE = 100000  # 变更日志保留的条数，落后更多的worker整体重建索引
+RANDOM_INDEX_APPLY_BATCH = 1000  # 重放变更时每次加锁应用的条数
+RANDOM_MAX_COUNT = 50  # /api/random 一次最多返回的图片数
+RANDOM_DECK_MAX_LENGTH = 64  # 牌组标识的最大长度
+RANDOM_DECK_TTL = 24 * 3600  # 牌组超过该时间（秒）未使用时清除
+RANDOM_DECK_PURGE_EVERY = 500  # 每写入多少次牌组清理一次过期牌组
+RANDOM_DECK_MAX_RETRIES = 5  # 同一牌组并发抽取冲突时重新读取游标的次数
+RANDOM_SEED_MAX_LENGTH = 128  # 种子的最大长度
+RANDOM_SEED_MAX_AGE = 3600  # 指定种子时允许缓存的时间（秒）
+# 按时间段固定图片（如"每小时一图"）时各时间段的长度（秒），按服务器本地时间对齐
+RANDOM_PERIODS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 24 * 3600,
+}
+
+# 按屏幕尺寸选择图片时的分桶：宽高比和分辨率（长边）都按对数划分
+FIT_ASPECT_STEPS = 8  # 宽高比每相差2倍划分的桶数（相邻桶约相差9%）
+FIT_LEVEL_STEPS = 4  # 长边每相差2倍划分的桶数（相邻桶约相差19%）
+FIT_MAX_ASPECT_DISTANCE = 4  # 宽高比最多放宽到相差几个桶（约±41%）
+FIT_LEVEL_BAND = 2  # 能覆盖屏幕的最小分辨率之上还接受几个分辨率桶（长边约大 1.4 倍以内）
+FIT_DISTANCE_WEIGHT = 0.75  # 宽高比或分辨率每偏离一个桶，抽取权重乘以该系数
+
+def fit_bucket(width, height):
+    """
+    图片所属的 (宽高比桶, 分辨率桶)，尺寸未知时返回None
+    
+    分辨率桶 n 中图片的长边在 [2^(n/FIT_LEVEL_STEPS), 2^((n+1)/FIT_LEVEL_STEPS)) 之间
+    """
+    if not width or not height or width <= 0 or height <= 0:
+        return None
+    return (round(math.log2(width / height) * FIT_ASPECT_STEPS),
+            math.floor(math.log2(max(width, height)) * FIT_LEVEL_STEPS))
+
+def covering_level(aspect, width, height):
+    """
+    宽高比桶 aspect 中的图片要覆盖 width x height 的屏幕所需的最小分辨率桶
+    
+    按桶内最不利的宽高比计算，该分辨率桶及以上的图片宽高都不小于屏幕
+    """
+    required = 0
+    for edge in (-0.5, 0.5):
+        ratio = 2 ** ((aspect + edge) / FIT_ASPECT_STEPS)
+        # 长边为 L 时宽为 L*min(1, ratio)，高为 L*min(1, 1/ratio)
+        required = max(required, width / min(1, ratio), height / min(1, 1 / ratio))
+    return math.ceil(math.log2(required) * FIT_LEVEL_STEPS)
+
+def ring_point(image_id):
+    """图片或种子在一致性哈希环上的位置（64位整数），与进程和加载顺序无关"""
+    return int.from_bytes(hashlib.blake2b(image_id.encode('utf-8'), digest_size=8).digest(), 'big')
+
+def compute_aspect_ratio(width, height):
+    """计算宽高比，尺寸未知时返回None"""
+    if not width or not height or width <= 0 or height <= 0:
+        return None
+    return width / height
+
+def classify_orientation(width, height):
+    """
+    根据宽高判断图片方向（与 init_database 中的回填规则一致）
+    
+    返回:
+        str or None - 'landscape'、'portrait' 或 'square'（接近方形），尺寸未知时返回None
+    """
+    ratio = compute_aspect_ratio(width, height)
+    if ratio is None:
+        return None
+    if ratio >= ORIENTATION_RATIO_THRESHOLD:
+        return 'landscape'
+    if 1 / ratio >= ORIENTATION_RATIO_THRESHOLD:
+        return 'portrait'
+    return 'square'
+
+class RandomImageIndex:
+    """
+    随机图片候选索引
+    
+    按 (渠道, 方向) 分桶保存rowid数组，方向取自持久化的 orientation 列，
+    随机选择为常数时间且不访问数据库。
+    本进程的写入直接更新索引；其他worker的写入由后台线程按 history_changes
+    变更日志增量重放，新增和删除都只处理变化的记录。
+    """
+    
+    _SELECT = 'SELECT rowid, id, file_name, file_url, width, height, channel, orientation FROM upload_history'
+    
+    def __init__(self, sync_interval=RANDOM_INDEX_SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()  # 同步串行执行，读数据库期间不持有 _lock
+        self._pid = None
+        self._reset()
+    
+    def _reset(self):
+        self._records = {}    # rowid -> 图片信息元组
+        self._buckets = {}    # (channel, orientation) -> array of rowid
+        self._positions = {}  # (channel, orientation) -> {rowid: 数组下标}
+        self._seq = None  # 已重放到的变更日志序号，None 表示需要整体加载
+        self._points = {}  # rowid -> 哈希环位置
+        self._point_rowids = {}  # 哈希环位置 -> rowid
+        self._rings = {}  # (channel, orientation) -> 已排序的哈希环位置数组，首次按种子选择时建立
+        self._fit_keys = {}  # rowid -> (宽高比桶, 分辨率桶)
+        self._fits = {}  # (channel, orientation) -> {(宽高比桶, 分辨率桶): array of rowid}
+        self._fit_positions = {}  # (channel, orientation) -> {rowid: 所在数组的下标}
+    
+    @staticmethod
+    def _bucket_keys(channel, orientation):
+        """一条记录所属的所有桶（None 表示不限）"""
+        channel = channel or None
+        keys = [(None, None), (channel, None)]
+        if orientation:
+            keys.extend([(None, orientation), (channel, orientation)])
+        return set(keys)
+    
+    def _insert(self, rowid, record):
+        if rowid in self._records:
+            return
+        self._records[rowid] = record
+        point = ring_point(record[0])
+        self._points[rowid] = point
+        self._point_rowids[point] = rowid
+        fit = fit_bucket(record[3], record[4])
+        if fit:
+            self._fit_keys[rowid] = fit
+        for key in self._bucket_keys(record[5], record[6]):
+            bucket = self._buckets.setdefault(key, array('q'))
+            self._positions.setdefault(key, {})[rowid] = len(bucket)
+            bucket.append(rowid)
+            if fit:
+                fit_bucket_rowids = self._fits.setdefault(key, {}).setdefault(fit, array('q'))
+                self._fit_positions.setdefault(key, {})[rowid] = len(fit_bucket_rowids)
+                fit_bucket_rowids.append(rowid)
+            ring = self._rings.get(key)
+            if ring is not None:
+                ring.insert(bisect.bisect_left(ring, point), point)
+    
+    def _delete(self, rowid):
+        record = self._records.pop(rowid, None)
+        if record is None:
+            return
+        point = self._points.pop(rowid)
+        self._point_rowids.pop(point, None)
+        fit = self._fit_keys.pop(rowid, None)
+        for key in self._bucket_keys(record[5], record[6]):
+            ring = self._rings.get(key)
+            if ring is not None:
+                del ring[bisect.bisect_left(ring, point)]
+            if fit:
+                self._swap_remove(self._fits[key][fit], self._fit_positions[key], rowid)
+            self._swap_remove(self._buckets[key], self._positions[key], rowid)
+    
+    @staticmethod
+    def _swap_remove(bucket, positions, rowid):
+        """用数组末尾元素填补空位，删除为常数时间"""
+        index = positions.pop(rowid)
+        last = bucket.pop()
+        if last != rowid:
+            bucket[index] = last
+            positions[last] = index
+    
+    def _ensure_loaded(self):
+        """首次使用或fork后的子进程中加载索引并启动同步线程"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._reset()
+            with get_db_connection() as conn:
+                self._load(conn)
+            self._pid = os.getpid()
+        threading.Thread(target=self._sync_loop, name='random-index-sync', daemon=True).start()
+    
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"同步随机图片索引失败: {str(e)}")
+    
+    def _load(self, conn):
+        """从数据库整体加载记录"""
+        # 先读日志序号再读数据，期间发生的变更会在下一轮重放（重放是幂等的）
+        self._seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM history_changes').fetchone()[0]
+        for r in conn.execute(self._SELECT):
+            self._insert(r[0], tuple(r[1:]))
+    
+    def sync(self):
+        """
+        按变更日志同步其他worker的写入
+        
+        读数据库时不持有索引锁，只在应用结果时短暂加锁，同步期间的选择不会被阻塞。
+        """
+        with self._sync_lock, get_db_connection() as conn:
+            first, last = conn.execute('SELECT MIN(seq), MAX(seq) FROM history_changes').fetchone()
+            with self._lock:
+                seq, size = self._seq, len(self._records)
+            if seq is not None and seq == (last or 0):
+                return
+            # 本进程清空过、落后的日志已被清理或待重放的变更多于现有记录时，整体重建更快
+            if seq is None or (first is not None and seq < first - 1) or last - seq > size:
+                fresh = RandomImageIndex.__new__(RandomImageIndex)
+                fresh._reset()
+                fresh._load(conn)
+                with self._lock:
+                    # 新索引在锁外建好，这里只替换引用
+                    vars(self).update(vars(fresh))
+                seq = fresh._seq
+            self._replay(conn, seq)
+            if first is not None and last - first >= 2 * RANDOM_INDEX_CHANGE_LOG_SIZE:
+                conn.execute('DELETE FROM history_changes WHERE seq <= ?', (last - RANDOM_INDEX_CHANGE_LOG_SIZE,))
+                conn.commit()
+    
+    def _replay(self, conn, seq):
+        """按顺序重放序号 seq 之后的变更"""
+        changes = conn.execute('SELECT seq, row_id, deleted FROM history_changes WHERE seq > ? ORDER BY seq',
+                               (seq,)).fetchall()
+        if not changes:
+            return
+        deleted = set()
+        latest = {}  # rowid -> 最后一次变更是否为删除
+        for _, rowid, is_deleted in changes:
+            if is_deleted:
+                deleted.add(rowid)
+            latest[rowid] = is_deleted
+        with self._lock:
+            # 已在索引中且期间没有删除的记录不必重新读取（本进程自己的写入）
+            wanted = [rowid for rowid, is_deleted in latest.items()
+                      if not is_deleted and (rowid in deleted or rowid not in self._records)]
+        # 读取当前数据：期间又被删除的记录读不到，其删除会在下一轮重放
+        records = {}
+        for i in range(0, len(wanted), 500):
+            chunk = wanted[i:i + 500]
+            rows = conn.execute(f"{self._SELECT} WHERE rowid IN ({','.join('?' * len(chunk))})", chunk)
+            records.update((r[0], tuple(r[1:])) for r in rows)
+        # 分批加锁应用，大批删除时选择也只需等待一批
+        ops = [(rowid, None) for rowid in deleted] + list(records.items())
+        for i in range(0, len(ops), RANDOM_INDEX_APPLY_BATCH):
+            with self._lock:
+                if self._seq != seq:
+                    # 期间本进程清空了索引，下一轮整体重建
+                    return
+                for rowid, record in ops[i:i + RANDOM_INDEX_APPLY_BATCH]:
+                    if record is None:
+                        self._delete(rowid)
+                    else:
+                        self._insert(rowid, record)
+        with self._lock:
+            if self._seq == seq:
+                self._seq = changes[-1][0]
+    
+    def add(self, rowid, item):
+        """本进程新增记录后更新索引"""
+        self._ensure_loaded()
+        record = (item['id'], item['file_name'], item['file_url'],
+                  item.get('width', 0), item.get('height', 0), item.get('channel', ''),
+                  item.get('orientation'))
+        with self._lock:
+            self._insert(rowid, record)
+    
+    def remove(self, rowid):
+        """本进程删除记录后更新索引"""
+        self._ensure_loaded()
+        with self._lock:
+            self._delete(rowid)
+    
+    def clear(self):
+        """本进程清空历史后清空索引"""
+        self._ensure_loaded()
+        with self._lock:
+            # 日志序号一并清除，下一轮同步时整体重建
+            self._reset()
+    
+    def pick(self, channel=None, orientation=None):
+        """
+        随机选择一张符合条件的图片
+        
+        返回:
+            dict or None - 图片信息，没有符合条件的图片时返回None
+        """
+        self._ensure_loaded()
+        with self._lock:
+            bucket = self._buckets.get((channel or None, orientation or None))
+            if not bucket:
+                return None
+            record = self._records[bucket[random.randrange(len(bucket))]]
+        return self._to_image(record)
+    
+    @staticmethod
+    def _to_image(record):
+        return dict(zip(('id', 'file_name', 'file_url', 'width', 'height', 'channel', 'orientation'), record))
+    
+    def sample(self, channel=None, orientation=None, count=1):
+        """
+        不放回地随机选择多张符合条件的图片
+        
+        参数:
+            count: int - 最多选择的数量，候选不足时返回全部候选
+        
+        返回:
+            list - [(rowid, 图片信息)]，顺序随机
+        """
+        self._ensure_loaded()
+        with self._lock:
+            bucket = self._buckets.get((channel or None, orientation or None))
+            if not bucket:
+                return []
+            rowids = [bucket[i] for i in random.sample(range(len(bucket)), min(count, len(bucket)))]
+            return [(rowid, self._to_image(self._records[rowid])) for rowid in rowids]
+    
+    def _ring(self, key):
+        """桶的哈希环，首次使用时建立"""
+        ring = self._rings.get(key)
+        if ring is None:
+            ring = self._rings[key] = array('Q', sorted(self._points[rowid] for rowid in self._buckets[key]))
+        return ring
+    
+    def pick_seeded(self, seed, channel=None, orientation=None, count=1):
+        """
+        按种子确定地选择图片（一致性哈希）
+        
+        图片和种子都映射到哈希环上，从种子的位置顺时针取最近的 count 张图片。
+        新增图片只会改变落在它与前一张图片之间的种子的结果，删除图片只影响原本选中它的种子。
+        
+        返回:
+            list - 图片信息列表，候选不足时返回全部候选
+        """
+        images, _ = self.pick_after(ring_point(seed) - 1, channel, orientation, count)
+        return images
+    
+    def pick_after(self, point, channel=None, orientation=None, count=1):
+        """
+        从哈希环上的位置 point 之后（不含）顺时针选择 count 张图片
+        
+        返回:
+            (list, int) - 图片信息列表（候选不足时返回全部候选）和最后一张图片在环上的位置；
+                          没有候选时返回 ([], point)
+        """
+        self._ensure_loaded()
+        with self._lock:
+            key = (channel or None, orientation or None)
+            if not self._buckets.get(key):
+                return [], point
+            ring = self._ring(key)
+            start = bisect.bisect_right(ring, point)
+            points = [ring[(start + i) % len(ring)] for i in range(min(count, len(ring)))]
+            return [self._to_image(self._records[self._point_rowids[p]]) for p in points], points[-1]
+    
+    def pick_best_fit(self, width, height, channel=None, orientation=None, count=1):
+        """
+        按屏幕尺寸随机选择图片：优先宽高比接近、分辨率刚好能覆盖屏幕的图片
+        
+        宽高比相差不超过 FIT_MAX_ASPECT_DISTANCE 个桶、分辨率在能覆盖屏幕的最小分辨率之上
+        FIT_LEVEL_BAND 个桶以内的图片都是候选，每偏离一个桶抽取权重乘以 FIT_DISTANCE_WEIGHT，
+        越接近越容易被选中但不会只在少数几张中打转。没有这样的候选时放宽分辨率，
+        按与该区间的距离加权。多张时不放回抽取。
+        
+        返回:
+            list - 图片信息列表；没有尺寸已知的候选时返回空列表
+        """
+        target = fit_bucket(width, height)
+        if target is None:
+            return []
+        aspect = target[0]
+        self._ensure_loaded()
+        with self._lock:
+            fits = self._fits.get((channel or None, orientation or None))
+            if not fits:
+                return []
+            in_band = []
+            outside = []
+            required_levels = {}
+            for (fit_aspect, fit_level), rowids in fits.items():
+                distance = abs(fit_aspect - aspect)
+                if not rowids or distance > FIT_MAX_ASPECT_DISTANCE:
+                    continue
+                if fit_aspect not in required_levels:
+                    required_levels[fit_aspect] = covering_level(fit_aspect, width, height)
+                offset = fit_level - required_levels[fit_aspect]
+                if 0 <= offset <= FIT_LEVEL_BAND:
+                    in_band.append((FIT_DISTANCE_WEIGHT ** (distance + offset), rowids))
+                else:
+                    # 与分辨率区间的距离：分辨率不足时为差几个桶，过大时为超出区间几个桶
+                    gap = -offset if offset < 0 else offset - FIT_LEVEL_BAND
+                    outside.append((FIT_DISTANCE_WEIGHT ** (distance + gap), rowids))
+            groups = in_band or outside
+            if not groups:
+                return []
+            
+            # 按组累计权重（组内每张图片权重相同），先选组再在组内均匀选择
+            cumulative = []
+            total = 0.0
+            size = 0
+            for weight, rowids in groups:
+                total += weight * len(rowids)
+                cumulative.append(total)
+                size += len(rowids)
+            wanted = min(count, size)
+            chosen = {}
+            attempts = 0
+            while len(chosen) < wanted and attempts < wanted * 20:
+                attempts += 1
+                group = min(bisect.bisect_right(cumulative, random.random() * total), len(groups) - 1)
+                rowids = groups[group][1]
+                rowid = rowids[random.randrange(len(rowids))]
+                chosen.setdefault(rowid, None)
+            return [self._to_image(self._records[rowid]) for rowid in chosen]
+    
+    def stats(self):
+        """返回各桶的候选数量"""
+        self._ensure_loaded()
+        with self._lock:
+            return {key: len(bucket) for key, bucket in self._buckets.items()}
+
+random_image_index = RandomImageIndex()
+
+_random_deck_writes = 0
+_random_deck_lock = threading.Lock()
+
+def draw_from_deck(deck, channel=None, orientation=None, count=1):
+    """
+    从牌组中抽取图片：同一牌组（同一筛选条件）在候选全部抽过一轮之前不会重复
+    
+    牌组只保存哈希环上的游标，每次从游标处顺时针取图片并前移游标，
+    绕环一周即所有候选各抽到一次；图片的环上位置由图片id决定，增删图片不影响其他图片。
+    
+    参数:
+        deck: str - 客户端提供的牌组标识
+    
+    返回:
+        list - 图片信息列表
+    """
+    global _random_deck_writes
+    deck_key = '\x00'.join((deck, channel or '', orientation or ''))
+    images = []
+    with get_db_connection() as conn:
+        for _ in range(RANDOM_DECK_MAX_RETRIES):
+            row = conn.execute('SELECT cursor FROM random_decks WHERE deck_key = ?', (deck_key,)).fetchone()
+            # 新牌组从环上的随机位置开始；游标按有符号64位整数保存
+            cursor = row['cursor'] + (1 << 63) if row else random.getrandbits(64)
+            images, end = random_image_index.pick_after(cursor, channel=channel, orientation=orientation, count=count)
+            if not images:
+                return []
+            # 条件更新：同一牌组的并发请求只有一个能前移游标，其余重新读取游标后再抽
+            if row:
+                updated = conn.execute('UPDATE random_decks SET cursor = ?, updated_at = ? WHERE deck_key = ? AND cursor = ?',
+                                       (end - (1 << 63), time.time(), deck_key, row['cursor']))
+            else:
+                updated = conn.execute('INSERT OR IGNORE INTO random_decks (deck_key, cursor, updated_at) VALUES (?, ?, ?)',
+                                       (deck_key, end - (1 << 63), time.time()))
+            conn.commit()
+            if updated.rowcount == 1:
+                break
+    
+    with _random_deck_lock:
+        _random_deck_writes += 1
+        purge = _random_deck_writes % RANDOM_DECK_PURGE_EVERY == 0
+    if purge:
+        with get_db_connection() as conn:
+            conn.execute('DELETE FROM random_decks WHERE updated_at < ?', (time.time() - RANDOM_DECK_TTL,))
+            conn.commit()
+    return images
 
 # 初始化数据库
 init_database()
@@ -294,54 +1280,1475 @@ def add_valid_token(token, created_at, expires_at):
         )
         conn.commit()
 
+# token缓存配置
+TOKEN_CACHE_SIZE = 1024  # 最多缓存的token数量
+TOKEN_CACHE_TTL = 300  # 缓存项最长有效期（秒），到期后重新查询数据库
+TOKEN_GENERATION_CHECK_INTERVAL = 5  # 检查其他worker撤销token的间隔（秒）
+TOKEN_SWEEP_INTERVAL = 600  # 清理过期token的间隔（秒）
+TOKEN_SWEEP_BATCH_SIZE = 500  # 每批删除的过期token数量
+
+class TokenCache:
+    """
+    已验证token的进程内LRU缓存
+    
+    缓存项保存token的 expires_at，过期判断与数据库完全一致；只缓存有效的token。
+    token被撤销时 token_meta.generation 递增，后台线程发现变化后清空缓存，
+    同一线程还负责按 idx_expires_at 分批清理过期token。
+    """
+    
+    def __init__(self, max_size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token -> (expires_at, 缓存失效时间)
+        self._lock = threading.Lock()
+        self._generation = None
+        self._pid = None
+    
+    def _ensure_started(self):
+        """首次使用或fork后的子进程中启动维护线程"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._entries = OrderedDict()
+            self._generation = None
+            self._pid = os.getpid()
+        threading.Thread(target=self._maintenance_loop, name='token-maintenance', daemon=True).start()
+    
+    def _maintenance_loop(self):
+        last_sweep = 0
+        while True:
+            try:
+                self.check_generation()
+                if time.time() - last_sweep >= TOKEN_SWEEP_INTERVAL:
+                    last_sweep = time.time()
+                    sweep_expired_tokens()
+            except Exception as e:
+                logger.error(f"token缓存维护失败: {str(e)}")
+            time.sleep(TOKEN_GENERATION_CHECK_INTERVAL)
+    
+    def check_generation(self):
+        """token被撤销（包括其他worker撤销）时清空缓存"""
+        with get_db_connection() as conn:
+            generation = conn.execute('SELECT generation FROM token_meta WHERE id = 1').fetchone()[0]
+        with self._lock:
+            if self._generation is not None and generation != self._generation:
+                self._entries.clear()
+            self._generation = generation
+    
+    def get(self, token, now):
+        """
+        查询缓存
+        
+        返回:
+            bool or None - 命中时返回token是否有效，未命中返回None
+        """
+        self._ensure_started()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            expires_at, cached_until = entry
+            if expires_at <= now:
+                del self._entries[token]
+                return False
+            if cached_until <= now:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return True
+    
+    def put(self, token, expires_at, now):
+        """缓存一个已验证有效的token"""
+        self._ensure_started()
+        with self._lock:
+            self._entries[token] = (expires_at, min(expires_at, now + self.ttl))
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def discard(self, token):
+        """从缓存中移除token"""
+        with self._lock:
+            self._entries.pop(token, None)
+
+token_cache = TokenCache()
+
+def sweep_expired_tokens(batch_size=TOKEN_SWEEP_BATCH_SIZE):
+    """分批删除过期token，返回删除的数量"""
+    deleted = 0
+    while True:
+        with get_db_connection() as conn:
+            cursor = conn.execute(
+                'DELETE FROM valid_tokens WHERE token IN '
+                '(SELECT token FROM valid_tokens WHERE expires_at <= ? LIMIT ?)',
+                (time.time(), batch_size)
+            )
+            conn.commit()
+        deleted += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            break
+    if deleted:
+        logger.info(f"已清理 {deleted} 个过期token")
+    return deleted
+
 def verify_token(token):
     """验证token是否有效"""
     if not token:
         return False
     
     current_time = time.time()
+    cached = token_cache.get(token, current_time)
+    if cached is not None:
+        return cached
+    
     with get_db_connection() as conn:
         cursor = conn.execute(
             'SELECT expires_at FROM valid_tokens WHERE token = ?',
             (token,)
         )
         row = cursor.fetchone()
-        if row:
-            # 检查是否过期
-            if row['expires_at'] > current_time:
-                return True
-            else:
-                # 已过期，删除该token
-                conn.execute('DELETE FROM valid_tokens WHERE token = ?', (token,))
-                conn.commit()
+    # 过期的token不在请求路径中删除，由后台线程批量清理
+    if row and row['expires_at'] > current_time:
+        token_cache.put(token, row['expires_at'], current_time)
+        return True
     return False
 
+def revoke_token(token):
+    """撤销token，返回是否撤销成功"""
+    with get_db_connection() as conn:
+        # 删除触发器会递增 token_meta.generation，其他worker随后清空缓存
+        cursor = conn.execute('DELETE FROM valid_tokens WHERE token = ?', (token,))
+        conn.commit()
+    token_cache.discard(token)
+    return cursor.rowcount > 0
+
 # 初始化验证配置
 init_verification_config()
 
-@app.route('/api/random')
-def random_image():
+# ==================== 上传文件接收 ====================
+
+SPOOL_MAX_MEMORY = 2 * 1024 * 1024  # 小于该大小的文件只保存在内存中
+SNIFF_HEADER_SIZE = 64  # 保留的文件头字节数，用于识别图片类型
+SNIFF_MIN_SIZE = 12  # 识别图片类型至少需要的字节数（WEBP需要检查第8-12字节）
+INGEST_CHUNK_SIZE = 64 * 1024
+URL_DOWNLOAD_MAX_SIZE = int(os.environ.get('URL_DOWNLOAD_MAX_SIZE', 50 * 1024 * 1024))  # 链接上传的最大下载大小（字节）
+
+# 图片魔术字节 -> (content_type, 扩展名)，WEBP 需要额外检查第8-12字节
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg', '.jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png', '.png'),
+    (b'GIF8', 'image/gif', '.gif'),
+    (b'RIFF', 'image/webp', '.webp'),
+    (b'BM', 'image/bmp', '.bmp'),
+)
+
+def sniff_image_type(header):
     """
-    随机图片接口
-    
-    查询参数:
-        channel: 可选，指定渠道 (miyoushe, chatglm, jd)
-        w: 可选，设备屏幕宽度
-        h: 可选，设备屏幕高度
-        orientation: 可选，指定方向 (landscape=横屏, portrait=竖屏, auto=自动检测[默认])
-        type: 可选，返回类型 (redirect=302重定向, json=返回JSON)
-        q: 可选，图片质量 (0=原图[默认], 1=压缩图)
+    根据文件头的魔术字节识别图片类型
+    
+    返回:
+        tuple or None - (content_type, 扩展名)，不是支持的图片格式时返回None
+    """
+    for signature, content_type, extension in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            if signature == b'RIFF' and len(header) >= 12 and header[8:12] != b'WEBP':
+                return None
+            return content_type, extension
+    return None
+
+# 支持的图片格式 -> (content_type, 扩展名)
+SUPPORTED_IMAGE_FORMATS = {
+    'jpeg': ('image/jpeg', '.jpg'),
+    'png': ('image/png', '.png'),
+    'gif': ('image/gif', '.gif'),
+    'webp': ('image/webp', '.webp'),
+    'bmp': ('image/bmp', '.bmp'),
+}
+
+PROBE_HEADER_SIZE = 32  # 除JPEG外，尺寸都在文件前32字节内
+PROBE_JPEG_MAX_SEGMENTS = 64  # JPEG最多跳过的标记段数，超过后交给PIL处理
+
+# JPEG中带有图像尺寸的SOF标记（排除DHT=C4、JPG=C8、DAC=CC）
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def _probe_jpeg_size(stream):
+    """逐段跳过JPEG标记，读取SOF段中的宽高；stream 已定位到SOI之后"""
+    for _ in range(PROBE_JPEG_MAX_SEGMENTS):
+        byte = stream.read(1)
+        if byte != b'\xff':
+            return None
+        marker = stream.read(1)
+        while marker == b'\xff':  # 填充字节
+            marker = stream.read(1)
+        if not marker:
+            return None
+        marker = marker[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # 没有长度字段的标记
+            continue
+        length_bytes = stream.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = int.from_bytes(length_bytes, 'big')
+        if marker in JPEG_SOF_MARKERS:
+            data = stream.read(5)
+            if len(data) < 5:
+                return None
+            return int.from_bytes(data[3:5], 'big'), int.from_bytes(data[1:3], 'big')
+        if length < 2:
+            return None
+        stream.seek(length - 2, 1)
+    return None
+
+def probe_image(stream):
+    """
+    只读取文件头识别图片格式和尺寸，不经过PIL
+    
+    参数:
+        stream: 可随机读取的二进制文件对象，读取后会重新定位到开头
+    
+    返回:
+        dict or None - 与 validate_image 相同的图片信息，无法识别时返回None（由PIL兜底）
+    """
+    stream.seek(0)
+    try:
+        head = stream.read(PROBE_HEADER_SIZE)
+        image_format = None
+        size = None
+        if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+            image_format = 'png'
+            size = int.from_bytes(head[16:20], 'big'), int.from_bytes(head[20:24], 'big')
+        elif head.startswith(b'\xff\xd8'):
+            image_format = 'jpeg'
+            stream.seek(2)
+            size = _probe_jpeg_size(stream)
+        elif head[:6] in (b'GIF87a', b'GIF89a') and len(head) >= 10:
+            image_format = 'gif'
+            size = int.from_bytes(head[6:8], 'little'), int.from_bytes(head[8:10], 'little')
+        elif head.startswith(b'RIFF') and head[8:12] == b'WEBP' and len(head) >= 30:
+            image_format = 'webp'
+            chunk = head[12:16]
+            if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+                size = int.from_bytes(head[26:28], 'little') & 0x3FFF, int.from_bytes(head[28:30], 'little') & 0x3FFF
+            elif chunk == b'VP8L' and head[20] == 0x2F:
+                bits = int.from_bytes(head[21:25], 'little')
+                size = (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            elif chunk == b'VP8X':
+                size = int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1
+        elif head.startswith(b'BM') and len(head) >= 26:
+            image_format = 'bmp'
+            dib_size = int.from_bytes(head[14:18], 'little')
+            if dib_size == 12:  # OS/2 BITMAPCOREHEADER
+                size = int.from_bytes(head[18:20], 'little'), int.from_bytes(head[20:22], 'little')
+            elif dib_size >= 40:
+                # 高度为负数表示自上而下存储的位图
+                size = (int.from_bytes(head[18:22], 'little', signed=True),
+                        abs(int.from_bytes(head[22:26], 'little', signed=True)))
+    finally:
+        stream.seek(0)
+    
+    if not size or size[0] <= 0 or size[1] <= 0:
+        return None
+    content_type, extension = SUPPORTED_IMAGE_FORMATS[image_format]
+    return {
+        'content_type': content_type,
+        'width': size[0],
+        'height': size[1],
+        'format': image_format,
+        'extension': extension
+    }
+
+class IngestSpool(tempfile.SpooledTemporaryFile):
+    """
+    边写入边计算哈希的临时文件
+    
+    小文件只保存在内存中，超过 SPOOL_MAX_MEMORY 后转存到 DATA_DIR 下的临时文件。
+    写入完成后即可得到 MD5/SHA-256、文件大小和文件头，无需再次读取文件。
+    只支持顺序追加写入。
+    """
+    
+    def __init__(self):
+        super().__init__(max_size=SPOOL_MAX_MEMORY, dir=DATA_DIR)
+        SPOOL_FILES.add(1, storage='memory')
+        self._counted = True
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.header = b''
+        # 从链接下载时源站返回的缓存校验信息
+        self.etag = None
+        self.last_modified = None
+    
+    def write(self, data):
+        self._md5.update(data)
+        self._sha256.update(data)
+        if len(self.header) < SNIFF_HEADER_SIZE:
+            self.header += bytes(data[:SNIFF_HEADER_SIZE - len(self.header)])
+        self.size += len(data)
+        return super().write(data)
+    
+    def rollover(self):
+        rolled = self._rolled
+        super().rollover()
+        if not rolled and self._counted:
+            SPOOL_FILES.add(-1, storage='memory')
+            SPOOL_FILES.add(1, storage='disk')
+    
+    def close(self):
+        if self._counted:
+            self._counted = False
+            SPOOL_FILES.add(-1, storage='disk' if self._rolled else 'memory')
+        super().close()
+    
+    @property
+    def md5(self):
+        return self._md5.hexdigest()
+    
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+def ingest_chunks(chunks):
+    """将数据块依次写入新的 IngestSpool，返回定位到开头的spool"""
+    spool = IngestSpool()
+    try:
+        for chunk in chunks:
+            if chunk:
+                spool.write(chunk)
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+def download_to_spool(response, max_size=URL_DOWNLOAD_MAX_SIZE):
+    """
+    将流式响应（stream=True）写入新的 IngestSpool，返回定位到开头的spool
+    
+    Content-Length 超过上限时不读取响应体；接收过程中累计大小超过上限，
+    或收到的文件头不是支持的图片格式时立即中止，内存中最多只保留几个数据块。
+    
+    异常:
+        UploadError - 超出大小限制或不是图片
+    """
+    max_size_mb = max_size / (1024 * 1024)
+    try:
+        content_length = response.headers.get('Content-Length', '')
+        if content_length.isdigit() and int(content_length) > max_size:
+            raise UploadError(f'图片大小 {int(content_length) / (1024 * 1024):.2f}MB 超出限制 {max_size_mb:.0f}MB')
+        
+        spool = IngestSpool()
+        try:
+            sniffed = False
+            for chunk in response.iter_content(chunk_size=INGEST_CHUNK_SIZE):
+                if not chunk:
+                    continue
+                if spool.size + len(chunk) > max_size:
+                    raise UploadError(f'图片大小超出限制 {max_size_mb:.0f}MB')
+                spool.write(chunk)
+                if not sniffed and len(spool.header) >= SNIFF_MIN_SIZE:
+                    if not sniff_image_type(spool.header):
+                        raise UploadError('链接内容不是有效的图片')
+                    sniffed = True
+            if spool.size and not sniffed and not sniff_image_type(spool.header):
+                raise UploadError('链接内容不是有效的图片')
+        except Exception:
+            spool.close()
+            raise
+    finally:
+        response.close()
+    spool.seek(0)
+    return spool
+
+class IngestRequest(Request):
+    """上传的文件直接写入 IngestSpool，在接收请求体的同时完成哈希计算"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return IngestSpool()
+
+app.request_class = IngestRequest
+
+class ValidatedFile:
+    """通过验证的上传文件信息，传递给各上传渠道"""
+    
+    def __init__(self, filename, img_info, spool):
+        self.filename = filename
+        self.content_type = img_info['content_type']
+        self.width = img_info['width']
+        self.height = img_info['height']
+        self.extension = img_info['extension']
+        self.format = img_info.get('format')
+        self.size = spool.size
+        self.md5 = spool.md5
+        self.sha256 = spool.sha256
+
+def lookup_duplicate_upload(uploader, spool, optimize=None):
+    """
+    查找该渠道是否已按相同的压缩选项上传过相同内容，并记录去重命中率
+    
+    返回:
+        dict or None - 命中时返回可直接响应的结果，否则返回None
+    """
+    channel = uploader.get_channel_name()
+    # 自动选择渠道时，任一渠道已保存过该内容即可直接使用
+    channels = list(channel_manager.get_all_channels()) if channel == channel_manager.AUTO_CHANNEL else [channel]
+    existing = find_upload_by_hash(channels, spool.sha256, optimize_fingerprint(optimize))
+    increment_stat('dedup_hit' if existing else 'dedup_miss')
+    if not existing:
+        return None
+    logger.info(f"内容已上传过，直接返回: 渠道={existing['channel']}, URL={existing['file_url']}")
+    result = {
+        'file_url': existing['file_url'],
+        'width': existing['width'],
+        'height': existing['height'],
+        'deduplicated': True
+    }
+    if channel == channel_manager.AUTO_CHANNEL:
+        result['channel'] = existing['channel']
+    return result
+
+class UploadError(Exception):
+    """上传流程中可以直接返回给客户端的错误"""
+    
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+def resolve_uploader(channel):
+    """获取指定的上传渠道，渠道不存在时使用默认渠道"""
+    uploader = channel_manager.get_channel(channel)
+    if not uploader:
+        uploader = channel_manager.get_default_channel()
+        logger.warning(f"渠道 {channel} 不存在，使用默认渠道 {uploader.get_channel_name()}")
+    return uploader
+
+def upload_spool(spool, file_name, uploader, img_info=None, optimize=None):
+    """
+    将已接收的文件去重、验证后上传到指定渠道
+    
+    参数:
+        spool: IngestSpool - 已写入完整文件内容的spool
+        file_name: str - 文件名
+        uploader: BaseChannel - 上传渠道
+        img_info: dict - 可选，已验证过的图片信息，传入时跳过验证
+        optimize: dict - 可选，上传前的压缩/转码选项（见 resolve_optimize_options）
+    
+    返回:
+        tuple - (返回给客户端的结果, 待保存的历史记录；去重命中时为None)
+    
+    异常:
+        UploadError - 图片无效、超出大小限制或渠道上传失败
+    """
+    # 相同内容已上传到该渠道时直接返回，不再访问外部网络
+    duplicate = lookup_duplicate_upload(uploader, spool, optimize)
+    if duplicate:
+        return duplicate, None
+    
+    validated_file = prepare_upload(spool, file_name, uploader, img_info, optimize)
+    return dispatch_upload(spool, validated_file, uploader, optimize)
+
+def prepare_upload(spool, file_name, uploader, img_info=None, optimize=None):
+    """
+    验证图片并检查渠道的大小限制（需要压缩/转码时在处理后检查）
+    
+    返回:
+        ValidatedFile - 传递给上传渠道的文件信息
+    
+    异常:
+        UploadError - 图片无效或超出大小限制
+    """
+    validated_file = validate_upload(spool, file_name, img_info)
+    
+    # 检查文件大小限制
+    if not optimize:
+        check_upload_size(spool, validated_file, uploader)
+    
+    return validated_file
+
+def validate_upload(spool, file_name, img_info=None):
+    """
+    验证图片，img_info 不为空时视为已验证
+    
+    返回:
+        ValidatedFile - 传递给上传渠道的文件信息
+    
+    异常:
+        UploadError - 图片无效
+    """
+    if img_info is None:
+        # 先根据文件头快速排除非图片，再验证图片并获取正确的content_type和尺寸信息
+        img_info = validate_image(spool, file_name) if sniff_image_type(spool.header) else None
+        if not img_info:
+            logger.warning(f"图片验证失败: {file_name}")
+            raise UploadError('无效的图片文件，请确保提供支持的图片格式：JPG, PNG, GIF, BMP, WEBP')
+        logger.info(f"图片验证通过: {file_name}, 尺寸: {img_info['width']}x{img_info['height']}, 格式: {img_info['format']}")
+    
+    # 创建包含验证后信息的文件对象
+    return ValidatedFile(file_name, img_info, spool)
+
+def check_upload_size(spool, validated_file, uploader):
+    """检查文件是否超出渠道的大小限制"""
+    size_ok, size_error = uploader.check_file_size(spool.size)
+    if not size_ok:
+        logger.warning(f"文件大小超出限制: {validated_file.filename}, {spool.size / (1024 * 1024):.2f}MB, 渠道: {uploader.get_channel_name()}")
+        raise UploadError(size_error)
+
+def dispatch_upload(spool, validated_file, uploader, optimize=None):
+    """
+    将已验证的文件（按选项压缩/转码后）上传到渠道
+    
+    返回:
+        tuple - (返回给客户端的结果, 待保存的历史记录)
+    
+    异常:
+        UploadError - 超出大小限制或渠道上传失败
+    """
+    # 缩略图在子进程中生成，与压缩和渠道上传同时进行
+    thumbnail = submit_thumbnail(spool, validated_file)
+    optimized = optimize_upload(spool, validated_file, optimize) if optimize else None
+    if optimized:
+        stored_spool, stored_file = optimized
+    else:
+        stored_spool, stored_file = spool, validated_file
+    try:
+        if optimize:
+            check_upload_size(stored_spool, stored_file, uploader)
+        result = _upload_to_channel(stored_spool, stored_file, uploader)
+    except Exception:
+        if thumbnail:
+            thumbnail.cancel()
+        raise
+    finally:
+        if optimized:
+            stored_spool.close()
+    if thumbnail:
+        save_thumbnail(spool.sha256, thumbnail)
+    # 自动选择渠道时结果中带有实际使用的渠道
+    return result, build_history_item(spool, stored_file, result, result.get('channel') or uploader.get_channel_name(),
+                                      optimize)
+
+def build_history_item(spool, stored_file, result, channel, optimize=None):
+    """
+    构建待保存的上传历史
+    
+    参数:
+        spool: IngestSpool - 原图内容
+        stored_file: ValidatedFile - 实际上传的文件（压缩/转码后的文件或原图）
+        result: dict - 渠道返回的结果
+        channel: str - 渠道名称
+        optimize: dict - 可选，上传前的压缩/转码选项
+    """
+    history_item = {
+        'id': str(uuid.uuid4()),
+        'file_name': stored_file.filename,
+        'file_url': result['file_url'],
+        'width': result.get('width', stored_file.width),
+        'height': result.get('height', stored_file.height),
+        'file_size': stored_file.size,
+        'channel': channel,
+        'upload_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        # 去重按原图内容和压缩选项计算，同一张原图不会因压缩结果不同而重复上传
+        'content_hash': spool.sha256,
+        'optimize_key': optimize_fingerprint(optimize)
+    }
+    if stored_file.sha256 != spool.sha256:
+        history_item['original_size'] = spool.size
+    return history_item
+
+def _upload_to_channel(spool, validated_file, uploader):
+    """调用渠道上传，返回渠道结果"""
+    channel = uploader.get_channel_name()
+    file_name = validated_file.filename
+    
+    logger.info(f"开始上传到渠道: {channel}")
+    spool.seek(0)
+    result = channel_manager.upload(uploader, spool, validated_file)
+    if not result:
+        logger.error(f"上传失败: 文件={file_name}, 渠道={channel}, 原因=渠道返回空结果")
+        raise UploadError(f'上传到{channel}失败，请检查渠道配置或稍后重试', 500)
+    
+    logger.info(f"上传成功: 文件={file_name}, 渠道={channel}, URL={result['file_url']}")
+    return result
+
+# ==================== 上传前压缩/转码 ====================
+
+# 转码后可能输出的格式（AVIF 需要安装 pillow-avif-plugin）
+OUTPUT_IMAGE_FORMATS = dict(SUPPORTED_IMAGE_FORMATS, avif=('image/avif', '.avif'))
+OPTIMIZE_WORKERS = int(os.environ.get('OPTIMIZE_WORKERS', '2'))  # 每个worker进程中执行压缩的子进程数
+OPTIMIZE_TIMEOUT = 60  # 单张图片压缩的最长等待时间（秒），超时上传原图
+OPTIMIZE_MAX_PIXELS = 50000000  # 像素数超过该值的图片不处理，避免子进程占用过多内存
+OPTIMIZE_DISABLED = 'none'  # 请求中用于关闭渠道默认压缩方案的取值
+
+class ImageOptimizerPool:
+    """
+    执行压缩/转码的进程池
+    
+    编码是CPU密集的操作，放在子进程中执行，不占用处理HTTP请求的线程持有的GIL。
+    使用 spawn 方式创建子进程（请求线程中fork多线程的进程不安全），子进程只导入 image_optimizer。
+    首次使用时创建，fork出的worker进程中重新创建；子进程异常退出后下次使用时重建。
+    """
+    
+    def __init__(self, workers=OPTIMIZE_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=image_optimizer.init_worker, initargs=(os.getpid(),)
+                )
+                self._pid = os.getpid()
+            return self._executor
+    
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    def submit(self, func, *args):
+        """提交到子进程执行，返回 Future；子进程异常退出时重建进程池后抛出 BrokenProcessPool"""
+        executor = self._get_executor()
+        try:
+            future = executor.submit(func, *args)
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise
+        future.add_done_callback(lambda f: self._on_done(executor, f))
+        return future
+    
+    def _on_done(self, executor, future):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._reset(executor)
+    
+    def run(self, data, image_format, options):
+        """在子进程中执行 image_optimizer.optimize_image_bytes，返回其结果"""
+        future = self.submit(image_optimizer.optimize_image_bytes, data, image_format, options)
+        return future.result(timeout=OPTIMIZE_TIMEOUT)
+
+image_optimizer_pool = ImageOptimizerPool()
+
+def resolve_optimize_options(profile, max_dimension, uploader):
+    """
+    解析请求中的压缩/转码参数
+    
+    参数:
+        profile: str - 压缩方案名称，为空时使用渠道默认方案，'none' 表示不处理
+        max_dimension: str or int - 可选，长边最大像素数，超过时等比缩小
+        uploader: BaseChannel - 上传渠道，为None时没有默认方案（多渠道上传）
+    
+    返回:
+        dict or None - 传递给 image_optimizer 的选项，不需要处理时返回None
+    
+    异常:
+        UploadError - 参数无效或当前环境不支持该格式
+    """
+    requested = (profile or '').strip().lower()
+    profile = requested or (uploader.get_optimize_profile() if uploader else None)
+    if profile == OPTIMIZE_DISABLED:
+        profile = None
+    
+    if max_dimension not in (None, ''):
+        try:
+            max_dimension = int(max_dimension)
+        except (TypeError, ValueError):
+            raise UploadError('max_dimension 必须是正整数')
+        if max_dimension <= 0:
+            raise UploadError('max_dimension 必须是正整数')
+    else:
+        max_dimension = None
+    
+    if not profile and not max_dimension:
+        return None
+    # 只限制尺寸时保持原格式
+    options = dict(image_optimizer.OPTIMIZE_PROFILES.get(profile or 'lossless') or {})
+    if not options:
+        raise UploadError(f"不支持的压缩方案: {profile}，可选: {', '.join(image_optimizer.OPTIMIZE_PROFILES)}")
+    if options['format'] and not image_optimizer.is_format_supported(options['format']):
+        if requested:
+            raise UploadError(f"当前环境不支持 {options['format'].upper()} 编码")
+        # 渠道默认方案不可用时上传原图，不影响上传
+        logger.warning(f"当前环境不支持 {options['format'].upper()} 编码，渠道 {uploader.get_channel_name()} 的默认压缩方案不生效")
+        return None
+    options['profile'] = profile or 'lossless'
+    options['max_dimension'] = max_dimension
+    return options
+
+def optimize_fingerprint(options):
+    """
+    压缩/转码选项的标识，作为内容去重和链接缓存键的一部分
+    
+    返回:
+        str - 不处理时为空字符串，否则为 "方案:长边上限"
+    """
+    if not options:
+        return ''
+    return f"{options['profile']}:{options['max_dimension'] or ''}"
+
+def optimize_upload(spool, validated_file, options):
+    """
+    按选项压缩/转码图片
+    
+    返回:
+        tuple or None - (新的spool, 新的ValidatedFile)；无需处理、结果不比原图小或处理失败时返回None，上传原图
+    """
+    if validated_file.width * validated_file.height > OPTIMIZE_MAX_PIXELS:
+        logger.info(f"图片像素过多，跳过压缩: {validated_file.filename}, {validated_file.width}x{validated_file.height}")
+        return None
+    
+    spool.seek(0)
+    data = spool.read()
+    start = time.time()
+    try:
+        output = image_optimizer_pool.run(data, validated_file.format, options)
+    except Exception as e:
+        logger.warning(f"图片压缩失败，上传原图: {validated_file.filename}, 方案={options['profile']}, 错误: {str(e)}")
+        return None
+    if not output:
+        return None
+    
+    content, image_format, width, height = output
+    content_type, extension = OUTPUT_IMAGE_FORMATS[image_format]
+    file_name = validated_file.filename
+    if image_format != validated_file.format:
+        file_name = os.path.splitext(file_name)[0] + extension
+    new_spool = ingest_chunks([content])
+    img_info = {
+        'content_type': content_type,
+        'width': width,
+        'height': height,
+        'format': image_format,
+        'extension': extension
+    }
+    logger.info(
+        f"图片压缩完成: {validated_file.filename} -> {file_name}, 方案={options['profile']}, "
+        f"{spool.size} -> {new_spool.size} 字节, 耗时 {time.time() - start:.2f}s"
+    )
+    increment_stat('optimize_bytes_saved', spool.size - new_spool.size)
+    return new_spool, ValidatedFile(file_name, img_info, new_spool)
+
+# ==================== 缩略图缓存 ====================
+
+THUMB_DIR = os.path.join(DATA_DIR, 'thumbs')  # 缩略图文件，按原图内容哈希命名
+THUMB_MAX_SIZE = 400  # 缩略图长边像素数（约为历史页网格宽度的2倍，适配高分屏）
+THUMB_QUALITY = 75  # 缩略图编码质量
+THUMB_CACHE_MAX_BYTES = int(os.environ.get('THUMB_CACHE_MAX_MB', '256')) * 1024 * 1024  # 缓存总大小上限，为0时不生成缩略图
+THUMB_EVICT_EVERY = 50  # 每写入多少张缩略图检查一次总大小
+THUMB_TOUCH_INTERVAL = 3600  # 记录缩略图使用时间的最小间隔，避免每次访问都写数据库（秒）
+THUMB_HTTP_MAX_AGE = 365 * 24 * 3600  # 浏览器缓存缩略图的时间（秒），同一记录的缩略图内容不会变化
+THUMB_HINT_MAX_SIZE = 2048  # 客户端传递的缩略图显示尺寸上限
+
+_thumb_writes = 0
+_thumb_lock = threading.Lock()
+
+if not os.path.exists(THUMB_DIR):
+    os.makedirs(THUMB_DIR)
+
+def thumbnail_path(content_hash, image_format):
+    """缩略图文件路径，按哈希前两位分目录，避免单个目录下文件过多"""
+    return os.path.join(THUMB_DIR, content_hash[:2], content_hash + OUTPUT_IMAGE_FORMATS[image_format][1])
+
+def submit_thumbnail(spool, validated_file):
+    """
+    提交缩略图生成任务
+    
+    返回:
+        Future or None - 已有该内容的缩略图、未启用或图片过大时返回None
+    """
+    if not THUMB_CACHE_MAX_BYTES or validated_file.width * validated_file.height > OPTIMIZE_MAX_PIXELS:
+        return None
+    try:
+        with get_db_connection() as conn:
+            if conn.execute('SELECT 1 FROM thumbnails WHERE content_hash = ?', (spool.sha256,)).fetchone():
+                return None
+        spool.seek(0)
+        return image_optimizer_pool.submit(image_optimizer.create_thumbnail, spool.read(), THUMB_MAX_SIZE, THUMB_QUALITY)
+    except Exception as e:
+        logger.warning(f"提交缩略图任务失败: {validated_file.filename}, 错误: {str(e)}")
+        return None
+
+def save_thumbnail(content_hash, future):
+    """等待缩略图生成完成并写入缓存，失败时只记录日志"""
+    global _thumb_writes
+    try:
+        content, image_format = future.result(timeout=OPTIMIZE_TIMEOUT)
+        path = thumbnail_path(content_hash, image_format)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换，读取方不会读到写了一半的文件
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        with get_db_connection() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO thumbnails (content_hash, format, size, last_used) VALUES (?, ?, ?, ?)',
+                (content_hash, image_format, len(content), time.time())
+            )
+            conn.commit()
+    except Exception as e:
+        logger.warning(f"生成缩略图失败: {content_hash}, 错误: {str(e)}")
+        return
+    
+    with _thumb_lock:
+        _thumb_writes += 1
+        if _thumb_writes % THUMB_EVICT_EVERY:
+            return
+    evict_thumbnails()
+
+def get_thumbnail(content_hash):
+    """
+    查找缩略图并记录使用时间
+    
+    返回:
+        tuple or None - (文件路径, 格式)，不存在时返回None
+    """
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT format, last_used FROM thumbnails WHERE content_hash = ?', (content_hash,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row['last_used'] >= THUMB_TOUCH_INTERVAL:
+            conn.execute('UPDATE thumbnails SET last_used = ? WHERE content_hash = ?', (now, content_hash))
+            conn.commit()
+    return thumbnail_path(content_hash, row['format']), row['format']
+
+def history_thumbnail_url(item, has_thumb, thumb_size=None):
+    """
+    上传记录的缩略图地址
+    
+    参数:
+        item: dict - 包含 id, file_url, width, height, channel 的上传记录
+        has_thumb: bool - 是否有本地缩略图
+        thumb_size: (宽, 高) - 客户端的缩略图显示尺寸（已乘以设备像素比），None 表示未知
+    
+    返回:
+        str or None - 本地缩略图能满足显示尺寸时使用本地缩略图，否则请求渠道图床缩放；
+                      都不可用时返回None，由前端使用原图
+    """
+    local_url = f"/thumb/{item['id']}" if has_thumb else None
+    if local_url and (not thumb_size or max(thumb_size) <= THUMB_MAX_SIZE):
+        return local_url
+    transformed = transform_image_url(item['file_url'], item['channel'], image_size=(item['width'], item['height']),
+                                      target_size=thumb_size, max_size=None if thumb_size else THUMB_MAX_SIZE,
+                                      image_format='webp', quality=THUMB_QUALITY)
+    return transformed or local_url
+
+def remove_thumbnail(content_hash, image_format):
+    """删除缩略图记录和文件"""
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM thumbnails WHERE content_hash = ?', (content_hash,))
+        conn.commit()
+    try:
+        os.remove(thumbnail_path(content_hash, image_format))
+    except FileNotFoundError:
+        pass
+
+def evict_thumbnails():
+    """总大小超过 THUMB_CACHE_MAX_BYTES 时，按最近使用时间淘汰到上限的90%"""
+    with get_db_connection() as conn:
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM thumbnails').fetchone()[0]
+        if total <= THUMB_CACHE_MAX_BYTES:
+            return
+        target = total - THUMB_CACHE_MAX_BYTES * 0.9
+        evicted = []
+        for row in conn.execute('SELECT content_hash, format, size FROM thumbnails ORDER BY last_used'):
+            if target <= 0:
+                break
+            evicted.append((row['content_hash'], row['format']))
+            target -= row['size']
+    for content_hash, image_format in evicted:
+        remove_thumbnail(content_hash, image_format)
+    logger.info(f"淘汰缩略图: {len(evicted)} 张, 淘汰前总大小 {total / (1024 * 1024):.1f}MB")
+
+# ==================== 多渠道并发上传 ====================
+
+# race: 返回最先成功的渠道，取消其余渠道；mirror: 等待所有渠道，其他渠道的链接作为镜像保存
+FANOUT_MODES = ('race', 'mirror')
+FANOUT_WORKERS = 8  # 执行多渠道上传的线程数（所有请求共享）
+FANOUT_TIMEOUT = 120  # 等待各渠道上传结果的最长时间（秒）
+FANOUT_STATS_WINDOW = 7 * 24 * 3600  # /api/stats 中汇总各渠道结果的时间范围（秒）
+FANOUT_RETENTION = 30 * 24 * 3600  # 各渠道结果记录的保留时间（秒）
+FANOUT_PURGE_EVERY = 200  # 每记录多少条结果清理一次过期记录
+
+_fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout-upload')
+_channel_upload_writes = 0
+_channel_upload_lock = threading.Lock()
+
+def resolve_fanout_request(mode, channels):
+    """
+    解析请求中的多渠道上传参数
+    
+    参数:
+        mode: str - 上传模式，为空时表示单渠道上传
+        channels: str or list - 逗号分隔的渠道名或渠道名列表，为空时使用所有已注册的渠道
+    
+    返回:
+        tuple - (模式, 渠道实例列表)；单渠道上传时返回 (None, None)
+    
+    异常:
+        UploadError - 模式无效或渠道不存在
+    """
+    mode = (mode or '').strip().lower()
+    if not mode:
+        return None, None
+    if mode not in FANOUT_MODES:
+        raise UploadError(f"不支持的上传模式: {mode}，可选: {', '.join(FANOUT_MODES)}")
+    
+    if isinstance(channels, str):
+        names = channels.split(',')
+    elif isinstance(channels, list):
+        names = [str(name) for name in channels]
+    elif channels is None:
+        names = []
+    else:
+        raise UploadError('无效的渠道列表')
+    # 去重并保持顺序，顺序决定镜像模式下的主链接
+    names = [name for name in dict.fromkeys(name.strip() for name in names) if name]
+    if not names:
+        names = list(channel_manager.get_all_channels())
+    unknown = [name for name in names if name not in channel_manager.get_all_channels()]
+    if unknown:
+        raise UploadError(f"渠道不存在: {', '.join(unknown)}")
+    return mode, [channel_manager.get_channel(name) for name in names]
+
+def record_channel_upload(group_id, mode, channel, outcome):
+    """记录多渠道上传中一个渠道的结果，并定期清理过期记录"""
+    global _channel_upload_writes
+    with get_db_connection() as conn:
+        conn.execute('''
+            INSERT INTO channel_uploads (group_id, mode, channel, status, duration, file_url, error, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (group_id, mode, channel, outcome['status'], outcome.get('duration'), outcome.get('file_url'),
+              outcome.get('error'), time.time()))
+        conn.commit()
+    
+    with _channel_upload_lock:
+        _channel_upload_writes += 1
+        if _channel_upload_writes % FANOUT_PURGE_EVERY:
+            return
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM channel_uploads WHERE created_at < ?', (time.time() - FANOUT_RETENTION,))
+        conn.commit()
+
+def get_channel_upload_stats():
+    """
+    汇总最近 FANOUT_STATS_WINDOW 内多渠道上传中各渠道的结果
+    
+    返回:
+        dict - {渠道名: {attempts, succeeded, failed, cancelled, success_rate, avg_duration}}
+    """
+    with get_db_connection() as conn:
+        rows = conn.execute('''
+            SELECT channel, COUNT(*) AS attempts,
+                   SUM(status = 'succeeded') AS succeeded,
+                   SUM(status = 'failed') AS failed,
+                   SUM(status = 'cancelled') AS cancelled,
+                   AVG(CASE WHEN status = 'succeeded' THEN duration END) AS avg_duration
+            FROM channel_uploads WHERE created_at >= ? GROUP BY channel
+        ''', (time.time() - FANOUT_STATS_WINDOW,)).fetchall()
+    stats = {}
+    for row in rows:
+        finished = row['succeeded'] + row['failed']
+        stats[row['channel']] = {
+            'attempts': row['attempts'],
+            'succeeded': row['succeeded'],
+            'failed': row['failed'],
+            'cancelled': row['cancelled'],
+            'success_rate': round(row['succeeded'] / finished, 4) if finished else 0,
+            'avg_duration': round(row['avg_duration'], 3) if row['avg_duration'] is not None else None
+        }
+    return stats
+
+def _fanout_attempt(uploader, data, validated_file, event):
+    """在上传线程中执行一个渠道的上传，返回 (渠道结果, 耗时)"""
+    start = time.time()
+    with cancel_scope(event):
+        result = channel_manager.upload(uploader, io.BytesIO(data), validated_file)
+    return result, time.time() - start
+
+def fanout_upload(spool, file_name, uploaders, mode, img_info=None, optimize=None):
+    """
+    同时上传到多个渠道
+    
+    文件只验证和压缩一次，各渠道读取同一份内容。race 模式在第一个渠道成功后立即返回，
+    尚未开始的渠道不再执行，正在上传的渠道在下一个HTTP请求前停止；mirror 模式等待所有渠道完成。
+    各渠道的结果和耗时记录在 channel_uploads 表中。
+    
+    参数:
+        spool: IngestSpool - 已写入完整文件内容的spool
+        file_name: str - 文件名
+        uploaders: list - 渠道实例列表，mirror 模式下第一个成功的渠道作为主链接
+        mode: str - 'race' 或 'mirror'
+        img_info: dict - 可选，已验证过的图片信息
+        optimize: dict - 可选，上传前的压缩/转码选项
+    
+    返回:
+        tuple - (返回给客户端的结果, 待保存的历史记录；去重命中时为None)
+    
+    异常:
+        UploadError - 图片无效或所有渠道都上传失败
+    """
+    group_id = uuid.uuid4().hex
+    outcomes = {}
+    
+    # 已保存过相同内容的渠道直接使用已有链接；一次查询所有渠道，去重命中率按一次上传统计
+    found = find_uploads_by_hash([uploader.get_channel_name() for uploader in uploaders], spool.sha256,
+                                 optimize_fingerprint(optimize))
+    increment_stat('dedup_hit' if found else 'dedup_miss')
+    existing = {}
+    for uploader in uploaders:
+        channel = uploader.get_channel_name()
+        if channel not in found:
+            continue
+        duplicate = dict(found[channel], deduplicated=True)
+        logger.info(f"内容已上传过，直接返回: 渠道={channel}, URL={duplicate['file_url']}")
+        if mode == 'race':
+            return duplicate, None
+        existing[channel] = duplicate
+        outcomes[channel] = {'status': 'deduplicated', 'file_url': duplicate['file_url']}
+    targets = [uploader for uploader in uploaders if uploader.get_channel_name() not in existing]
+    
+    validated_file = validate_upload(spool, file_name, img_info)
+    thumbnail = submit_thumbnail(spool, validated_file) if targets else None
+    optimized = optimize_upload(spool, validated_file, optimize) if targets and optimize else None
+    stored_spool, stored_file = optimized or (spool, validated_file)
+    try:
+        stored_spool.seek(0)
+        data = stored_spool.read()
+    finally:
+        if optimized:
+            stored_spool.close()
+    
+    event = threading.Event()
+    futures = {}
+    for uploader in targets:
+        size_ok, size_error = uploader.check_file_size(len(data))
+        if not size_ok:
+            outcomes[uploader.get_channel_name()] = {'status': 'skipped', 'error': size_error}
+            continue
+        futures[_fanout_executor.submit(_fanout_attempt, uploader, data, stored_file, event)] = uploader
+    logger.info(f"开始多渠道上传: 文件={stored_file.filename}, 模式={mode}, 渠道={[u.get_channel_name() for u in futures.values()]}")
+    
+    results = {}
+    
+    def finish(future):
+        uploader = futures[future]
+        channel = uploader.get_channel_name()
+        result, outcome = None, {'status': 'cancelled'}
+        if not future.cancelled():
+            try:
+                result, duration = future.result()
+                if result:
+                    outcome = {'status': 'succeeded', 'duration': round(duration, 3), 'file_url': result['file_url']}
+                elif not event.is_set():
+                    outcome = {'status': 'failed', 'duration': round(duration, 3), 'error': '渠道返回空结果'}
+            except Exception as e:
+                if not event.is_set():
+                    outcome = {'status': 'failed', 'error': str(e)}
+        try:
+            record_channel_upload(group_id, mode, channel, outcome)
+        except Exception as e:
+            logger.error(f"记录渠道上传结果失败: {str(e)}")
+        return channel, result, outcome
+    
+    winner = None
+    pending = set(futures)
+    deadline = time.time() + FANOUT_TIMEOUT
+    while pending and not winner:
+        done, pending = wait(pending, timeout=max(0, deadline - time.time()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            channel, result, outcome = finish(future)
+            outcomes[channel] = outcome
+            if result:
+                results[channel] = result
+                if mode == 'race' and winner is None:
+                    winner = channel
+    
+    if pending:
+        # race 模式已有渠道成功，或等待超时：取消其余渠道，已在执行的渠道结束后再记录结果
+        event.set()
+        for future in pending:
+            channel = futures[future].get_channel_name()
+            outcomes[channel] = {'status': 'cancelled' if winner else 'timeout'}
+            if future.cancel():
+                record_channel_upload(group_id, mode, channel, {'status': 'cancelled'})
+            else:
+                future.add_done_callback(finish)
+    
+    if mode == 'mirror':
+        # 按渠道顺序选择主链接
+        winner = next((u.get_channel_name() for u in uploaders if u.get_channel_name() in results), None)
+    if winner is None:
+        if thumbnail:
+            thumbnail.cancel()
+        if existing:
+            return next(iter(existing.values())), None
+        errors = '; '.join(f"{channel}: {outcome.get('error', outcome['status'])}" for channel, outcome in outcomes.items())
+        logger.error(f"多渠道上传全部失败: 文件={stored_file.filename}, {errors}")
+        raise UploadError(f'所有渠道上传失败（{errors}）', 500)
+    
+    if thumbnail:
+        save_thumbnail(spool.sha256, thumbnail)
+    result = dict(results[winner], channel=winner, channels=outcomes)
+    history_item = build_history_item(spool, stored_file, results[winner], winner, optimize)
+    if mode == 'mirror':
+        mirrors = [{'channel': channel, 'file_url': outcome['file_url']}
+                   for channel, outcome in outcomes.items() if channel != winner and outcome.get('file_url')]
+        result['mirrors'] = mirrors
+        history_item['mirrors'] = mirrors
+    logger.info(f"多渠道上传完成: 文件={stored_file.filename}, 模式={mode}, 主渠道={winner}, 成功={len(results)}/{len(futures)}")
+    return result, history_item
+
+# ==================== 异步上传任务 ====================
+
+UPLOAD_JOB_DIR = os.path.join(DATA_DIR, 'jobs')  # 排队中的文件内容
+UPLOAD_JOB_WORKERS = 4  # 每个worker进程中执行上传任务的线程数，与处理HTTP请求的线程分开
+UPLOAD_JOB_POLL_INTERVAL = 1  # 空闲时检查新任务（包括其他worker提交的任务）的间隔（秒）
+UPLOAD_JOB_LEASE = 300  # 任务超过该时长没有心跳，视为所在worker已退出，重新排队（秒）
+UPLOAD_JOB_HEARTBEAT_INTERVAL = 60  # 执行中的任务刷新心跳（updated_at）的间隔（秒），远小于 UPLOAD_JOB_LEASE
+UPLOAD_JOB_MAX_ATTEMPTS = 3  # 因worker退出被重新排队的最大次数
+UPLOAD_JOB_RETENTION = 24 * 3600  # 已完成任务的保留时间（秒）
+UPLOAD_JOB_MAINTENANCE_INTERVAL = 60  # 回收超时任务、清理过期任务的间隔（秒）
+UPLOAD_JOB_MAX_WAIT = 25  # 长轮询最长等待时间（秒）
+
+UPLOAD_JOB_FINISHED = ('succeeded', 'failed')
+
+if not os.path.exists(UPLOAD_JOB_DIR):
+    os.makedirs(UPLOAD_JOB_DIR)
+
+class UploadJobQueue:
+    """
+    基于SQLite的异步上传任务队列
+    
+    请求线程完成接收和验证后，把文件内容写入 UPLOAD_JOB_DIR 并插入一条 queued 任务，
+    由独立的任务线程领取并上传到渠道，HTTP线程不再被慢速的渠道上传占用。
+    任务状态保存在数据库中，所有worker共同领取；执行中的任务定期刷新心跳，
+    worker退出后心跳超过 UPLOAD_JOB_LEASE 的任务会被重新排队。
+    """
+    
+    def __init__(self, workers=UPLOAD_JOB_WORKERS):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._queued = threading.Condition(self._lock)    # 本进程提交了新任务
+        self._finished = threading.Condition(self._lock)  # 本进程完成了任务
+        self._pid = None
+        self._running = {}  # 本进程正在执行的任务：任务ID -> 领取标识
+    
+    def _ensure_started(self):
+        """首次使用或fork后的子进程中启动任务线程"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._running = {}
+        for i in range(self.workers):
+            threading.Thread(target=self._worker_loop, args=(i == 0,), name=f'upload-job-{i}', daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, name='upload-job-heartbeat', daemon=True).start()
+    
+    @staticmethod
+    def _payload_path(job_id):
+        return os.path.join(UPLOAD_JOB_DIR, job_id)
+    
+    def submit(self, spool, validated_file, uploader, optimize=None):
+        """
+        提交上传任务
+        
+        参数:
+            spool: IngestSpool - 已通过验证的文件内容
+            validated_file: ValidatedFile - 验证后的文件信息
+            uploader: BaseChannel - 上传渠道
+            optimize: dict - 可选，上传前的压缩/转码选项
+        
+        返回:
+            str - 任务ID
+        """
+        self._ensure_started()
+        job_id = str(uuid.uuid4())
+        path = self._payload_path(job_id)
+        
+        # 先完整写入文件再插入任务，任务线程不会读到写了一半的文件
+        spool.seek(0)
+        with open(path + '.tmp', 'wb') as f:
+            shutil.copyfileobj(spool, f, INGEST_CHUNK_SIZE)
+        os.replace(path + '.tmp', path)
+        
+        img_info = {
+            'content_type': validated_file.content_type,
+            'width': validated_file.width,
+            'height': validated_file.height,
+            'format': validated_file.format,
+            'extension': validated_file.extension
+        }
+        now = time.time()
+        try:
+            with get_db_connection() as conn:
+                conn.execute('''
+                    INSERT INTO upload_jobs (id, status, channel, file_name, img_info, options, created_at, updated_at)
+                    VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)
+                ''', (job_id, uploader.get_channel_name(), validated_file.filename,
+                      json.dumps(img_info), json.dumps(optimize) if optimize else None, now, now))
+                conn.commit()
+        except Exception:
+            os.remove(path)
+            raise
+        
+        with self._queued:
+            self._queued.notify()
+        logger.info(f"上传任务已排队: 任务={job_id}, 文件={validated_file.filename}, 渠道={uploader.get_channel_name()}")
+        return job_id
+    
+    def _worker_loop(self, maintenance):
+        last_maintenance = 0
+        while True:
+            try:
+                if maintenance and time.time() - last_maintenance >= UPLOAD_JOB_MAINTENANCE_INTERVAL:
+                    last_maintenance = time.time()
+                    self.recover_stale_jobs()
+                    self.purge_finished_jobs()
+                
+                job = self._claim()
+                if job is None:
+                    with self._queued:
+                        self._queued.wait(UPLOAD_JOB_POLL_INTERVAL)
+                    continue
+                self._run(job)
+            except Exception as e:
+                logger.error(f"上传任务线程异常: {str(e)}", exc_info=True)
+                time.sleep(UPLOAD_JOB_POLL_INTERVAL)
+    
+    def _claim(self):
+        """领取最早排队的任务，没有任务时返回None"""
+        claim = uuid.uuid4().hex
+        with get_db_connection() as conn:
+            # 子查询和更新在同一条语句的写事务中完成，多个worker不会领取到同一个任务
+            conn.execute('''
+                UPDATE upload_jobs SET status = 'running', claimed_by = ?, attempts = attempts + 1, updated_at = ?
+                WHERE id = (SELECT id FROM upload_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1)
+                AND status = 'queued'
+            ''', (claim, time.time()))
+            conn.commit()
+            return conn.execute('SELECT * FROM upload_jobs WHERE claimed_by = ?', (claim,)).fetchone()
+    
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(UPLOAD_JOB_HEARTBEAT_INTERVAL)
+            try:
+                self._heartbeat()
+            except Exception as e:
+                logger.error(f"刷新上传任务心跳失败: {str(e)}")
+    
+    def _heartbeat(self):
+        """刷新本进程正在执行的任务的 updated_at，避免耗时较长的上传被当作worker退出而重新排队"""
+        with self._lock:
+            running = list(self._running.items())
+        if not running:
+            return
+        now = time.time()
+        with get_db_connection() as conn:
+            conn.executemany(
+                "UPDATE upload_jobs SET updated_at = ? WHERE id = ? AND claimed_by = ? AND status = 'running'",
+                [(now, job_id, claimed_by) for job_id, claimed_by in running]
+            )
+            conn.commit()
+    
+    def _run(self, job):
+        job_id = job['id']
+        with self._lock:
+            self._running[job_id] = job['claimed_by']
+        try:
+            self._execute(job)
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+    
+    def _execute(self, job):
+        job_id = job['id']
+        uploader = resolve_uploader(job['channel'])
+        try:
+            with open(self._payload_path(job_id), 'rb') as f:
+                spool = ingest_chunks(iter(lambda: f.read(INGEST_CHUNK_SIZE), b''))
+            try:
+                validated_file = ValidatedFile(job['file_name'], json.loads(job['img_info']), spool)
+                optimize = json.loads(job['options']) if job['options'] else None
+                result, history_item = dispatch_upload(spool, validated_file, uploader, optimize)
+            finally:
+                spool.close()
+            if history_item:
+                add_upload_history(history_item)
+            self._finish(job, 'succeeded', result=result)
+        except UploadError as e:
+            self._finish(job, 'failed', error=e.message)
+        except Exception as e:
+            logger.error(f"上传任务异常: 任务={job_id}, 错误={str(e)}", exc_info=True)
+            self._finish(job, 'failed', error=f'上传失败: {str(e)}')
+    
+    def _finish(self, job, status, result=None, error=None):
+        with get_db_connection() as conn:
+            # 只有仍由本次领取持有的任务才更新，超时后被重新排队的任务以新的执行结果为准
+            cursor = conn.execute('''
+                UPDATE upload_jobs SET status = ?, result = ?, error = ?, updated_at = ?
+                WHERE id = ? AND claimed_by = ?
+            ''', (status, json.dumps(result, ensure_ascii=False) if result else None, error,
+                  time.time(), job['id'], job['claimed_by']))
+            conn.commit()
+        if cursor.rowcount == 1:
+            self._remove_payload(job['id'])
+        else:
+            # 文件仍由重新领取的执行使用
+            logger.warning(f"上传任务已被重新排队，忽略本次结果: 任务={job['id']}, 状态={status}")
+        with self._finished:
+            self._finished.notify_all()
+    
+    def _remove_payload(self, job_id):
+        try:
+            os.remove(self._payload_path(job_id))
+        except FileNotFoundError:
+            pass
+    
+    def recover_stale_jobs(self):
+        """重新排队执行超时的任务，超过最大次数的标记为失败"""
+        now = time.time()
+        with get_db_connection() as conn:
+            stale = conn.execute(
+                "SELECT id, attempts FROM upload_jobs WHERE status = 'running' AND updated_at < ?",
+                (now - UPLOAD_JOB_LEASE,)
+            ).fetchall()
+            exhausted = []
+            for row in stale:
+                if row['attempts'] < UPLOAD_JOB_MAX_ATTEMPTS:
+                    conn.execute('''
+                        UPDATE upload_jobs SET status = 'queued', claimed_by = NULL, updated_at = ?
+                        WHERE id = ? AND status = 'running'
+                    ''', (now, row['id']))
+                else:
+                    exhausted.append(row['id'])
+                    conn.execute('''
+                        UPDATE upload_jobs SET status = 'failed', error = ?, updated_at = ?
+                        WHERE id = ? AND status = 'running'
+                    ''', ('上传任务多次中断，已放弃', now, row['id']))
+            conn.commit()
+        for job_id in exhausted:
+            self._remove_payload(job_id)
+        if stale:
+            logger.warning(f"回收超时上传任务: 重新排队={len(stale) - len(exhausted)}, 放弃={len(exhausted)}")
+    
+    def purge_finished_jobs(self):
+        """删除超过保留时间的已完成任务"""
+        with get_db_connection() as conn:
+            conn.execute(
+                "DELETE FROM upload_jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?",
+                (time.time() - UPLOAD_JOB_RETENTION,)
+            )
+            conn.commit()
+    
+    def get(self, job_id):
+        """
+        查询任务状态
+        
+        返回:
+            dict or None - 任务信息，不存在时返回None
+        """
+        self._ensure_started()
+        with get_db_connection() as conn:
+            row = conn.execute('SELECT * FROM upload_jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row['id'],
+            'status': row['status'],
+            'channel': row['channel'],
+            'file_name': row['file_name'],
+            'created_at': datetime.fromtimestamp(row['created_at']).strftime('%Y-%m-%d %H:%M:%S'),
+            'updated_at': datetime.fromtimestamp(row['updated_at']).strftime('%Y-%m-%d %H:%M:%S'),
+            'result': json.loads(row['result']) if row['result'] else None,
+            'message': row['error']
+        }
+    
+    def wait(self, job_id, timeout):
+        """
+        等待任务完成，最多等待 timeout 秒
+        
+        本进程完成任务时立即唤醒；其他worker执行的任务按 UPLOAD_JOB_POLL_INTERVAL 轮询
+        """
+        deadline = time.time() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.time()
+            if job is None or job['status'] in UPLOAD_JOB_FINISHED or remaining <= 0:
+                return job
+            with self._finished:
+                self._finished.wait(min(remaining, UPLOAD_JOB_POLL_INTERVAL))
+
+upload_job_queue = UploadJobQueue()
+
+def submit_upload_job(spool, file_name, uploader, img_info=None, optimize=None):
+    """
+    去重、验证后把上传交给后台任务
+    
+    返回:
+        tuple - (去重命中时的结果, None) 或 (None, 任务ID)
+    
+    异常:
+        UploadError - 图片无效或超出大小限制
+    """
+    duplicate = lookup_duplicate_upload(uploader, spool, optimize)
+    if duplicate:
+        return duplicate, None
+    validated_file = prepare_upload(spool, file_name, uploader, img_info, optimize)
+    return None, upload_job_queue.submit(spool, validated_file, uploader, optimize)
+
+def is_async_requested(value):
+    """请求参数 async 是否要求使用任务模式"""
+    return str(value).lower() in ('1', 'true', 'yes')
+
+@app.route('/api/random')
+def random_image():
+    """
+    随机图片接口
+    
+    查询参数:
+        channel: 可选，指定渠道 (miyoushe, chatglm, jd)
+        w: 可选，设备屏幕宽度
+        h: 可选，设备屏幕高度
+        orientation: 可选，指定方向 (landscape=横屏, portrait=竖屏, auto=自动检测[默认])
+        type: 可选，返回类型 (redirect=302重定向, json=返回JSON)
+        q: 可选，图片质量 (0=原图[默认], 1=压缩图)
+        count: 可选，返回多张不重复的图片 (1-RANDOM_MAX_COUNT)，指定时总是返回JSON列表
+        deck: 可选，牌组标识，同一牌组在候选全部返回过一次之前不会重复
+        seed: 可选，种子，相同的种子和筛选条件总是返回相同的图片
+        period: 可选，按时间段固定图片 (minute, hour, day)，同一时间段内返回相同的图片
     
     返回:
         默认 302 重定向到图片URL，或返回 JSON 格式的图片信息
     
+    缓存:
+        - 指定 seed/period 时响应带有 ETag 和 Cache-Control，可被CDN和浏览器缓存；
+          period 的缓存时间截止到当前时间段结束
+        - 其他情况每次返回不同的图片，响应禁止缓存
+        - 方向由 User-Agent 自动判断时响应带有 Vary: User-Agent
+    
     自动检测逻辑:
         - 如果未指定 orientation 且未传递 w/h，则根据 User-Agent 自动判断
         - 移动设备 → 竖屏图片，桌面设备 → 横屏图片
     
+    屏幕尺寸:
+        - 传递 w/h 时优先返回宽高比接近、分辨率刚好能覆盖屏幕的图片（见 RandomImageIndex.pick_best_fit），
+          没有尺寸已知的候选时按方向随机选择；指定 seed/period/deck 时只按方向选择
+    
     图片质量:
         - 0: 返回原图（默认）
-        - 1: 返回压缩图（通过OSS图片处理参数实现，最大边1920px，质量80%，WebP格式）
+        - 1: 返回压缩图（由图片所在渠道的图床缩放/转码，质量80%，WebP格式；传递 w/h 时缩小到刚好覆盖屏幕，
+             否则长边不超过1920px；渠道不支持图片处理时返回原图）
     """
     # 获取查询参数
     channel = request.args.get('channel', '').strip()
@@ -350,6 +2757,31 @@ def random_image():
     orientation = request.args.get('orientation', '').strip().lower()
     response_type = request.args.get('type', 'redirect').strip().lower()
     quality = request.args.get('q', '0').strip()  # 0=原图, 1=压缩图
+    deck = request.args.get('deck', '').strip()
+    count = 1
+    if 'count' in request.args:
+        count = request.args.get('count', type=int)
+        if not count or not 1 <= count <= RANDOM_MAX_COUNT:
+            return jsonify({'status': 1, 'message': f'count 必须是 1 到 {RANDOM_MAX_COUNT} 之间的整数'}), 400
+        response_type = 'json'
+    if len(deck) > RANDOM_DECK_MAX_LENGTH:
+        return jsonify({'status': 1, 'message': f'deck 长度不能超过 {RANDOM_DECK_MAX_LENGTH}'}), 400
+    seed = request.args.get('seed', '').strip()
+    period = request.args.get('period', '').strip().lower()
+    if len(seed) > RANDOM_SEED_MAX_LENGTH:
+        return jsonify({'status': 1, 'message': f'seed 长度不能超过 {RANDOM_SEED_MAX_LENGTH}'}), 400
+    if period and period not in RANDOM_PERIODS:
+        return jsonify({'status': 1, 'message': f"period 可选: {', '.join(RANDOM_PERIODS)}"}), 400
+    if (seed or period) and deck:
+        return jsonify({'status': 1, 'message': 'seed/period 不能与 deck 同时使用'}), 400
+    
+    max_age = RANDOM_SEED_MAX_AGE
+    if period:
+        # 时间段编号计入种子，按本地时间对齐（如每天零点切换）
+        length = RANDOM_PERIODS[period]
+        now = time.time() + time.localtime().tm_gmtoff
+        seed = f"{seed}|{period}:{int(now // length)}"
+        max_age = max(1, int(length - now % length))
     
     # 根据屏幕尺寸判断需要的图片方向
     # orientation: landscape = 横屏 (宽>高), portrait = 竖屏 (高>宽)
@@ -364,45 +2796,124 @@ def random_image():
     else:
         # 未传递参数时，根据 User-Agent 自动判断设备类型
         need_orientation = detect_device_orientation(request.headers.get('User-Agent', ''))
+    vary_user_agent = orientation not in ('landscape', 'portrait') and not (screen_width and screen_height)
     
     try:
-        image = get_random_image(channel=channel if channel else None, 
-                                  orientation=need_orientation)
+        images = None
+        if screen_width and screen_height and not seed and not deck:
+            # 传递了屏幕尺寸时按宽高比和分辨率选择，显式指定的 orientation 仍然生效
+            images = get_best_fit_images(screen_width, screen_height, channel=channel if channel else None,
+                                         orientation=orientation if orientation in ('landscape', 'portrait') else None,
+                                         count=count)
+        if not images:
+            images = get_random_images(channel=channel if channel else None,
+                                       orientation=need_orientation, count=count, deck=deck or None,
+                                       seed=seed or None)
         
-        if not image:
+        if not images:
             return jsonify({
                 'status': 1, 
                 'message': '没有找到符合条件的图片'
             }), 404
         
         # 处理图片 URL（根据 quality 参数决定是否添加压缩参数）
-        file_url = process_image_url(image['file_url'], quality)
+        results = [{
+            'file_url': process_image_url(image['file_url'], quality, channel=image['channel'],
+                                          image_size=(image['width'], image['height']),
+                                          target_size=(screen_width, screen_height) if screen_width and screen_height else None),
+            'file_name': image['file_name'],
+            'width': image['width'],
+            'height': image['height'],
+            'channel': image['channel'],
+            'quality': quality
+        } for image in images]
         
         # 根据返回类型决定响应方式
         if response_type == 'json':
-            return jsonify({
+            response = jsonify({
                 'status': 0,
                 'message': 'success',
-                'result': {
-                    'file_url': file_url,
-                    'file_name': image['file_name'],
-                    'width': image['width'],
-                    'height': image['height'],
-                    'channel': image['channel'],
-                    'quality': quality
-                }
+                'result': results if 'count' in request.args else results[0]
             })
         else:
             # 302 重定向到图片URL，速度最快
-            from flask import redirect
-            return redirect(file_url, code=302)
+            response = redirect(results[0]['file_url'], code=302)
+        
+        if vary_user_agent:
+            response.vary.add('User-Agent')
+        if not seed:
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+        
+        # 种子模式下结果确定，ETag 由响应内容决定
+        etag_source = json.dumps([response_type, 'count' in request.args, results], sort_keys=True)
+        etag = hashlib.sha1(etag_source.encode('utf-8')).hexdigest()[:20]
+        if request.if_none_match.contains(etag):
+            not_modified = Response(status=304)
+            not_modified.vary.update(response.vary)
+            response = not_modified
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f'public, max-age={max_age}'
+        return response
             
     except Exception as e:
         logger.error(f"随机图片接口错误: {str(e)}", exc_info=True)
         return jsonify({'status': 1, 'message': '服务器内部错误'}), 500
 
 
-def process_image_url(url, quality='0'):
+# 压缩图（q=1）的处理参数
+COMPRESSED_IMAGE_MAX_SIZE = 1920  # 没有屏幕尺寸时的长边上限
+COMPRESSED_IMAGE_QUALITY = 80
+COMPRESSED_IMAGE_FORMAT = 'webp'
+
+
+def fit_transform_size(image_width, image_height, target_width=None, target_height=None, max_size=None):
+    """
+    计算请求图床缩放时的目标尺寸
+    
+    参数:
+        image_width, image_height: 原图尺寸，未知时为0或None
+        target_width, target_height: 显示区域尺寸，缩小到刚好能覆盖该区域（与 object-fit: cover 一致）
+        max_size: 没有显示区域时的长边上限
+    
+    返回:
+        tuple or None - (宽, 高)，不需要缩小时返回None
+    """
+    targets = [(target, size) for target, size in ((target_width, image_width), (target_height, image_height)) if target]
+    if not image_width or not image_height:
+        # 原图尺寸未知时限制在正方形内，图床不会放大图片
+        side = max(target for target, _ in targets) if targets else max_size
+        return (side, side) if side else None
+    if targets:
+        scale = max(target / size for target, size in targets)
+    elif max_size:
+        scale = max_size / max(image_width, image_height)
+    else:
+        return None
+    if scale >= 1:
+        return None
+    return max(1, math.ceil(image_width * scale)), max(1, math.ceil(image_height * scale))
+
+
+def transform_image_url(url, channel, image_size=None, target_size=None, max_size=None,
+                        image_format=None, quality=None):
+    """
+    请求渠道图床缩放/转码图片
+    
+    参数:
+        image_size: (宽, 高) - 原图尺寸
+        target_size: (宽, 高) - 显示区域尺寸，见 fit_transform_size
+    
+    返回:
+        str or None - 处理后的地址，渠道不支持图片处理时返回None
+    """
+    size = fit_transform_size(*(image_size or (None, None)), *(target_size or (None, None)), max_size=max_size)
+    width, height = size or (None, None)
+    return channel_manager.transform_url(channel, url, width=width, height=height,
+                                         image_format=image_format, quality=quality)
+
+
+def process_image_url(url, quality='0', channel=None, image_size=None, target_size=None):
     """
     根据质量参数处理图片 URL
     
@@ -410,22 +2921,22 @@ def process_image_url(url, quality='0'):
         url: 原始图片 URL
         quality: 图片质量
             - '0': 返回原图（默认）
-            - '1': 返回压缩图（OSS图片处理）
+            - '1': 返回压缩图（由图片所在渠道的图床缩放/转码）
+        channel: 图片所在的渠道
+        image_size: (宽, 高) - 原图尺寸
+        target_size: (宽, 高) - 客户端屏幕尺寸，压缩图缩小到刚好能覆盖屏幕；
+                     未传递时长边不超过 COMPRESSED_IMAGE_MAX_SIZE
     
     返回:
-        str: 处理后的图片 URL
+        str: 处理后的图片 URL，渠道不支持图片处理时返回原图
     """
     if quality != '1':
         return url
     
-    # OSS 图片处理参数：最大边1920px，质量80%，渐进式加载，WebP格式
-    oss_process = 'x-oss-process=image/resize,s_1920/quality,q_80/interlace,1/format,webp'
-    
-    # 判断 URL 中是否已有查询参数
-    if '?' in url:
-        return f"{url}&{oss_process}"
-    else:
-        return f"{url}?{oss_process}"
+    transformed = transform_image_url(url, channel, image_size=image_size, target_size=target_size,
+                                      max_size=None if target_size else COMPRESSED_IMAGE_MAX_SIZE,
+                                      image_format=COMPRESSED_IMAGE_FORMAT, quality=COMPRESSED_IMAGE_QUALITY)
+    return transformed or url
 
 
 def detect_device_orientation(user_agent):
@@ -464,66 +2975,57 @@ def detect_device_orientation(user_agent):
     return 'landscape'
 
 
-def get_random_image(channel=None, orientation=None, aspect_ratio_threshold=1.2):
+def get_random_image(channel=None, orientation=None):
     """
-    从数据库获取随机图片
+    从内存索引中获取随机图片
     
     参数:
         channel: 可选，指定渠道名称
         orientation: 可选，'landscape'(横屏,宽>高) 或 'portrait'(竖屏,高>宽)
-        aspect_ratio_threshold: 宽高比阈值，用于过滤接近方形的图片，默认1.2
     
     返回:
         dict: 图片信息，如果没有找到返回 None
     
     说明:
-        使用宽高比阈值过滤，确保只返回明显的横屏/竖屏图片
-        - 横屏：宽/高 >= 1.2
-        - 竖屏：高/宽 >= 1.2
+        使用宽高比阈值 ORIENTATION_RATIO_THRESHOLD 过滤，确保只返回明显的横屏/竖屏图片
     """
-    with get_db_connection() as conn:
-        # 构建 SQL 查询
-        sql = 'SELECT id, file_name, file_url, width, height, channel FROM upload_history WHERE 1=1'
-        params = []
-        
-        # 过滤渠道
-        if channel:
-            sql += ' AND channel = ?'
-            params.append(channel)
-        
-        # 过滤图片方向 (需要有有效的宽高数据，且使用宽高比阈值过滤接近方形的图片)
-        if orientation == 'landscape':
-            # 横屏：宽/高 >= 阈值 (明显的横屏图片)
-            sql += ' AND width > 0 AND height > 0 AND CAST(width AS REAL) / height >= ?'
-            params.append(aspect_ratio_threshold)
-        elif orientation == 'portrait':
-            # 竖屏：高/宽 >= 阈值 (明显的竖屏图片)
-            sql += ' AND width > 0 AND height > 0 AND CAST(height AS REAL) / width >= ?'
-            params.append(aspect_ratio_threshold)
-        
-        # 使用高效的随机选择策略
-        # 先获取符合条件的记录总数
-        count_sql = sql.replace(
-            'SELECT id, file_name, file_url, width, height, channel',
-            'SELECT COUNT(*)'
-        )
-        cursor = conn.execute(count_sql, params)
-        total_count = cursor.fetchone()[0]
-        
-        if total_count == 0:
-            return None
-        
-        # 使用 LIMIT + OFFSET 随机选择，比 ORDER BY RANDOM() 更高效
-        random_offset = random.randint(0, total_count - 1)
-        sql += ' LIMIT 1 OFFSET ?'
-        params.append(random_offset)
-        
-        cursor = conn.execute(sql, params)
-        row = cursor.fetchone()
-        
-        if row:
-            return dict(row)
-        return None
+    return random_image_index.pick(channel=channel, orientation=orientation)
+
+
+def get_best_fit_images(width, height, channel=None, orientation=None, count=1):
+    """
+    按屏幕尺寸获取随机图片
+    
+    参数:
+        width, height: 屏幕尺寸（像素）
+        orientation: 可选，额外限定方向
+    
+    返回:
+        list: 图片信息列表，没有尺寸已知的候选时返回空列表
+    """
+    return random_image_index.pick_best_fit(width, height, channel=channel, orientation=orientation, count=count)
+
+
+def get_random_images(channel=None, orientation=None, count=1, deck=None, seed=None):
+    """
+    获取多张不重复的随机图片
+    
+    参数:
+        count: 最多返回的数量，候选不足时返回全部候选
+        deck: 可选，牌组标识，指定时跨请求不重复（见 draw_from_deck）
+        seed: 可选，种子，指定时按种子确定地选择（见 RandomImageIndex.pick_seeded）
+    
+    返回:
+        list: 图片信息列表，顺序随机
+    """
+    if seed:
+        return random_image_index.pick_seeded(seed, channel=channel, orientation=orientation, count=count)
+    if deck:
+        return draw_from_deck(deck, channel=channel, orientation=orientation, count=count)
+    if count == 1:
+        image = get_random_image(channel=channel, orientation=orientation)
+        return [image] if image else []
+    return [image for _, image in random_image_index.sample(channel, orientation, count)]
 
 
 @app.route('/')
@@ -568,146 +3070,725 @@ def verify():
     
     return jsonify({'status': 0, 'message': '验证成功', 'token': token})
 
-@app.route('/api/check_verification', methods=['POST'])
-def check_verification():
-    data = request.json
-    if not data or 'token' not in data:
-        return jsonify({'status': 1, 'message': '无效的请求'}), 400
-    
-    token = data['token']
+@app.route('/api/check_verification', methods=['POST'])
+def check_verification():
+    data = request.json
+    if not data or 'token' not in data:
+        return jsonify({'status': 1, 'message': '无效的请求'}), 400
+    
+    token = data['token']
+    
+    if verify_token(token):
+        return jsonify({'status': 0, 'message': '验证有效'})
+    else:
+        return jsonify({'status': 1, 'message': '验证已过期或无效'}), 401
+
+@app.route('/api/logout', methods=['POST'])
+def logout():
+    token = request.headers.get('X-Verification-Token')
+    if not token or not revoke_token(token):
+        return jsonify({'status': 1, 'message': '验证已过期或无效'}), 401
+    return jsonify({'status': 0, 'message': '已退出登录'})
+
+@app.route('/upload', methods=['POST'])
+def upload_image():
+    # 验证token
+    token = request.headers.get('X-Verification-Token')
+    if not token or not verify_token(token):
+        logger.warning("上传请求验证失败: token无效或已过期")
+        return jsonify({'status': 1, 'message': '未验证或验证已过期'}), 401
+    
+    if 'file' not in request.files:
+        logger.warning("上传请求缺少文件")
+        return jsonify({'status': 1, 'message': '没有文件'}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        logger.warning("上传请求文件名为空")
+        return jsonify({'status': 1, 'message': '没有选择文件'}), 400
+    
+    # 检查文件类型
+    if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')):
+        logger.warning(f"不支持的文件类型: {file.filename}")
+        return jsonify({'status': 1, 'message': '请选择支持的图片格式：JPG, PNG, GIF, BMP, WEBP'}), 400
+    
+    # 获取上传渠道
+    channel = request.form.get('channel', channel_manager.get_default_channel_name())
+    logger.info(f"开始上传: 文件={file.filename}, 渠道={channel}")
+    
+    # 请求体在解析时已写入 IngestSpool 并完成哈希计算，这里无需再保存临时文件
+    spool = file.stream
+    try:
+        if not isinstance(spool, IngestSpool):
+            spool = ingest_chunks(iter(lambda: file.stream.read(INGEST_CHUNK_SIZE), b''))
+        
+        file_size_mb = spool.size / (1024 * 1024)
+        logger.info(f"文件已接收: {file.filename}, 大小: {file_size_mb:.2f}MB, MD5: {spool.md5}")
+        
+        # 多渠道上传：mode=race/mirror，channels 为逗号分隔的渠道列表
+        mode, uploaders = resolve_fanout_request(request.form.get('mode'), request.form.get('channels'))
+        uploader = None if mode else resolve_uploader(channel)
+        optimize = resolve_optimize_options(request.form.get('optimize'), request.form.get('max_dimension'), uploader)
+        is_async = is_async_requested(request.form.get('async', request.args.get('async')))
+        
+        if mode:
+            if is_async:
+                raise UploadError('多渠道上传不支持任务模式')
+            result, history_item = fanout_upload(spool, file.filename, uploaders, mode, optimize=optimize)
+            if history_item:
+                add_upload_history(history_item)
+            return jsonify({'status': 0, 'message': '上传成功', 'result': result})
+        
+        # 任务模式：验证通过后立即返回任务ID，由后台任务线程上传
+        if is_async:
+            result, job_id = submit_upload_job(spool, file.filename, uploader, optimize=optimize)
+            if job_id:
+                return jsonify({
+                    'status': 0,
+                    'message': '已加入上传队列',
+                    'result': {'job_id': job_id, 'status': 'queued'}
+                }), 202
+            return jsonify({'status': 0, 'message': '上传成功', 'result': result})
+        
+        result, history_item = upload_spool(spool, file.filename, uploader, optimize=optimize)
+        
+        # 保存上传历史（去重命中时没有新记录）
+        if history_item:
+            add_upload_history(history_item)
+        
+        return jsonify({
+            'status': 0,
+            'message': '上传成功',
+            'result': result
+        })
+    except UploadError as e:
+        return jsonify({'status': 1, 'message': e.message}), e.status_code
+    except Exception as e:
+        logger.error(f"上传异常: 文件={file.filename}, 错误={str(e)}", exc_info=True)
+        return jsonify({'status': 1, 'message': f'上传失败: {str(e)}'}), 500
+    finally:
+        # 关闭spool，已转存到磁盘的临时文件会被自动删除
+        spool.close()
+
+# 批量上传配置
+BATCH_UPLOAD_MAX_FILES = 100  # 单次批量上传的最大文件数
+BATCH_UPLOAD_WORKERS = 4  # 同时进行的渠道上传数（所有批量请求共享）
+
+_batch_upload_executor = ThreadPoolExecutor(max_workers=BATCH_UPLOAD_WORKERS, thread_name_prefix='batch-upload')
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """
+    批量上传接口
+    
+    表单字段:
+        files: 多个图片文件
+        channel: 可选，上传渠道
+        optimize, max_dimension: 可选，上传前的压缩/转码参数，同 /upload
+    
+    返回:
+        NDJSON 流，每个文件完成时输出一行 {index, file_name, status, message, result}，
+        最后一行为汇总 {done: true, total, succeeded, failed}
+    """
+    # 验证token
+    token = request.headers.get('X-Verification-Token')
+    if not token or not verify_token(token):
+        logger.warning("批量上传请求验证失败: token无效或已过期")
+        return jsonify({'status': 1, 'message': '未验证或验证已过期'}), 401
+    
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return jsonify({'status': 1, 'message': '没有文件'}), 400
+    if len(files) > BATCH_UPLOAD_MAX_FILES:
+        return jsonify({'status': 1, 'message': f'单次最多上传 {BATCH_UPLOAD_MAX_FILES} 个文件'}), 400
+    
+    uploader = resolve_uploader(request.form.get('channel', channel_manager.get_default_channel_name()))
+    try:
+        optimize = resolve_optimize_options(request.form.get('optimize'), request.form.get('max_dimension'), uploader)
+    except UploadError as e:
+        return jsonify({'status': 1, 'message': e.message}), e.status_code
+    logger.info(f"开始批量上传: 文件数={len(files)}, 渠道={uploader.get_channel_name()}")
+    
+    def generate():
+        futures = {}
+        collected = set()  # 已读取结果的future
+        history_items = []
+        succeeded = 0
+        
+        def flush_history():
+            # 所有历史记录在一个事务中写入
+            if history_items:
+                try:
+                    add_upload_history_batch(history_items)
+                except Exception as e:
+                    logger.error(f"批量保存历史记录失败: {str(e)}")
+                history_items.clear()
+        
+        try:
+            for index, file in enumerate(files):
+                if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')):
+                    yield json.dumps({'index': index, 'file_name': file.filename, 'status': 1,
+                                      'message': '请选择支持的图片格式：JPG, PNG, GIF, BMP, WEBP'}, ensure_ascii=False) + '\n'
+                    continue
+                spool = file.stream
+                if not isinstance(spool, IngestSpool):
+                    spool = ingest_chunks(iter(lambda: file.stream.read(INGEST_CHUNK_SIZE), b''))
+                futures[_batch_upload_executor.submit(upload_spool, spool, file.filename, uploader,
+                                                      optimize=optimize)] = (index, file, spool)
+            
+            # 按完成顺序输出每个文件的结果
+            for future in as_completed(futures):
+                index, file, spool = futures[future]
+                collected.add(future)
+                line = {'index': index, 'file_name': file.filename}
+                try:
+                    result, history_item = future.result()
+                    if history_item:
+                        history_items.append(history_item)
+                    succeeded += 1
+                    line.update(status=0, message='上传成功', result=result)
+                except UploadError as e:
+                    line.update(status=1, message=e.message)
+                except Exception as e:
+                    logger.error(f"批量上传异常: 文件={file.filename}, 错误={str(e)}", exc_info=True)
+                    line.update(status=1, message=f'上传失败: {str(e)}')
+                finally:
+                    spool.close()
+                yield json.dumps(line, ensure_ascii=False) + '\n'
+            
+            flush_history()
+            
+            logger.info(f"批量上传完成: 成功={succeeded}, 失败={len(files) - succeeded}")
+            yield json.dumps({'done': True, 'total': len(files), 'succeeded': succeeded,
+                              'failed': len(files) - succeeded}) + '\n'
+        finally:
+            # 客户端中途断开时，等待已提交的上传结束后释放spool，
+            # 已上传成功的文件（包括这里等到的）仍然写入历史记录
+            for future, (_, _, spool) in futures.items():
+                if not future.cancel():
+                    wait([future])
+                    if future not in collected and future.exception() is None:
+                        history_item = future.result()[1]
+                        if history_item:
+                            history_items.append(history_item)
+                spool.close()
+            flush_history()
+    
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['X-Accel-Buffering'] = 'no'  # 关闭反向代理缓冲，逐行推送结果
+    return response
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_upload_job(job_id):
+    """
+    查询异步上传任务
+    
+    查询参数:
+        wait: 可选，任务未完成时最多等待的秒数（长轮询），上限为 UPLOAD_JOB_MAX_WAIT
+    
+    返回:
+        result: {job_id, status(queued/running/succeeded/failed), channel, file_name,
+                 created_at, updated_at, result, message}
+    """
+    # 验证token
+    token = request.headers.get('X-Verification-Token')
+    if not token or not verify_token(token):
+        return jsonify({'status': 1, 'message': '未验证或验证已过期'}), 401
+    
+    try:
+        wait_seconds = min(max(float(request.args.get('wait', 0)), 0), UPLOAD_JOB_MAX_WAIT)
+    except ValueError:
+        wait_seconds = 0
+    
+    job = upload_job_queue.wait(job_id, wait_seconds) if wait_seconds else upload_job_queue.get(job_id)
+    if job is None:
+        return jsonify({'status': 1, 'message': '任务不存在或已过期'}), 404
+    
+    return jsonify({
+        'status': 0,
+        'message': 'success',
+        'result': job
+    })
+
+# ==================== 链接下载客户端 ====================
+
+DOWNLOAD_TIMEOUT = 30  # 下载请求超时（秒）
+DOWNLOAD_HOST_CONCURRENCY = 4  # 同一主机同时进行的下载数（每个worker进程）
+DOWNLOAD_HOST_RATE = 5  # 同一主机每秒最多发起的请求数（每个worker进程）
+DOWNLOAD_POOL_HOSTS = 64  # 保持keep-alive连接池的主机数
+DOWNLOAD_MAX_TRACKED_HOSTS = 1024  # 最多保留统计信息的主机数
+DOWNLOAD_RETRY_AFTER_MAX = 60  # Retry-After 最长遵守时间（秒）
+DOWNLOAD_INTERACTIVE_MAX_WAIT = 5  # 请求线程中下载时最多为限速和退避等待的时间（秒），超过时直接返回错误
+DOWNLOAD_BACKOFF_BASE = 0.5  # 未给出 Retry-After 时的退避基数（秒），按连续失败次数指数增长
+DOWNLOAD_LATENCY_SAMPLES = 256  # 每个主机保留的延迟样本数
+
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数或HTTP日期），返回需要等待的秒数，无法解析时返回None"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class DownloadHost:
+    """单个主机的并发、限速、退避状态和统计"""
+    
+    def __init__(self):
+        self.slots = threading.BoundedSemaphore(DOWNLOAD_HOST_CONCURRENCY)
+        self.next_start = 0.0      # 下一个请求最早的发起时间（限速）
+        self.blocked_until = 0.0   # 429/失败退避结束时间
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self.latencies = deque(maxlen=DOWNLOAD_LATENCY_SAMPLES)
+
+class DownloadClient:
+    """
+    链接下载共享客户端
+    
+    所有链接下载共用一个keep-alive会话，按主机限制并发和请求频率；
+    主机返回429或503时按 Retry-After 暂停该主机的所有下载，连接失败时按连续失败次数指数退避。
+    限制和统计都在进程内，每个worker各自计算。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = OrderedDict()  # host -> DownloadHost，按最近使用排序
+        self._session = None
+        self._pid = None
+    
+    def _get_session(self):
+        """共享会话，fork后的子进程中重新创建"""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    session = requests.Session()
+                    # 会话由所有用户的下载共用，不保存源站下发的Cookie，避免在其他用户的请求中回传
+                    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                    adapter = HTTPAdapter(pool_connections=DOWNLOAD_POOL_HOSTS, pool_maxsize=DOWNLOAD_HOST_CONCURRENCY)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._hosts = OrderedDict()
+                    self._pid = os.getpid()
+        return self._session
+    
+    def _get_host(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = DownloadHost()
+                while len(self._hosts) > DOWNLOAD_MAX_TRACKED_HOSTS:
+                    self._hosts.popitem(last=False)
+            else:
+                self._hosts.move_to_end(host)
+            return state
+    
+    def _reserve_start(self, state, max_wait=None):
+        """
+        按限速和退避计算本次请求的发起时间，返回需要等待的秒数
+        
+        异常:
+            UploadError - 需要等待的时间超过 max_wait（为None时不限制）
+        """
+        with self._lock:
+            now = time.time()
+            start = max(now, state.next_start, state.blocked_until)
+            if max_wait is not None and start - now > max_wait:
+                raise UploadError(f'源站限流中，请 {math.ceil(start - now)} 秒后重试', 503)
+            state.next_start = start + 1.0 / DOWNLOAD_HOST_RATE
+            return start - now
+    
+    def backoff(self, host, retry_after=None):
+        """
+        暂停主机的后续请求
+        
+        参数:
+            retry_after: 服务端要求的等待秒数，为None时按连续失败次数指数退避
+        """
+        state = self._get_host(host)
+        with self._lock:
+            state.consecutive_failures += 1
+            if retry_after is None:
+                delay = DOWNLOAD_BACKOFF_BASE * (2 ** (state.consecutive_failures - 1))
+            else:
+                delay = retry_after
+            delay = min(delay, DOWNLOAD_RETRY_AFTER_MAX)
+            state.blocked_until = max(state.blocked_until, time.time() + delay)
+        return delay
+    
+    @contextmanager
+    def get(self, url, max_wait=None, **kwargs):
+        """
+        发起流式GET请求，在with块内持有该主机的一个并发名额
+        
+        先按限速和退避等待到发起时间再占用并发名额，等待中的请求不占用名额。
+        429/503 响应会记录 Retry-After 并暂停该主机，响应照常返回给调用方
+        
+        参数:
+            max_wait: 最多等待的秒数，为None时不限制；处理请求的线程应设置，避免被限流的主机长时间占用
+        
+        异常:
+            UploadError - 需要等待的时间超过 max_wait
+        """
+        session = self._get_session()
+        host = urlparse(url).netloc.lower()
+        state = self._get_host(host)
+        
+        delay = self._reserve_start(state, max_wait)
+        if delay > 0:
+            time.sleep(delay)
+        
+        with state.slots:
+            started = time.time()
+            try:
+                response = session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT, **kwargs)
+            except Exception:
+                with self._lock:
+                    state.requests += 1
+                    state.errors += 1
+                raise
+            
+            throttled = response.status_code in (429, 503)
+            with self._lock:
+                state.requests += 1
+                state.latencies.append(time.time() - started)
+                if throttled:
+                    state.throttled += 1
+                elif response.status_code >= 500:
+                    state.errors += 1
+                elif response.status_code < 400:
+                    state.consecutive_failures = 0
+            if throttled:
+                delay = self.backoff(host, parse_retry_after(response.headers.get('Retry-After')))
+                logger.warning(f"下载被限流 (HTTP {response.status_code})，暂停该主机 {delay:.1f} 秒: {host}")
+            
+            try:
+                yield response
+            except requests.exceptions.RequestException as e:
+                # 接收响应体时连接中断或超时（调用方 raise_for_status 抛出的HTTP错误不计入）
+                if not isinstance(e, requests.exceptions.HTTPError):
+                    with self._lock:
+                        state.errors += 1
+                raise
+            finally:
+                response.close()
+    
+    def stats(self):
+        """
+        各主机的下载统计
+        
+        返回:
+            dict - {host: {requests, errors, throttled, latency_avg, latency_p95}}
+        """
+        with self._lock:
+            hosts = list(self._hosts.items())
+        result = {}
+        for host, state in hosts:
+            latencies = sorted(state.latencies)
+            result[host] = {
+                'requests': state.requests,
+                'errors': state.errors,
+                'throttled': state.throttled,
+                'latency_avg': round(sum(latencies) / len(latencies), 4) if latencies else None,
+                'latency_p95': round(latencies[int(len(latencies) * 0.95)], 4) if latencies else None
+            }
+        return result
+
+download_client = DownloadClient()
+
+def download_max_size(uploader):
+    """链接上传的下载大小上限：取配置上限和渠道限制中较小的一个"""
+    max_size = URL_DOWNLOAD_MAX_SIZE
+    if uploader.get_max_file_size():
+        max_size = min(max_size, uploader.get_max_file_size())
+    return max_size
+
+def download_image(url, max_size=URL_DOWNLOAD_MAX_SIZE, validators=None, max_wait=None):
+    """
+    下载链接中的图片，失败时按防盗链策略调整请求头并重试
+    
+    参数:
+        validators: dict - 可选，条件请求头（If-None-Match / If-Modified-Since）
+        max_wait: 每次请求最多为限速和退避等待的秒数，为None时不限制（见 DownloadClient.get）
+    
+    返回:
+        IngestSpool or None - 定位到开头的图片内容；条件请求得到304（内容未变化）时返回None
+    
+    异常:
+        UploadError - 下载失败、超出大小限制或不是图片
+    """
+    spool = None
+    
+    # 配置代理（如果需要）
+    proxies = None
+    # 如果需要使用代理，可以取消下面注释并修改代理地址
+    # proxies = {
+    #     'http': 'http://your-proxy:port',
+    #     'https': 'http://your-proxy:port'
+    # }
+    
+    # 根据域名设置特定的请求头
+    headers, domain, base_domain = generate_request_headers(url)
+    headers.update(validators or {})
+    
+    # 一些网站需要Cookie
+    cookies = None
+    if 'pixiv' in domain:
+        # 这里可以添加pixiv的cookies，如果有的话
+        # cookies = {'PHPSESSID': 'your_session_id'}
+        pass
+    
+    # 下载图片 - 失败后重试；等待由共享下载客户端按主机统一安排（Retry-After 或指数退避）
+    host = urlparse(url).netloc.lower()
+    max_retries = 3
+    last_error = None
+    
+    for retry in range(max_retries):
+        try:
+            if retry > 0:
+                logger.info(f"重试下载 ({retry}/{max_retries}): {url}")
+                
+                # 重试时可能需要更新请求头（防盗链重试已单独调整过Referer的除外）
+                if retry > 1 and not isinstance(last_error, requests.exceptions.HTTPError):
+                    # 为了更好地模拟真实浏览器，重新生成请求头
+                    headers, _, _ = generate_request_headers(url)
+                    headers.update(validators or {})
+            
+            # 发起请求下载图片，响应体边接收边写入spool
+            with download_client.get(url, max_wait=max_wait, proxies=proxies, headers=headers,
+                                     cookies=cookies) as response:
+                if response.status_code in (429, 503):
+                    # 下载客户端已按 Retry-After 暂停该主机，下一次尝试会自动等待
+                    last_error = requests.exceptions.HTTPError(response=response)
+                    continue
+                if response.status_code == 304 and validators:
+                    logger.info(f"源图片未变化 (HTTP 304): {url}")
+                    return None
+                response.raise_for_status()  # 确保请求成功
+                etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+                spool = download_to_spool(response, max_size)
+                spool.etag, spool.last_modified = etag, last_modified
+            
+            # 如果成功获取内容，跳出重试循环
+            if spool.size:
+                logger.info(f"成功下载图片: {url}")
+                break
+                
+            # 内容为空，继续重试
+            spool.close()
+            spool = None
+            last_error = ValueError("下载的图片内容为空")
+            download_client.backoff(host)
+            logger.warning(f"下载内容为空，将重试: {url}")
+            continue
+            
+        except UploadError:
+            # 超出大小限制、不是图片或需要等待过久，重试也不会改变结果
+            raise
+        except requests.exceptions.Timeout as e:
+            last_error = e
+            download_client.backoff(host)
+            logger.warning(f"下载超时，准备重试: {url}")
+            continue
+        except requests.exceptions.ConnectionError as e:
+            last_error = e
+            download_client.backoff(host)
+            logger.warning(f"连接错误，准备重试: {url}")
+            continue
+        except requests.exceptions.HTTPError as e:
+            # 对于403 Forbidden或401 Unauthorized，可能是防盗链问题
+            if e.response.status_code in (403, 401):
+                last_error = e
+                logger.warning(f"访问被拒绝 (HTTP {e.response.status_code})，尝试调整请求头: {url}")
+                
+                # 记录当前的请求头，帮助调试
+                logger.debug(f"当前请求头: {headers}")
+                
+                # 对于被拒绝的请求，尝试使用更通用的请求头或空Referer
+                if retry == 0:
+                    headers['Referer'] = url  # 使用自身URL作为Referer
+                    logger.debug(f"尝试使用自身URL作为Referer: {url}")
+                elif retry == 1:
+                    # 最后一次尝试，删除Referer
+                    if 'Referer' in headers:
+                        del headers['Referer']
+                        logger.debug("尝试删除Referer头")
+                continue
+            else:
+                # 其他HTTP错误直接返回，不再重试
+                raise UploadError(f'HTTP错误: {e.response.status_code}')
+        except Exception as e:
+            last_error = e
+            # 其他错误，如果有重试次数就继续
+            if retry < max_retries - 1:
+                download_client.backoff(host)
+                logger.warning(f"下载出错，准备重试: {url}, 错误: {str(e)}")
+                continue
+            raise  # 用完重试次数，重新抛出异常
+    
+    # 用完所有重试次数仍然失败
+    if spool is None:
+        if isinstance(last_error, requests.exceptions.Timeout):
+            raise UploadError('下载图片超时，请检查URL或稍后重试')
+        elif isinstance(last_error, requests.exceptions.ConnectionError):
+            raise UploadError('连接错误，无法访问图片URL')
+        elif isinstance(last_error, requests.exceptions.HTTPError):
+            raise UploadError(f'HTTP错误: {last_error.response.status_code}')
+        elif isinstance(last_error, ValueError):
+            raise UploadError('下载的图片内容为空')
+        else:
+            raise UploadError(f'下载图片失败: {str(last_error)}')
+    return spool
+
+def build_url_file_name(url, extension):
+    """根据URL生成文件名，控制长度并使用验证后的扩展名"""
+    try:
+        # 从URL中提取文件名
+        original_name = url.split('/')[-1].split('?')[0]
+        
+        # 去除文件扩展名以处理基础名称
+        base_name = os.path.splitext(original_name)[0]
+        
+        # 限制基础名称长度，最多保留30个字符
+        if len(base_name) > 30:
+            base_name = base_name[:30]
+        
+        # 如果基础名称为空或太短，生成一个随机名称
+        if not base_name or len(base_name) < 3:
+            base_name = f"img_{uuid.uuid4().hex[:8]}"
+            
+        # 使用验证后的扩展名构建最终文件名
+        file_name = f"{base_name}{extension}"
+    except Exception:
+        # 如果文件名处理出错，使用安全的默认名称
+        file_name = f"image_{uuid.uuid4().hex[:8]}{extension}"
+    return file_name
+
+# ==================== 链接上传结果缓存 ====================
+
+URL_CACHE_FRESH_TTL = 6 * 3600  # 缓存结果在该时间内直接使用，不访问源站（秒）
+URL_CACHE_MAX_IDLE = 30 * 24 * 3600  # 超过该时间未被使用的缓存项会被删除（秒）
+URL_CACHE_MAX_ENTRIES = 50000  # 缓存项上限，超出时淘汰最久未使用的
+URL_CACHE_EVICT_EVERY = 100  # 每写入多少次缓存执行一次淘汰
+
+_url_cache_writes = 0
+_url_cache_lock = threading.Lock()
+
+def normalize_source_url(url):
+    """
+    规范化源链接作为缓存键：协议和主机名转小写，去掉默认端口和片段，查询参数按名称排序
+    """
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    if parsed.port and (scheme, parsed.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parsed.port}"
+    query = '&'.join(sorted(parsed.query.split('&'))) if parsed.query else ''
+    return f"{scheme}://{host}{parsed.path or '/'}" + (f"?{query}" if query else '')
+
+def get_url_cache_entry(url, channel, optimize_key=''):
+    """查询链接在指定渠道、按指定压缩选项上传的缓存结果，不存在时返回None"""
+    with get_db_connection() as conn:
+        return conn.execute(
+            'SELECT * FROM url_cache WHERE url_key = ? AND channel = ? AND optimize_key = ?',
+            (normalize_source_url(url), channel, optimize_key)
+        ).fetchone()
+
+def touch_url_cache_entry(url, channel, optimize_key='', revalidated=False):
+    """记录缓存项被使用；revalidated 为True时同时刷新校验时间"""
+    now = time.time()
+    with get_db_connection() as conn:
+        if revalidated:
+            conn.execute(
+                'UPDATE url_cache SET last_used = ?, validated_at = ? '
+                'WHERE url_key = ? AND channel = ? AND optimize_key = ?',
+                (now, now, normalize_source_url(url), channel, optimize_key)
+            )
+        else:
+            conn.execute(
+                'UPDATE url_cache SET last_used = ? WHERE url_key = ? AND channel = ? AND optimize_key = ?',
+                (now, normalize_source_url(url), channel, optimize_key)
+            )
+        conn.commit()
+
+def save_url_cache_entry(url, channel, result, etag=None, last_modified=None, optimize=None):
+    """保存链接按 optimize 选项上传的结果，并定期淘汰过期和多余的缓存项"""
+    global _url_cache_writes
+    now = time.time()
+    with get_db_connection() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO url_cache
+                (url_key, channel, optimize_key, file_url, width, height, etag, last_modified, validated_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (normalize_source_url(url), channel, optimize_fingerprint(optimize), result['file_url'],
+              result.get('width', 0), result.get('height', 0), etag, last_modified, now, now))
+        conn.commit()
     
-    if verify_token(token):
-        return jsonify({'status': 0, 'message': '验证有效'})
-    else:
-        return jsonify({'status': 1, 'message': '验证已过期或无效'}), 401
+    with _url_cache_lock:
+        _url_cache_writes += 1
+        if _url_cache_writes % URL_CACHE_EVICT_EVERY:
+            return
+    evict_url_cache()
 
-@app.route('/upload', methods=['POST'])
-def upload_image():
-    # 验证token
-    token = request.headers.get('X-Verification-Token')
-    if not token or not verify_token(token):
-        logger.warning("上传请求验证失败: token无效或已过期")
-        return jsonify({'status': 1, 'message': '未验证或验证已过期'}), 401
-    
-    if 'file' not in request.files:
-        logger.warning("上传请求缺少文件")
-        return jsonify({'status': 1, 'message': '没有文件'}), 400
+def evict_url_cache():
+    """删除长期未使用的缓存项，并按最近使用时间只保留 URL_CACHE_MAX_ENTRIES 项"""
+    with get_db_connection() as conn:
+        conn.execute('DELETE FROM url_cache WHERE last_used < ?', (time.time() - URL_CACHE_MAX_IDLE,))
+        conn.execute('''
+            DELETE FROM url_cache WHERE last_used < (
+                SELECT last_used FROM url_cache ORDER BY last_used DESC LIMIT 1 OFFSET ?
+            )
+        ''', (URL_CACHE_MAX_ENTRIES - 1,))
+        conn.commit()
+
+def fetch_url_image(url, uploader, max_wait=None, optimize=None):
+    """
+    获取链接图片，优先使用按相同压缩选项上传过的缓存结果
     
-    file = request.files['file']
-    if file.filename == '':
-        logger.warning("上传请求文件名为空")
-        return jsonify({'status': 1, 'message': '没有选择文件'}), 400
+    缓存在 URL_CACHE_FRESH_TTL 内直接返回；过期后带 If-None-Match / If-Modified-Since
+    重新请求，源站返回304时继续使用缓存结果。max_wait 见 download_image。
     
-    # 检查文件类型
-    if not file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')):
-        logger.warning(f"不支持的文件类型: {file.filename}")
-        return jsonify({'status': 1, 'message': '请选择支持的图片格式：JPG, PNG, GIF, BMP, WEBP'}), 400
+    返回:
+        tuple - (缓存的上传结果, None) 或 (None, 下载得到的IngestSpool)
     
-    # 获取上传渠道
-    channel = request.form.get('channel', channel_manager.get_default_channel_name())
-    logger.info(f"开始上传: 文件={file.filename}, 渠道={channel}")
+    异常:
+        UploadError - 下载失败、超出大小限制或不是图片
+    """
+    channel = uploader.get_channel_name()
+    optimize_key = optimize_fingerprint(optimize)
+    entry = get_url_cache_entry(url, channel, optimize_key)
+    cached_result = None
+    validators = None
+    if entry:
+        cached_result = {'file_url': entry['file_url'], 'width': entry['width'], 'height': entry['height'], 'cached': True}
+        if time.time() - entry['validated_at'] < URL_CACHE_FRESH_TTL:
+            touch_url_cache_entry(url, channel, optimize_key)
+            increment_stat('url_cache_hit')
+            return cached_result, None
+        validators = {}
+        if entry['etag']:
+            validators['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            validators['If-Modified-Since'] = entry['last_modified']
     
-    try:
-        # 保存临时文件
-        temp_file_name = f"temp_{uuid.uuid4().hex}{os.path.splitext(file.filename)[1]}"
-        temp_file_path = os.path.join(DATA_DIR, temp_file_name)
-        file.save(temp_file_path)
-        
-        # 获取文件大小
-        file_size = os.path.getsize(temp_file_path)
-        file_size_mb = file_size / (1024 * 1024)
-        logger.info(f"临时文件已保存: {temp_file_path}, 大小: {file_size_mb:.2f}MB")
-        
-        # 验证图片并获取正确的content_type和尺寸信息
-        img_info = validate_image(temp_file_path, file.filename)
-        if not img_info:
-            # 清理临时文件
-            try:
-                os.remove(temp_file_path)
-            except Exception as e:
-                logger.error(f"删除临时文件失败: {str(e)}")
-            logger.warning(f"图片验证失败: {file.filename}")
-            return jsonify({'status': 1, 'message': '无效的图片文件，请确保提供支持的图片格式：JPG, PNG, GIF, BMP, WEBP'}), 400
-        
-        logger.info(f"图片验证通过: {file.filename}, 尺寸: {img_info['width']}x{img_info['height']}, 格式: {img_info['format']}")
-        
-        # 创建包含验证后信息的文件对象
-        class ValidatedFile:
-            def __init__(self, original_file, img_info):
-                self.filename = original_file.filename
-                self.content_type = img_info['content_type']
-                self.width = img_info['width']
-                self.height = img_info['height']
-        
-        validated_file = ValidatedFile(file, img_info)
-        result = None
-        
-        # 根据不同的渠道进行上传
-        uploader = channel_manager.get_channel(channel)
-        if not uploader:
-            # 如果渠道不存在，使用默认渠道
-            uploader = channel_manager.get_default_channel()
-            logger.warning(f"渠道 {channel} 不存在，使用默认渠道 {uploader.get_channel_name()}")
-        
-        # 检查文件大小限制
-        size_ok, size_error = uploader.check_file_size(temp_file_path)
-        if not size_ok:
-            logger.warning(f"文件大小超出限制: {file.filename}, {file_size_mb:.2f}MB, 渠道: {uploader.get_channel_name()}")
-            # 清理临时文件
-            try:
-                os.remove(temp_file_path)
-            except Exception as e:
-                logger.error(f"删除临时文件失败: {str(e)}")
-            return jsonify({'status': 1, 'message': size_error}), 400
-        
-        logger.info(f"开始上传到渠道: {uploader.get_channel_name()}")
-        result = uploader.upload(temp_file_path, validated_file)
-        
-        # 清理临时文件
-        try:
-            os.remove(temp_file_path)
-        except Exception as e:
-            logger.error(f"删除临时文件失败: {str(e)}")
-        
-        if not result:
-            logger.error(f"上传失败: 文件={file.filename}, 渠道={uploader.get_channel_name()}, 原因=渠道返回空结果")
-            return jsonify({'status': 1, 'message': f'上传到{uploader.get_channel_name()}失败，请检查渠道配置或稍后重试'}), 500
-        
-        logger.info(f"上传成功: 文件={file.filename}, 渠道={uploader.get_channel_name()}, URL={result['file_url']}")
-        
-        # 保存上传历史
-        history_item = {
-            'id': str(uuid.uuid4()),
-            'file_name': file.filename,
-            'file_url': result['file_url'],
-            'width': result.get('width', validated_file.width),
-            'height': result.get('height', validated_file.height),
-            'file_size': file_size,
-            'channel': channel,
-            'upload_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
-        add_upload_history(history_item)
-        
-        return jsonify({
-            'status': 0,
-            'message': '上传成功',
-            'result': result
-        })
-    except Exception as e:
-        logger.error(f"上传异常: 文件={file.filename if 'file' in locals() else '未知'}, 错误={str(e)}", exc_info=True)
-        # 确保临时文件被删除
-        if 'temp_file_path' in locals() and os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-            except Exception as remove_error:
-                logger.error(f"删除临时文件失败: {str(remove_error)}")
-                
-        return jsonify({'status': 1, 'message': f'上传失败: {str(e)}'}), 500
+    spool = download_image(url, download_max_size(uploader), validators or None, max_wait)
+    if spool is None:
+        touch_url_cache_entry(url, channel, optimize_key, revalidated=True)
+        increment_stat('url_cache_revalidated')
+        return cached_result, None
+    increment_stat('url_cache_miss')
+    return None, spool
 
 @app.route('/upload_from_url', methods=['POST'])
 def upload_from_url():
-    # 临时文件路径，用于在出现异常时清理
-    temp_file_path = None
+    # 下载内容的spool，用于在出现异常时清理
+    spool = None
     
     # 验证token
     token = request.headers.get('X-Verification-Token')
@@ -735,337 +3816,513 @@ def upload_from_url():
     logger.info(f"开始URL上传: URL={url[:100]}{'...' if len(url) > 100 else ''}, 渠道={channel}")
     
     try:
-        # 配置代理（如果需要）
-        proxies = None
-        # 如果需要使用代理，可以取消下面注释并修改代理地址
-        # proxies = {
-        #     'http': 'http://your-proxy:port',
-        #     'https': 'http://your-proxy:port'
-        # }
-        
-        # 根据域名设置特定的请求头
-        headers, domain, base_domain = generate_request_headers(url)
-        
-        # 一些网站需要Cookie
-        cookies = None
-        if 'pixiv' in domain:
-            # 这里可以添加pixiv的cookies，如果有的话
-            # cookies = {'PHPSESSID': 'your_session_id'}
-            pass
-        
-        # 下载图片 - 添加重试机制和指数退避策略
-        max_retries = 3
-        retry_delay = 1.0  # 初始延迟1秒
-        last_error = None
-        
-        for retry in range(max_retries):
-            try:
-                if retry > 0:
-                    logger.info(f"重试下载 ({retry}/{max_retries}): {url}")
-                    # 指数退避，每次重试增加延迟
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                    
-                    # 重试时可能需要更新请求头
-                    if retry > 1:
-                        # 为了更好地模拟真实浏览器，重新生成请求头
-                        headers, _, _ = generate_request_headers(url)
-                
-                # 发起请求下载图片
-                response = requests.get(url, stream=True, timeout=30, proxies=proxies, headers=headers, cookies=cookies)
-                response.raise_for_status()  # 确保请求成功
-                
-                # 如果成功获取内容，跳出重试循环
-                if response.content:
-                    logger.info(f"成功下载图片: {url}")
-                    break
-                    
-                # 内容为空，继续重试
-                last_error = ValueError("下载的图片内容为空")
-                logger.warning(f"下载内容为空，将重试: {url}")
-                continue
-                
-            except requests.exceptions.Timeout as e:
-                last_error = e
-                logger.warning(f"下载超时，准备重试: {url}")
-                continue
-            except requests.exceptions.ConnectionError as e:
-                last_error = e
-                logger.warning(f"连接错误，准备重试: {url}")
-                continue
-            except requests.exceptions.HTTPError as e:
-                # 对于403 Forbidden或401 Unauthorized，可能是防盗链问题
-                if e.response.status_code in (403, 401):
-                    last_error = e
-                    logger.warning(f"访问被拒绝 (HTTP {e.response.status_code})，尝试调整请求头: {url}")
-                    
-                    # 记录当前的请求头，帮助调试
-                    logger.debug(f"当前请求头: {headers}")
-                    
-                    # 对于被拒绝的请求，尝试使用更通用的请求头或空Referer
-                    if retry == 1:
-                        headers['Referer'] = url  # 使用自身URL作为Referer
-                        logger.debug(f"尝试使用自身URL作为Referer: {url}")
-                    elif retry == 2:
-                        # 最后一次尝试，删除Referer
-                        if 'Referer' in headers:
-                            del headers['Referer']
-                            logger.debug("尝试删除Referer头")
-                    continue
-                else:
-                    raise  # 其他HTTP错误直接抛出
-            except Exception as e:
-                last_error = e
-                # 其他错误，如果有重试次数就继续
-                if retry < max_retries - 1:
-                    logger.warning(f"下载出错，准备重试: {url}, 错误: {str(e)}")
-                    continue
-                raise  # 用完重试次数，重新抛出异常
-        
-        # 用完所有重试次数仍然失败
-        if last_error is not None and 'response' not in locals():
-            if isinstance(last_error, requests.exceptions.Timeout):
-                return jsonify({'status': 1, 'message': '下载图片超时，请检查URL或稍后重试'}), 400
-            elif isinstance(last_error, requests.exceptions.ConnectionError):
-                return jsonify({'status': 1, 'message': '连接错误，无法访问图片URL'}), 400
-            elif isinstance(last_error, requests.exceptions.HTTPError):
-                return jsonify({'status': 1, 'message': f'HTTP错误: {last_error.response.status_code}'}), 400
-            else:
-                return jsonify({'status': 1, 'message': f'下载图片失败: {str(last_error)}'}), 400
-        
-        # 检查响应是否为空
-        if not response.content:
-            return jsonify({'status': 1, 'message': '下载的图片内容为空'}), 400
-            
-        # 检查内容类型
-        content_type = response.headers.get('Content-Type', '')
-        if not content_type.startswith('image/'):
-            # 如果服务器没有返回正确的content-type，尝试通过URL的扩展名判断
-            ext = os.path.splitext(url.split('?')[0])[1].lower()
-            if ext and ext in ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp']:
-                # URL有有效的图片扩展名，我们可以继续处理
-                content_type = mimetypes.guess_type(url)[0] or 'image/jpeg'
-            else:
-                # 尝试通过魔术字节来判断文件类型
-                magic_bytes = response.content[:12]
-                if (magic_bytes.startswith(b'\xff\xd8\xff') or  # JPEG
-                    magic_bytes.startswith(b'\x89PNG\r\n\x1a\n') or  # PNG
-                    magic_bytes.startswith(b'GIF8') or  # GIF
-                    magic_bytes.startswith(b'RIFF') or  # WEBP
-                    magic_bytes.startswith(b'BM')):  # BMP
-                    # 推测内容类型
-                    if magic_bytes.startswith(b'\xff\xd8\xff'):
-                        content_type = 'image/jpeg'
-                        ext = '.jpg'
-                    elif magic_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
-                        content_type = 'image/png'
-                        ext = '.png'
-                    elif magic_bytes.startswith(b'GIF8'):
-                        content_type = 'image/gif'
-                        ext = '.gif'
-                    elif magic_bytes.startswith(b'RIFF'):
-                        content_type = 'image/webp'
-                        ext = '.webp'
-                    elif magic_bytes.startswith(b'BM'):
-                        content_type = 'image/bmp'
-                        ext = '.bmp'
-                else:
-                    return jsonify({'status': 1, 'message': '链接内容不是有效的图片'}), 400
-        else:
-            # 从content_type中提取扩展名
-            ext_map = {
-                'image/jpeg': '.jpg',
-                'image/png': '.png',
-                'image/gif': '.gif',
-                'image/webp': '.webp',
-                'image/bmp': '.bmp'
-            }
-            ext = ext_map.get(content_type, '.jpg')
+        mode, uploaders = resolve_fanout_request(data.get('mode'), data.get('channels'))
+        if mode:
+            return upload_url_fanout(url, uploaders, mode, data)
         
-        try:
-            # 创建临时文件
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
-            temp_file_path = temp_file.name
-            
-            # 将图片内容写入临时文件
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    temp_file.write(chunk)
-            temp_file.close()
-        except Exception as e:
-            return jsonify({'status': 1, 'message': f'创建临时文件失败: {str(e)}'}), 400
+        uploader = resolve_uploader(channel)
+        optimize = resolve_optimize_options(data.get('optimize'), data.get('max_dimension'), uploader)
+        cached_result, spool = fetch_url_image(url, uploader, DOWNLOAD_INTERACTIVE_MAX_WAIT, optimize)
+        if cached_result:
+            logger.info(f"链接已上传过，使用缓存结果: URL={url[:100]}, 渠道={uploader.get_channel_name()}")
+            return jsonify({'status': 0, 'message': '上传成功', 'result': cached_result})
         
         # 验证图片并获取正确的content_type和尺寸信息
-        img_info = validate_image(temp_file_path, "从URL下载")
+        img_info = validate_image(spool, "从URL下载")
         if not img_info:
-            # 清理临时文件
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.remove(temp_file_path)
-                except Exception as e:
-                    logger.error(f"删除临时文件失败: {str(e)}")
+            spool.close()
             return jsonify({'status': 1, 'message': '下载的文件不是支持的图片格式：JPG, PNG, GIF, BMP, WEBP'}), 400
         
-        # 处理文件名 - 控制长度
-        try:
-            # 从URL中提取文件名
-            original_name = url.split('/')[-1].split('?')[0]
-            
-            # 去除文件扩展名以处理基础名称
-            base_name = os.path.splitext(original_name)[0]
-            
-            # 限制基础名称长度，最多保留30个字符
-            if len(base_name) > 30:
-                base_name = base_name[:30]
-            
-            # 如果基础名称为空或太短，生成一个随机名称
-            if not base_name or len(base_name) < 3:
-                base_name = f"img_{uuid.uuid4().hex[:8]}"
-                
-            # 使用验证后的扩展名构建最终文件名
-            file_name = f"{base_name}{img_info['extension']}"
-        except Exception:
-            # 如果文件名处理出错，使用安全的默认名称
-            file_name = f"image_{uuid.uuid4().hex[:8]}{img_info['extension']}"
-        
-        # 创建包含验证后信息的文件对象
-        class ValidatedFile:
-            def __init__(self, filename, img_info):
-                self.filename = filename
-                self.content_type = img_info['content_type']
-                self.width = img_info['width'] 
-                self.height = img_info['height']
-        
-        validated_file = ValidatedFile(file_name, img_info)
-        
-        # 获取文件大小
-        file_size = os.path.getsize(temp_file_path)
-        file_size_mb = file_size / (1024 * 1024)
-        logger.info(f"URL图片下载完成: 大小={file_size_mb:.2f}MB, 尺寸={img_info['width']}x{img_info['height']}")
+        file_name = build_url_file_name(url, img_info['extension'])
         
-        # 传递验证后的文件对象到上传函数
-        result = None
+        file_size_mb = spool.size / (1024 * 1024)
+        logger.info(f"URL图片下载完成: 大小={file_size_mb:.2f}MB, 尺寸={img_info['width']}x{img_info['height']}")
         
         # 根据不同的渠道进行上传
+        job_id = None
         try:
-            uploader = channel_manager.get_channel(channel)
-            if not uploader:
-                # 如果渠道不存在，使用默认渠道
-                uploader = channel_manager.get_default_channel()
-                logger.warning(f"渠道 {channel} 不存在，使用默认渠道 {uploader.get_channel_name()}")
-            
-            # 检查文件大小限制
-            size_ok, size_error = uploader.check_file_size(temp_file_path)
-            if not size_ok:
-                logger.warning(f"URL上传文件大小超出限制: {file_size_mb:.2f}MB, 渠道={uploader.get_channel_name()}")
-                return jsonify({'status': 1, 'message': size_error}), 400
-            
-            logger.info(f"开始上传到渠道: {uploader.get_channel_name()}")
-            result = uploader.upload(temp_file_path, validated_file)
-                
-            if not result:
-                logger.error(f"URL上传失败: 渠道={uploader.get_channel_name()}, 原因=渠道返回空结果")
-                return jsonify({'status': 1, 'message': f'上传到{uploader.get_channel_name()}失败，请检查渠道配置或稍后重试'}), 400
+            if is_async_requested(data.get('async')):
+                # 任务模式：下载和验证完成后立即返回任务ID
+                result, job_id = submit_upload_job(spool, file_name, uploader, img_info=img_info, optimize=optimize)
+                history_item = None
+            else:
+                result, history_item = upload_spool(spool, file_name, uploader, img_info=img_info, optimize=optimize)
+        except UploadError as e:
+            return jsonify({'status': 1, 'message': e.message}), 400
         except Exception as e:
             logger.error(f"URL上传异常: 渠道={channel}, 错误={str(e)}", exc_info=True)
             return jsonify({'status': 1, 'message': f'上传图片时发生错误: {str(e)}'}), 400
         finally:
-            # 确保无论如何都清理临时文件
-            if temp_file_path and os.path.exists(temp_file_path):
-                try:
-                    os.remove(temp_file_path)
-                except Exception as e:
-                    logger.error(f"删除临时文件失败: {str(e)}")
+            # 确保无论如何都释放spool
+            spool.close()
         
-        logger.info(f"URL上传成功: 渠道={uploader.get_channel_name()}, URL={result['file_url']}")
+        if job_id:
+            return jsonify({
+                'status': 0,
+                'message': '已加入上传队列',
+                'result': {'job_id': job_id, 'status': 'queued'}
+            }), 202
+        
+        # 保存上传历史（去重命中时没有新记录）
+        if history_item:
+            try:
+                add_upload_history(history_item)
+            except Exception as e:
+                logger.error(f"保存历史记录失败: {str(e)}")
+                # 不阻止返回上传成功的结果
         
-        # 保存上传历史
+        # 记录链接对应的上传结果，再次提交相同链接时无需重新下载和上传
         try:
-            history_item = {
-                'id': str(uuid.uuid4()),
-                'file_name': file_name,
-                'file_url': result['file_url'],
-                'width': result.get('width', validated_file.width),
-                'height': result.get('height', validated_file.height),
-                'file_size': file_size,
-                'channel': channel,
-                'upload_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            }
-            add_upload_history(history_item)
+            save_url_cache_entry(url, uploader.get_channel_name(), result, spool.etag, spool.last_modified, optimize)
         except Exception as e:
-            logger.error(f"保存历史记录失败: {str(e)}")
-            # 不阻止返回上传成功的结果
+            logger.error(f"保存链接缓存失败: {str(e)}")
         
+        response_result = {
+            'file_url': result['file_url'],
+            'width': result.get('width', 0),
+            'height': result.get('height', 0)
+        }
+        if result.get('deduplicated'):
+            response_result['deduplicated'] = True
         return jsonify({
             'status': 0,
             'message': '上传成功',
-            'result': {
-                'file_url': result['file_url'],
-                'width': result.get('width', 0),
-                'height': result.get('height', 0)
-            }
+            'result': response_result
         })
     
+    except UploadError as e:
+        logger.warning(f"URL下载被拒绝: URL={url[:100]}, 原因={e.message}")
+        if spool is not None:
+            spool.close()
+        return jsonify({'status': 1, 'message': e.message}), e.status_code
     except Exception as e:
         logger.error(f"URL上传处理异常: URL={url[:100] if 'url' in locals() else '未知'}, 错误={str(e)}", exc_info=True)
-        # 确保临时文件被删除
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-            except Exception:
-                pass
+        # 确保spool被释放
+        if spool is not None:
+            spool.close()
         
         return jsonify({'status': 1, 'message': f'处理失败: {str(e)}'}), 400
 
-def validate_image(file_path, original_filename=None):
+def upload_url_fanout(url, uploaders, mode, data):
+    """
+    将链接图片同时上传到多个渠道（不读取链接缓存，成功后为各渠道写入缓存）
+    
+    异常:
+        UploadError - 下载、验证失败或所有渠道都上传失败
+    """
+    if is_async_requested(data.get('async')):
+        raise UploadError('多渠道上传不支持任务模式')
+    optimize = resolve_optimize_options(data.get('optimize'), data.get('max_dimension'), None)
+    
+    spool = download_image(url, max(download_max_size(uploader) for uploader in uploaders),
+                           max_wait=DOWNLOAD_INTERACTIVE_MAX_WAIT)
+    try:
+        img_info = validate_image(spool, url)
+        if not img_info:
+            raise UploadError('下载的文件不是支持的图片格式：JPG, PNG, GIF, BMP, WEBP')
+        result, history_item = fanout_upload(spool, build_url_file_name(url, img_info['extension']), uploaders, mode,
+                                             img_info=img_info, optimize=optimize)
+    finally:
+        spool.close()
+    
+    if history_item:
+        add_upload_history(history_item)
+    for channel, outcome in result.get('channels', {}).items():
+        if outcome['status'] == 'succeeded':
+            save_url_cache_entry(url, channel, dict(result, file_url=outcome['file_url']), spool.etag, spool.last_modified,
+                                 optimize)
+    return jsonify({'status': 0, 'message': '上传成功', 'result': result})
+
+# ==================== 批量链接导入 ====================
+
+URL_IMPORT_MAX_URLS = 10000  # 单次导入的最大链接数
+URL_IMPORT_WORKERS = 8  # 每个worker进程同时处理的链接数
+URL_IMPORT_PER_HOST = 2  # 同一主机同时下载的链接数
+URL_IMPORT_FLUSH_SIZE = 50  # 累计多少条结果写入一次数据库
+URL_IMPORT_FLUSH_INTERVAL = 2  # 最长多久写入一次结果并刷新心跳（秒）
+URL_IMPORT_LEASE = 60  # 心跳超过该时长未更新，视为所在worker已退出，由其他worker接手（秒）
+URL_IMPORT_RETENTION = 7 * 24 * 3600  # 已完成导入任务的保留时间（秒）
+URL_IMPORT_POLL_INTERVAL = 5  # 空闲时检查待处理导入任务的间隔（秒）
+URL_IMPORT_PURGE_INTERVAL = 3600  # 清理过期导入任务的间隔（秒）
+URL_IMPORT_MAX_FAILURES = 100  # 查询进度时最多返回的失败明细数
+
+def parse_import_urls(text):
+    """
+    从文本或CSV内容中提取链接，每行可以有多列，取所有以 http(s):// 开头的单元格
+    
+    返回:
+        list - 去重后的链接，保持原有顺序
+    """
+    urls = []
+    seen = set()
+    for row in csv.reader(io.StringIO(text)):
+        for cell in row:
+            cell = cell.strip()
+            if cell.startswith(('http://', 'https://')) and cell not in seen:
+                seen.add(cell)
+                urls.append(cell)
+    return urls
+
+def import_url(url, uploader):
+    """
+    下载、验证并上传单个链接
+    
+    返回:
+        tuple - (上传结果, 待保存的历史记录；去重命中时为None)
+    
+    异常:
+        UploadError - 下载、验证或上传失败
+    """
+    # 批量导入使用渠道默认的压缩方案
+    optimize = resolve_optimize_options(None, None, uploader)
+    cached_result, spool = fetch_url_image(url, uploader, optimize=optimize)
+    if cached_result:
+        return cached_result, None
+    try:
+        img_info = validate_image(spool, url)
+        if not img_info:
+            raise UploadError('下载的文件不是支持的图片格式：JPG, PNG, GIF, BMP, WEBP')
+        result, history_item = upload_spool(spool, build_url_file_name(url, img_info['extension']), uploader,
+                                            img_info=img_info, optimize=optimize)
+    finally:
+        spool.close()
+    save_url_cache_entry(url, uploader.get_channel_name(), result, spool.etag, spool.last_modified, optimize)
+    return result, history_item
+
+class UrlImportManager:
+    """
+    批量链接导入任务
+    
+    导入任务和每条链接的状态保存在数据库中。每个worker进程有一个调度线程领取任务，
+    按主机分组调度下载：总并发不超过 URL_IMPORT_WORKERS，同一主机不超过 URL_IMPORT_PER_HOST。
+    结果和历史记录按批写入，同时刷新心跳；worker退出后心跳过期的任务由其他worker
+    接手，只继续处理尚未完成的链接。
+    """
+    
+    def __init__(self, workers=URL_IMPORT_WORKERS, per_host=URL_IMPORT_PER_HOST):
+        self.workers = workers
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._submitted = threading.Condition(self._lock)
+        self._pid = None
+        self._executor = None
+    
+    def _ensure_started(self):
+        """首次使用或fork后的子进程中启动调度线程"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='url-import')
+        threading.Thread(target=self._dispatch_loop, name='url-import-dispatch', daemon=True).start()
+    
+    def submit(self, urls, uploader):
+        """
+        创建导入任务
+        
+        返回:
+            str - 导入任务ID
+        """
+        self._ensure_started()
+        import_id = str(uuid.uuid4())
+        now = time.time()
+        with get_db_connection() as conn:
+            conn.execute('''
+                INSERT INTO url_imports (id, status, channel, total, created_at, updated_at)
+                VALUES (?, 'queued', ?, ?, ?, ?)
+            ''', (import_id, uploader.get_channel_name(), len(urls), now, now))
+            conn.executemany(
+                'INSERT INTO url_import_items (import_id, idx, url) VALUES (?, ?, ?)',
+                [(import_id, index, url) for index, url in enumerate(urls)]
+            )
+            conn.commit()
+        with self._submitted:
+            self._submitted.notify()
+        logger.info(f"批量导入已创建: 任务={import_id}, 链接数={len(urls)}, 渠道={uploader.get_channel_name()}")
+        return import_id
+    
+    def _dispatch_loop(self):
+        last_purge = 0
+        while True:
+            try:
+                if time.time() - last_purge >= URL_IMPORT_PURGE_INTERVAL:
+                    last_purge = time.time()
+                    self.purge_finished_imports()
+                
+                job = self._claim()
+                if job is None:
+                    with self._submitted:
+                        self._submitted.wait(URL_IMPORT_POLL_INTERVAL)
+                    continue
+                self._run(job)
+            except Exception as e:
+                logger.error(f"批量导入调度异常: {str(e)}", exc_info=True)
+                time.sleep(URL_IMPORT_POLL_INTERVAL)
+    
+    def _claim(self):
+        """领取排队中或心跳已过期的导入任务"""
+        claim = uuid.uuid4().hex
+        now = time.time()
+        with get_db_connection() as conn:
+            conn.execute('''
+                UPDATE url_imports SET status = 'running', claimed_by = ?, updated_at = ?
+                WHERE id = (
+                    SELECT id FROM url_imports
+                    WHERE status = 'queued' OR (status = 'running' AND updated_at < ?)
+                    ORDER BY created_at LIMIT 1
+                )
+            ''', (claim, now, now - URL_IMPORT_LEASE))
+            conn.commit()
+            return conn.execute('SELECT * FROM url_imports WHERE claimed_by = ?', (claim,)).fetchone()
+    
+    def _run(self, job):
+        import_id = job['id']
+        uploader = resolve_uploader(job['channel'])
+        with get_db_connection() as conn:
+            pending = conn.execute(
+                "SELECT idx, url FROM url_import_items WHERE import_id = ? AND status = 'pending' ORDER BY idx",
+                (import_id,)
+            ).fetchall()
+        if job['succeeded'] or job['failed']:
+            logger.info(f"继续批量导入: 任务={import_id}, 剩余={len(pending)}/{job['total']}")
+        
+        # 按主机分组的待下载队列
+        host_queues = OrderedDict()
+        for row in pending:
+            host_queues.setdefault(urlparse(row['url']).netloc.lower(), []).append((row['idx'], row['url']))
+        for queue in host_queues.values():
+            queue.reverse()
+        
+        host_running = {}
+        in_flight = {}
+        results = []
+        last_flush = time.time()
+        try:
+            while host_queues or in_flight:
+                # 在总并发和单主机并发限制内提交下载
+                for host in list(host_queues):
+                    queue = host_queues[host]
+                    while queue and len(in_flight) < self.workers and host_running.get(host, 0) < self.per_host:
+                        index, url = queue.pop()
+                        in_flight[self._executor.submit(import_url, url, uploader)] = (index, url, host)
+                        host_running[host] = host_running.get(host, 0) + 1
+                    if not queue:
+                        del host_queues[host]
+                
+                done, _ = wait(in_flight, timeout=URL_IMPORT_FLUSH_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, url, host = in_flight.pop(future)
+                    host_running[host] -= 1
+                    try:
+                        result, history_item = future.result()
+                        results.append((index, result['file_url'], None, history_item))
+                    except UploadError as e:
+                        results.append((index, None, e.message, None))
+                    except Exception as e:
+                        logger.error(f"导入链接异常: URL={url[:100]}, 错误={str(e)}", exc_info=True)
+                        results.append((index, None, f'处理失败: {str(e)}', None))
+                
+                if len(results) >= URL_IMPORT_FLUSH_SIZE or time.time() - last_flush >= URL_IMPORT_FLUSH_INTERVAL:
+                    if not self._flush(job, results):
+                        logger.warning(f"批量导入已被其他worker接手，停止处理: 任务={import_id}")
+                        return
+                    results = []
+                    last_flush = time.time()
+            
+            self._flush(job, results, finished=True)
+            logger.info(f"批量导入完成: 任务={import_id}")
+        finally:
+            # 异常退出时等待已提交的链接处理完，避免与接手的worker同时处理
+            for future in in_flight:
+                future.cancel()
+            wait(in_flight)
+    
+    def _flush(self, job, results, finished=False):
+        """
+        写入一批结果并刷新心跳，任务已被其他worker接手时返回False
+        
+        先写历史记录再标记链接完成：两步之间中断时，重新处理该链接会命中内容去重
+        """
+        history_items = [item for _, _, _, item in results if item]
+        if history_items:
+            add_upload_history_batch(history_items)
+        
+        succeeded = sum(1 for _, file_url, _, _ in results if file_url)
+        with get_db_connection() as conn:
+            cursor = conn.execute('''
+                UPDATE url_imports SET succeeded = succeeded + ?, failed = failed + ?, status = ?, updated_at = ?
+                WHERE id = ? AND claimed_by = ?
+            ''', (succeeded, len(results) - succeeded, 'completed' if finished else 'running',
+                  time.time(), job['id'], job['claimed_by']))
+            if cursor.rowcount == 0:
+                conn.rollback()
+                return False
+            conn.executemany('''
+                UPDATE url_import_items SET status = ?, file_url = ?, error = ?
+                WHERE import_id = ? AND idx = ?
+            ''', [('succeeded' if file_url else 'failed', file_url, error, job['id'], index)
+                  for index, file_url, error, _ in results])
+            conn.commit()
+        return True
+    
+    def purge_finished_imports(self):
+        """删除超过保留时间的已完成导入任务"""
+        with get_db_connection() as conn:
+            conn.execute('''
+                DELETE FROM url_import_items WHERE import_id IN (
+                    SELECT id FROM url_imports WHERE status = 'completed' AND updated_at < ?
+                )
+            ''', (time.time() - URL_IMPORT_RETENTION,))
+            conn.execute(
+                "DELETE FROM url_imports WHERE status = 'completed' AND updated_at < ?",
+                (time.time() - URL_IMPORT_RETENTION,)
+            )
+            conn.commit()
+    
+    def get(self, import_id):
+        """
+        查询导入进度
+        
+        返回:
+            dict or None - 进度信息，不存在时返回None
+        """
+        self._ensure_started()
+        with get_db_connection() as conn:
+            row = conn.execute('SELECT * FROM url_imports WHERE id = ?', (import_id,)).fetchone()
+            if row is None:
+                return None
+            failures = conn.execute('''
+                SELECT idx, url, error FROM url_import_items
+                WHERE import_id = ? AND status = 'failed' ORDER BY idx LIMIT ?
+            ''', (import_id, URL_IMPORT_MAX_FAILURES)).fetchall()
+        return {
+            'import_id': row['id'],
+            'status': row['status'],
+            'channel': row['channel'],
+            'total': row['total'],
+            'succeeded': row['succeeded'],
+            'failed': row['failed'],
+            'pending': row['total'] - row['succeeded'] - row['failed'],
+            'created_at': datetime.fromtimestamp(row['created_at']).strftime('%Y-%m-%d %H:%M:%S'),
+            'updated_at': datetime.fromtimestamp(row['updated_at']).strftime('%Y-%m-%d %H:%M:%S'),
+            'failures': [{'index': item['idx'], 'url': item['url'], 'message': item['error']} for item in failures]
+        }
+
+url_import_manager = UrlImportManager()
+
+@app.route('/import/urls', methods=['POST'])
+def import_urls():
+    """
+    批量链接导入接口
+    
+    请求:
+        JSON {urls: [...], channel} 或表单 {file: 文本/CSV文件, channel}
+    
+    返回:
+        202，result: {import_id, total}；通过 GET /import/<import_id> 查询进度
+    """
+    # 验证token
+    token = request.headers.get('X-Verification-Token')
+    if not token or not verify_token(token):
+        logger.warning("批量导入请求验证失败: token无效或已过期")
+        return jsonify({'status': 1, 'message': '未验证或验证已过期'}), 401
+    
+    if 'file' in request.files:
+        try:
+            text = request.files['file'].read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return jsonify({'status': 1, 'message': '链接文件必须是UTF-8编码的文本或CSV'}), 400
+        channel = request.form.get('channel', channel_manager.get_default_channel_name())
+    else:
+        data = request.get_json(silent=True) or {}
+        urls = data.get('urls')
+        if not isinstance(urls, list):
+            return jsonify({'status': 1, 'message': '无效的请求参数'}), 400
+        text = '\n'.join(str(url) for url in urls)
+        channel = data.get('channel', channel_manager.get_default_channel_name())
+    
+    urls = parse_import_urls(text)
+    if not urls:
+        return jsonify({'status': 1, 'message': '没有找到有效的图片链接'}), 400
+    if len(urls) > URL_IMPORT_MAX_URLS:
+        return jsonify({'status': 1, 'message': f'单次最多导入 {URL_IMPORT_MAX_URLS} 个链接'}), 400
+    
+    import_id = url_import_manager.submit(urls, resolve_uploader(channel))
+    return jsonify({
+        'status': 0,
+        'message': '导入任务已创建',
+        'result': {'import_id': import_id, 'total': len(urls)}
+    }), 202
+
+@app.route('/import/<import_id>', methods=['GET'])
+def get_url_import(import_id):
+    """查询批量导入进度"""
+    # 验证token
+    token = request.headers.get('X-Verification-Token')
+    if not token or not verify_token(token):
+        return jsonify({'status': 1, 'message': '未验证或验证已过期'}), 401
+    
+    progress = url_import_manager.get(import_id)
+    if progress is None:
+        return jsonify({'status': 1, 'message': '导入任务不存在或已过期'}), 404
+    
+    return jsonify({
+        'status': 0,
+        'message': 'success',
+        'result': progress
+    })
+
+def validate_image(source, original_filename=None):
     """
     验证文件是否为有效图片，并返回正确的content_type和图片信息
     
     参数:
-        file_path: 图片文件的路径
+        source: 图片文件的路径，或可随机读取的二进制文件对象（读取后会重新定位到开头）
         original_filename: 原始文件名，用于记录日志
         
     返回:
         dict: 包含content_type, width, height等信息的字典，如果验证失败则返回None
     """
     try:
-        # 使用PIL打开图片以验证是否为有效图片
-        img = Image.open(file_path)
+        # 优先只解析文件头获取格式和尺寸，识别不了的情况再交给PIL
+        if hasattr(source, 'seek'):
+            img_info = probe_image(source)
+        else:
+            with open(source, 'rb') as f:
+                img_info = probe_image(f)
+        if img_info:
+            logger.info(f"图片验证成功: {original_filename}, 格式: {img_info['format']}, 尺寸: {img_info['width']}x{img_info['height']}")
+            return img_info
         
-        # 获取图片格式和尺寸
-        img_format = img.format.lower() if img.format else None
-        width, height = img.size
+        # 使用PIL打开图片以验证是否为有效图片，只解析文件头，不解码像素
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        with Image.open(source) as img:
+            # 获取图片格式和尺寸
+            img_format = img.format.lower() if img.format else None
+            width, height = img.size
+        if hasattr(source, 'seek'):
+            source.seek(0)
         
         # 验证图片格式是否为支持的类型
-        supported_formats = {'jpeg': 'image/jpeg', 'jpg': 'image/jpeg', 'png': 'image/png', 
-                           'gif': 'image/gif', 'webp': 'image/webp', 'bmp': 'image/bmp'}
-        
-        if not img_format or img_format.lower() not in supported_formats:
+        if not img_format or img_format not in SUPPORTED_IMAGE_FORMATS:
             logger.warning(f"不支持的图片格式: {img_format}, 文件: {original_filename}")
             return None
-            
-        # 获取正确的content_type
-        content_type = supported_formats.get(img_format.lower(), 'image/jpeg')
+        
+        # 获取正确的content_type和扩展名
+        content_type, extension = SUPPORTED_IMAGE_FORMATS[img_format]
         
         # 构建图片信息
         img_info = {
             'content_type': content_type,
             'width': width,
             'height': height,
-            'format': img_format.lower()
+            'format': img_format,
+            'extension': extension
         }
         
-        # 确定扩展名
-        ext_map = {
-            'jpeg': '.jpg',
-            'jpg': '.jpg',
-            'png': '.png',
-            'gif': '.gif',
-            'webp': '.webp',
-            'bmp': '.bmp'
-        }
-        img_info['extension'] = ext_map.get(img_format.lower(), '.jpg')
-        
         logger.info(f"图片验证成功: {original_filename}, 格式: {img_format}, 尺寸: {width}x{height}")
         return img_info
     except UnidentifiedImageError:
@@ -1083,8 +4340,63 @@ def get_history():
     if not token or not verify_token(token):
         return jsonify({'status': 1, 'message': '未验证或验证已过期'}), 401
     
-    history = get_upload_history()
-    return jsonify({'status': 0, 'message': 'success', 'result': history})
+    # 分页参数：cursor 为上一页返回的游标，page 仅用于跳页
+    cursor = request.args.get('cursor', '').strip() or None
+    page = request.args.get('page', type=int)
+    limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    
+    if cursor and not decode_history_cursor(cursor):
+        return jsonify({'status': 1, 'message': '无效的分页游标'}), 400
+    
+    # 缩略图的显示尺寸（已乘以设备像素比），用于向图床请求合适大小的缩略图
+    thumb_width = request.args.get('thumb_w', type=int)
+    thumb_height = request.args.get('thumb_h', type=int)
+    thumb_size = None
+    if thumb_width and thumb_height and thumb_width > 0 and thumb_height > 0:
+        thumb_size = (min(thumb_width, THUMB_HINT_MAX_SIZE), min(thumb_height, THUMB_HINT_MAX_SIZE))
+    
+    items, next_cursor = get_upload_history_page(cursor=cursor, limit=limit, page=page, thumb_size=thumb_size)
+    return jsonify({
+        'status': 0,
+        'message': 'success',
+        'result': {
+            'items': items,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None,
+            'total': get_history_total_count(),
+            'page_size': limit
+        }
+    })
+
+@app.route('/thumb/<item_id>', methods=['GET'])
+def get_history_thumbnail(item_id):
+    """
+    上传记录的缩略图
+    
+    记录ID不可猜测，与图床链接一样无需验证即可访问，便于 <img> 直接引用；
+    没有本地缩略图时重定向到渠道图床缩放后的图片，渠道不支持图片处理时重定向到原图
+    """
+    with get_db_connection() as conn:
+        row = conn.execute('SELECT id, file_url, width, height, channel, content_hash FROM upload_history WHERE id = ?',
+                           (item_id,)).fetchone()
+    if row is None:
+        return jsonify({'status': 1, 'message': '找不到指定记录'}), 404
+    
+    thumbnail = get_thumbnail(row['content_hash']) if row['content_hash'] else None
+    if thumbnail:
+        path, image_format = thumbnail
+        try:
+            response = send_file(path, mimetype=OUTPUT_IMAGE_FORMATS[image_format][0], conditional=True)
+            response.headers['Cache-Control'] = f'public, max-age={THUMB_HTTP_MAX_AGE}, immutable'
+            return response
+        except FileNotFoundError:
+            # 文件已被其他worker淘汰或手动删除
+            remove_thumbnail(row['content_hash'], image_format)
+    
+    response = redirect(history_thumbnail_url(dict(row), False) or row['file_url'], code=302)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/delete_history/<item_id>', methods=['DELETE'])
 def delete_history_item(item_id):
@@ -1108,6 +4420,58 @@ def clear_history():
     clear_all_history()
     return jsonify({'status': 0, 'message': '清除成功'})
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Prometheus 文本格式的运行指标，汇总所有worker进程
+    
+    设置了 METRICS_TOKEN 时需要请求头 Authorization: Bearer <METRICS_TOKEN>
+    """
+    if METRICS_TOKEN and not secrets.compare_digest(request.headers.get('Authorization', ''),
+                                                    f'Bearer {METRICS_TOKEN}'):
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    response = Response(metrics_registry.export(), content_type=metrics.CONTENT_TYPE)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/api/stats', methods=['GET'])
+def upload_stats():
+    # 验证token
+    token = request.headers.get('X-Verification-Token')
+    if not token or not verify_token(token):
+        return jsonify({'status': 1, 'message': '未验证或验证已过期'}), 401
+    
+    stats = get_stats()
+    hits = stats.get('dedup_hit', 0)
+    misses = stats.get('dedup_miss', 0)
+    lookups = hits + misses
+    return jsonify({
+        'status': 0,
+        'message': 'success',
+        'result': {
+            'dedup': {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0
+            },
+            'url_cache': {
+                'hits': stats.get('url_cache_hit', 0),
+                'revalidated': stats.get('url_cache_revalidated', 0),
+                'misses': stats.get('url_cache_miss', 0)
+            },
+            # 上传前压缩/转码累计节省的字节数
+            'optimize_bytes_saved': stats.get('optimize_bytes_saved', 0),
+            # 当前worker进程内各渠道的连接复用情况
+            'channels': channel_manager.get_http_stats(),
+            # 当前worker进程内链接下载的各主机统计
+            'download_hosts': download_client.stats(),
+            # 当前worker进程内各渠道最近的耗时、成功率和熔断状态，用于自动选择渠道
+            'channel_health': channel_manager.get_health_stats(),
+            # 最近7天多渠道上传中各渠道的成功率和耗时
+            'fanout_channels': get_channel_upload_stats()
+        }
+    })
+
 def generate_request_headers(url, use_smart_referer=True):
     """
     生成用于图片下载的请求头，智能处理防盗链
@@ -1241,5 +4605,25 @@ def generate_request_headers(url, use_smart_referer=True):
     
     return headers, domain, base_domain
 
+# ==================== 后台任务 ====================
+
+def start_background_workers():
+    """
+    启动上传任务队列和批量链接导入的后台线程
+    
+    只在处理请求的进程中启动：gunicorn 在每个worker加载应用后由 gunicorn.conf.py 的
+    post_worker_init 钩子调用，重启前排队或执行中的任务、未完成的导入无需等待新的请求
+    即可继续执行和接手；其他服务器在收到第一个请求时启动。导入模块时不启动，
+    使用 --preload 时master进程不运行任务，也不会在持有锁时fork出worker
+    """
+    upload_job_queue._ensure_started()
+    url_import_manager._ensure_started()
+
+@app.before_request
+def ensure_background_workers():
+    # 已启动时只是一次pid比较
+    start_background_workers()
+
 if __name__ == '__main__':
+    start_background_workers()
     app.run(debug=False, host='0.0.0.0', port=5500) 
\ No newline at end of file
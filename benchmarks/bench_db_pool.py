@@ -0,0 +1,132 @@
+"""
+数据库连接池基准测试
+对比每次调用新建连接（旧实现）与线程本地连接复用（当前实现）
+在 /api/random 和 /upload 上的吞吐量（请求/秒）
+
+用法:
+    python benchmarks/bench_db_pool.py [--requests 2000] [--threads 4] [--rows 20000]
+
+说明:
+    使用临时数据目录，不会修改 data/ 下的数据；
+    /upload 使用本地桩渠道，不会产生任何外部网络请求。
+"""
+import argparse
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# 必须在导入 app 之前设置数据目录
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='fusionpic_bench_')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging  # noqa: E402
+from PIL import Image  # noqa: E402
+import app as app_module  # noqa: E402
+from channels import BaseChannel  # noqa: E402
+
+logging.getLogger('image_uploader').setLevel(logging.WARNING)
+logging.getLogger().setLevel(logging.WARNING)
+
+
+class StubChannel(BaseChannel):
+    """本地桩渠道，直接返回固定URL"""
+
+    def get_channel_name(self):
+        return "bench"
+
+    def upload(self, temp_file_path, file):
+        return {'file_url': f"https://bench.invalid/{uuid.uuid4().hex}.png",
+                'width': file.width, 'height': file.height}
+
+
+@contextmanager
+def unpooled_get_db_connection():
+    """旧实现：每次调用都新建连接"""
+    conn = sqlite3.connect(app_module.DATABASE_FILE, timeout=10)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def seed_history(rows):
+    """写入测试用的历史记录"""
+    conn = sqlite3.connect(app_module.DATABASE_FILE)
+    records = []
+    for i in range(rows):
+        width, height = (1920, 1080) if i % 2 else (1080, 1920)
+        records.append((str(uuid.uuid4()), f"img_{i}.png", f"https://bench.invalid/{i}.png",
+                        width, height, 1024, 'bench', f"2024-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}",
+                        app_module.compute_aspect_ratio(width, height),
+                        app_module.classify_orientation(width, height)))
+    conn.executemany('''
+        INSERT INTO upload_history
+        (id, file_name, file_url, width, height, file_size, channel, upload_time, aspect_ratio, orientation)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', records)
+    conn.commit()
+    conn.close()
+
+
+def make_png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (200, 100, 50)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def run(name, total, threads, make_request):
+    """并发执行请求并返回每秒请求数"""
+    def worker(count):
+        client = app_module.app.test_client()
+        for _ in range(count):
+            response = make_request(client)
+            assert response.status_code in (200, 302), response.get_data(as_text=True)
+
+    per_thread = total // threads
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(worker, [per_thread] * threads))
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='每个场景的请求总数')
+    parser.add_argument('--threads', type=int, default=4, help='并发线程数（对应gunicorn --threads）')
+    parser.add_argument('--rows', type=int, default=20000, help='预置的历史记录数')
+    args = parser.parse_args()
+
+    app_module.channel_manager.register(StubChannel())
+    seed_history(args.rows)
+    token = app_module.generate_token()
+    app_module.add_valid_token(token, time.time(), time.time() + 3600)
+    png = make_png()
+
+    scenarios = {
+        '/api/random': lambda c: c.get('/api/random?orientation=landscape'),
+        '/upload': lambda c: c.post('/upload', headers={'X-Verification-Token': token},
+                                    data={'channel': 'bench', 'file': (io.BytesIO(png), 'bench.png')},
+                                    content_type='multipart/form-data'),
+    }
+    pooled_get_db_connection = app_module.get_db_connection
+
+    print(f"记录数={args.rows}, 请求数={args.requests}, 线程数={args.threads}")
+    print(f"{'接口':<14}{'新建连接 req/s':>18}{'连接复用 req/s':>18}{'提升':>10}")
+    for path, make_request in scenarios.items():
+        app_module.get_db_connection = unpooled_get_db_connection
+        before = run(path, args.requests, args.threads, make_request)
+        app_module.get_db_connection = pooled_get_db_connection
+        after = run(path, args.requests, args.threads, make_request)
+        print(f"{path:<14}{before:>18.1f}{after:>18.1f}{after / before:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
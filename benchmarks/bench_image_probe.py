@@ -0,0 +1,106 @@
+"""
+图片验证基准测试
+对比 validate_image 中只解析文件头的 probe_image（当前实现）
+与 PIL Image.open（原实现）获取格式和尺寸的耗时
+
+用法:
+    python benchmarks/bench_image_probe.py [--iterations 2000]
+
+说明:
+    样本图片在临时目录中现场生成，覆盖 JPEG（基线/渐进式/大EXIF）、PNG、GIF、
+    WebP（有损/无损/带透明通道）、BMP（自下而上/自上而下）；
+    计时前先校验两种实现对每个样本得到的格式和尺寸完全一致。
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+# 必须在导入 app 之前设置数据目录
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='fusionpic_bench_')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging  # noqa: E402
+from PIL import Image  # noqa: E402
+import app as app_module  # noqa: E402
+
+logging.getLogger('image_uploader').setLevel(logging.WARNING)
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def encode(image, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, **params)
+    return buffer.getvalue()
+
+
+def build_corpus():
+    """生成样本图片，返回 {名称: 文件内容}"""
+    photo = Image.radial_gradient('L').resize((1920, 1080)).convert('RGB')
+    small = photo.resize((320, 240))
+    alpha = small.convert('RGBA')
+    exif = Image.Exif()
+    exif[0x010E] = 'x' * 60000  # ImageDescription，使SOF位于60KB之后
+    top_down = bytearray(encode(small, format='BMP'))
+    top_down[22:26] = (-240).to_bytes(4, 'little', signed=True)
+
+    return {
+        'jpeg-baseline': encode(photo, format='JPEG', quality=85),
+        'jpeg-progressive': encode(photo, format='JPEG', quality=85, progressive=True),
+        'jpeg-large-exif': encode(small, format='JPEG', exif=exif.tobytes()),
+        'png-rgb': encode(photo, format='PNG'),
+        'png-rgba': encode(alpha, format='PNG'),
+        'gif': encode(small.convert('P'), format='GIF'),
+        'webp-lossy': encode(photo, format='WEBP', quality=80),
+        'webp-lossless': encode(small, format='WEBP', lossless=True),
+        'webp-alpha': encode(alpha, format='WEBP'),
+        'bmp': encode(small, format='BMP'),
+        'bmp-top-down': bytes(top_down),
+    }
+
+
+def pil_probe(stream):
+    """原实现：PIL 打开文件读取格式和尺寸"""
+    stream.seek(0)
+    with Image.open(stream) as img:
+        result = img.format.lower(), img.size
+    stream.seek(0)
+    return result
+
+
+def time_per_call(func, stream, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(stream)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000, help='每个样本的调用次数')
+    args = parser.parse_args()
+
+    corpus = build_corpus()
+
+    # 两种实现的结果必须一致
+    for name, data in corpus.items():
+        stream = io.BytesIO(data)
+        probed = app_module.probe_image(stream)
+        assert probed is not None, f"{name}: probe_image 未能识别"
+        expected = pil_probe(stream)
+        actual = (probed['format'], (probed['width'], probed['height']))
+        assert actual == expected, f"{name}: probe_image={actual}, PIL={expected}"
+
+    print(f"样本数={len(corpus)}, 每个样本调用次数={args.iterations}")
+    print(f"{'样本':<20}{'大小':>10}{'PIL us/次':>14}{'文件头 us/次':>16}{'提升':>10}")
+    for name, data in corpus.items():
+        stream = io.BytesIO(data)
+        before = time_per_call(pil_probe, stream, args.iterations)
+        after = time_per_call(app_module.probe_image, stream, args.iterations)
+        print(f"{name:<20}{len(data) / 1024:>8.0f}KB{before:>14.1f}{after:>16.1f}{before / after:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""
+米游社渠道缓存基准测试
+对比不缓存、只缓存最终链接、同时缓存上传参数和最终链接三种配置下
+重复上传相同内容的耗时和发往远端的请求数
+
+用法:
+    python benchmarks/bench_miyoushe_cache.py [--files 20] [--rounds 5] [--latency 30] [--failure-rate 0.3]
+
+说明:
+    getUploadParams 接口和 OSS 由本地桩服务器模拟，每个请求额外等待 --latency 毫秒
+    以模拟网络往返；--files 个不同的文件各上传 --rounds 次（如清空历史记录后重新上传、
+    未命中去重的重复上传）。桩服务器返回的上传参数带有一小时后过期的 expire 和 policy。
+    OSS 以 --failure-rate 的概率返回 503，失败的上传立即重试（最多 5 次）：
+    链接缓存只在上传成功后生效，上传参数缓存省去的是重试时重新获取参数的请求。
+"""
+import argparse
+import base64
+import hashlib
+import http.server
+import io
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from channels.miyoushe import MiyousheChannel  # noqa: E402
+
+logging.getLogger().setLevel(logging.WARNING)
+# 模拟的 OSS 失败会被渠道记录为错误日志，不输出
+logging.getLogger('image_uploader').setLevel(logging.CRITICAL)
+
+
+class StubServer:
+    """模拟 getUploadParams 接口和 OSS 上传"""
+
+    def __init__(self, latency, failure_rate):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.counts = {'params': 0, 'oss': 0}
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                time.sleep(stub.latency)
+                status, content_type = 200, 'application/json'
+                if self.path == '/getUploadParams':
+                    stub.count('params')
+                    data = json.dumps(stub.upload_params(json.loads(body))).encode()
+                elif stub.fail():
+                    stub.count('oss')
+                    status, content_type = 503, 'application/xml'
+                    data = b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>ServiceUnavailable</Code></Error>'
+                else:
+                    stub.count('oss')
+                    data = json.dumps({'retcode': 0, 'data': {'url': f'https://upload-bbs.miyoushe.com{self.path}'}}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def fail(self):
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+    def upload_params(self, request):
+        expire = int(time.time()) + 3600
+        expiration = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(expire))
+        policy = base64.b64encode(json.dumps({'expiration': expiration}).encode()).decode()
+        file_name = f"{request['md5']}.{request['ext']}"
+        return {'retcode': 0, 'data': {
+            'file_name': file_name,
+            'params': {
+                'host': f'{self.base_url}/oss/{file_name}',
+                'accessid': 'stub',
+                'policy': policy,
+                'signature': 'stub',
+                'expire': expire,
+            }
+        }}
+
+    def reset(self):
+        self.counts = {'params': 0, 'oss': 0}
+        self._random = random.Random(0)
+
+
+def build_files(count):
+    files = []
+    for i in range(count):
+        data = os.urandom(64 * 1024)
+        files.append((data, SimpleNamespace(
+            filename=f'bench-{i}.png', extension='.png', content_type='image/png',
+            width=100, height=100, size=len(data), md5=hashlib.md5(data).hexdigest()
+        )))
+    return files
+
+
+def run(channel_class, stub, files, rounds):
+    channel = channel_class(cookie='stub=1')
+    channel.GET_UPLOAD_PARAMS_URL = f'{stub.base_url}/getUploadParams'
+    stub.reset()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data, file in files:
+            for _ in range(5):
+                result = channel.upload(io.BytesIO(data), file)
+                if result:
+                    break
+            assert result and result['file_url'], "上传失败"
+    elapsed = time.perf_counter() - start
+    return elapsed / (rounds * len(files)) * 1000, dict(stub.counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=20, help='不同文件数')
+    parser.add_argument('--rounds', type=int, default=5, help='每个文件的上传次数')
+    parser.add_argument('--latency', type=float, default=30, help='桩服务器每个请求的延迟（毫秒）')
+    parser.add_argument('--failure-rate', type=float, default=0.3, help='OSS 上传失败的概率')
+    args = parser.parse_args()
+
+    stub = StubServer(args.latency / 1000, args.failure_rate)
+    files = build_files(args.files)
+    configs = [
+        ('不缓存', {'URL_CACHE_SIZE': 0, 'PARAMS_CACHE_SIZE': 0}),
+        ('只缓存链接', {'PARAMS_CACHE_SIZE': 0}),
+        ('参数+链接缓存', {}),
+    ]
+
+    total = args.files * args.rounds
+    print(f"文件数={args.files}, 每个文件上传次数={args.rounds}, 请求延迟={args.latency:.0f}ms, "
+          f"OSS失败率={args.failure_rate:.0%}")
+    print(f"{'配置':<16}{'ms/次':>10}{'getUploadParams':>18}{'OSS':>8}")
+    baseline = None
+    for name, overrides in configs:
+        channel_class = type('BenchMiyousheChannel', (MiyousheChannel,), overrides)
+        per_upload, counts = run(channel_class, stub, files, args.rounds)
+        baseline = baseline or per_upload
+        print(f"{name:<16}{per_upload:>10.1f}{counts['params']:>12}/{total:<5}{counts['oss']:>8}"
+              f"   {baseline / per_upload:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
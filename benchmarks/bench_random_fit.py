@@ -0,0 +1,111 @@
+"""
+按屏幕尺寸选图基准测试
+对比 /api/random 只按方向选择（原实现）与按宽高比和分辨率选择（pick_best_fit）
+返回的图片能否覆盖屏幕、平均像素数（传输量的近似）、宽高比偏差、结果的随机性和耗时
+
+用法:
+    python benchmarks/bench_random_fit.py [--rows 20000] [--picks 2000]
+
+说明:
+    使用临时数据目录，写入 --rows 条尺寸随机的历史记录（常见的照片/壁纸宽高比，
+    长边 600-8000 像素），对几种常见屏幕各选择 --picks 次。
+    "不同图片数" 越接近选择次数，说明结果越不可预测。
+    按尺寸选择的候选只是宽高比和分辨率接近的一部分图片，不同图片数低于按方向选择；
+    低于按方向选择的 --min-distinct-ratio 倍时视为候选池过窄，以非零状态退出。
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+# 必须在导入 app 之前设置数据目录
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='fusionpic_bench_')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import logging  # noqa: E402
+import app as app_module  # noqa: E402
+
+logging.getLogger('image_uploader').setLevel(logging.WARNING)
+logging.getLogger().setLevel(logging.WARNING)
+
+SCREENS = {
+    '1080p': (1920, 1080),
+    '4K': (3840, 2160),
+    '带鱼屏': (3440, 1440),
+    '手机': (1170, 2532),
+    '平板竖屏': (1640, 2360),
+}
+ASPECTS = (16 / 9, 3 / 2, 4 / 3, 21 / 9, 1, 9 / 16, 2 / 3, 3 / 4, 9 / 19.5)
+
+
+def seed_history(rows):
+    """写入尺寸随机的历史记录"""
+    items = []
+    for i in range(rows):
+        aspect = random.choice(ASPECTS)
+        long_edge = int(math.exp(random.uniform(math.log(600), math.log(8000))))
+        width, height = (long_edge, round(long_edge / aspect)) if aspect >= 1 else (round(long_edge * aspect), long_edge)
+        items.append({
+            'id': uuid.uuid4().hex, 'file_name': f'bench-{i}.jpg', 'file_url': f'https://bench.invalid/{i}.jpg',
+            'width': width, 'height': height, 'channel': 'bench', 'file_size': 0,
+            'upload_time': '2024-01-01 00:00:00', 'content_hash': uuid.uuid4().hex,
+            'orientation': app_module.classify_orientation(width, height),
+        })
+    app_module.add_upload_history_batch(items)
+
+
+def measure(pick, screen, picks):
+    width, height = screen
+    covered = pixels = aspect_error = 0
+    seen = set()
+    start = time.perf_counter()
+    images = [pick() for _ in range(picks)]
+    elapsed = (time.perf_counter() - start) / picks * 1e6
+    for image in images:
+        covered += image['width'] >= width and image['height'] >= height
+        pixels += image['width'] * image['height']
+        aspect_error += abs(math.log((image['width'] / image['height']) / (width / height)))
+        seen.add(image['id'])
+    return covered / picks * 100, pixels / picks / 1e6, (math.exp(aspect_error / picks) - 1) * 100, len(seen), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000, help='历史记录条数')
+    parser.add_argument('--picks', type=int, default=2000, help='每种屏幕的选择次数')
+    parser.add_argument('--min-distinct-ratio', type=float, default=0.35,
+                        help='按尺寸选择的不同图片数至少为按方向选择的多少倍')
+    args = parser.parse_args()
+
+    seed_history(args.rows)
+    index = app_module.random_image_index
+
+    print(f"记录数={args.rows}, 每种屏幕选择次数={args.picks}")
+    print(f"{'屏幕':<10}{'方式':<8}{'覆盖屏幕':>10}{'平均像素':>10}{'宽高比偏差':>12}{'不同图片数':>12}{'us/次':>8}")
+    failures = []
+    for name, screen in SCREENS.items():
+        orientation = 'landscape' if screen[0] > screen[1] else 'portrait'
+        methods = (
+            ('按方向', lambda: index.pick(orientation=orientation)),
+            ('按尺寸', lambda: index.pick_best_fit(*screen)[0]),
+        )
+        distinct_counts = []
+        for method, pick in methods:
+            covered, megapixels, aspect_error, distinct, elapsed = measure(pick, screen, args.picks)
+            distinct_counts.append(distinct)
+            print(f"{name:<10}{method:<8}{covered:>9.1f}%{megapixels:>9.1f}M{aspect_error:>11.1f}%"
+                  f"{distinct:>12}{elapsed:>8.1f}")
+        if distinct_counts[1] < distinct_counts[0] * args.min_distinct_ratio:
+            failures.append(f"{name}: 按尺寸 {distinct_counts[1]} 张 < 按方向 {distinct_counts[0]} 张 × {args.min_distinct_ratio}")
+
+    if failures:
+        print("不同图片数过少:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,15 @@
 上传渠道管理器
 负责注册和管理所有上传渠道
 """
-from .base import BaseChannel
+import atexit
+import random
+import threading
+import time
+
+from .auto import AutoChannel
+from .base import BaseChannel, is_cancelled
 from .chatglm import ChatGLMChannel
+from .health import PROBE_PROBABILITY, ChannelHealth
 from .jd import JDChannel
 from .miyoushe import MiyousheChannel
 
@@ -13,9 +20,16 @@ class ChannelManager:
     
     # 默认渠道名称
     DEFAULT_CHANNEL = "miyoushe"
+    # 自动选择渠道的名称
+    AUTO_CHANNEL = "auto"
     
     def __init__(self):
         self.channels = {}
+        self.health = {}
+        self._health_lock = threading.Lock()
+        self._in_flight = {}  # 渠道名 -> 正在进行的上传数
+        self._upload_observers = []
+        self.auto_channel = AutoChannel(self)
         self._register_default_channels()
     
     def _register_default_channels(self):
@@ -35,23 +49,30 @@ class ChannelManager:
             raise ValueError(f"渠道必须继承自BaseChannel")
         
         channel_name = channel.get_channel_name()
+        previous = self.channels.get(channel_name)
         self.channels[channel_name] = channel
+        
+        # 被替换的渠道不再使用，释放其连接
+        if previous is not None and previous is not channel:
+            previous.close_session()
     
     def get_channel(self, channel_name):
         """
         获取指定的上传渠道
         
         参数:
-            channel_name: str - 渠道名称
+            channel_name: str - 渠道名称，"auto" 表示自动选择
             
         返回:
             BaseChannel or None - 渠道实例，如果不存在返回None
         """
+        if channel_name == self.AUTO_CHANNEL:
+            return self.auto_channel
         return self.channels.get(channel_name)
     
     def get_all_channels(self):
         """
-        获取所有已注册的渠道
+        获取所有已注册的渠道（不包括自动选择）
         
         返回:
             dict - 所有渠道的字典 {渠道名: 渠道实例}
@@ -68,7 +89,7 @@ class ChannelManager:
         返回:
             bool - 存在返回True，否则返回False
         """
-        return channel_name in self.channels
+        return channel_name == self.AUTO_CHANNEL or channel_name in self.channels
     
     def get_default_channel(self):
         """
@@ -87,8 +108,156 @@ class ChannelManager:
             str - 默认渠道名称
         """
         return self.DEFAULT_CHANNEL
+    
+    def get_health(self, channel_name):
+        """
+        获取渠道的健康统计（当前worker进程内）
+        
+        返回:
+            ChannelHealth - 首次使用时创建
+        """
+        health = self.health.get(channel_name)
+        if health is None:
+            with self._health_lock:
+                health = self.health.setdefault(channel_name, ChannelHealth())
+        return health
+    
+    def add_upload_observer(self, callback):
+        """
+        注册上传结果的回调，用于统计指标
+        
+        参数:
+            callback: callable(渠道名, 结果, 耗时, 字节数) - 结果为 'success'、'failure' 或 'cancelled'，
+                      字节数为成功上传的文件大小；回调中的异常会被忽略
+        """
+        self._upload_observers.append(callback)
+    
+    def get_in_flight(self):
+        """
+        获取各渠道正在进行的上传数（当前worker进程内）
+        
+        返回:
+            dict - {渠道名: 上传数}
+        """
+        with self._health_lock:
+            return dict(self._in_flight)
+    
+    def _notify_upload(self, channel_name, outcome, duration, size):
+        for callback in self._upload_observers:
+            try:
+                callback(channel_name, outcome, duration, size)
+            except Exception:
+                pass
+    
+    def upload(self, channel, file_stream, file):
+        """
+        调用渠道上传，并记录耗时和结果用于自动选择；被取消的上传不计入
+        
+        参数:
+            channel: BaseChannel - 上传渠道
+            file_stream, file: 同 BaseChannel.upload
+        
+        返回:
+            dict or None - 渠道返回的结果
+        """
+        if channel is self.auto_channel:
+            return channel.upload(file_stream, file)
+        
+        channel_name = channel.get_channel_name()
+        health = self.get_health(channel_name)
+        health.mark_attempt()
+        with self._health_lock:
+            self._in_flight[channel_name] = self._in_flight.get(channel_name, 0) + 1
+        start = time.time()
+        try:
+            result = channel.upload(file_stream, file)
+        except Exception:
+            if is_cancelled():
+                health.release()
+                self._notify_upload(channel_name, 'cancelled', time.time() - start, 0)
+            else:
+                health.record(False, time.time() - start)
+                self._notify_upload(channel_name, 'failure', time.time() - start, 0)
+            raise
+        finally:
+            with self._health_lock:
+                self._in_flight[channel_name] -= 1
+        if not result and is_cancelled():
+            health.release()
+            self._notify_upload(channel_name, 'cancelled', time.time() - start, 0)
+        else:
+            health.record(bool(result), time.time() - start, file.size if result else 0)
+            self._notify_upload(channel_name, 'success' if result else 'failure', time.time() - start,
+                                file.size if result else 0)
+        return result
+    
+    def rank_channels(self, file_size=None):
+        """
+        按预计上传耗时排序可用的渠道
+        
+        熔断中的渠道不参与；冷却结束等待试探的渠道排在最前，较长时间没有被尝试的渠道
+        以 PROBE_PROBABILITY 的概率排在最前，使恢复或变快的渠道能重新被使用；
+        其余按预计耗时排序，耗时相同时默认渠道优先
+        
+        参数:
+            file_size: int - 可选，文件大小，超出渠道限制的渠道不参与
+        
+        返回:
+            list - 渠道实例列表
+        """
+        explore = random.random() < PROBE_PROBABILITY
+        candidates = []
+        for index, (name, channel) in enumerate(self.channels.items()):
+            if file_size is not None and not channel.check_file_size(file_size)[0]:
+                continue
+            health = self.get_health(name)
+            if not health.is_available():
+                continue
+            candidates.append((not health.needs_probe(explore), health.score(), name != self.DEFAULT_CHANNEL, index, channel))
+        candidates.sort(key=lambda item: item[:4])
+        return [item[-1] for item in candidates]
+    
+    def transform_url(self, channel_name, url, **options):
+        """
+        获取由渠道图床缩放/转码后的图片地址（见 BaseChannel.transform_url）
+        
+        返回:
+            str or None - 渠道不存在或不支持图片处理时返回None
+        """
+        channel = self.channels.get(channel_name)
+        if channel is None:
+            return None
+        return channel.transform_url(url, **options)
+    
+    def get_health_stats(self):
+        """
+        获取所有渠道的健康统计
+        
+        返回:
+            dict - {渠道名: {state, samples, success_rate, p50, p90, p99, throughput, ..., score}}
+        """
+        stats = {}
+        for name in self.channels:
+            health = self.get_health(name)
+            stats[name] = dict(health.get_stats(), score=round(health.score(), 3))
+        return stats
+    
+    def get_http_stats(self):
+        """
+        获取所有渠道的连接复用统计
+        
+        返回:
+            dict - {渠道名: 连接统计}
+        """
+        return {name: channel.get_http_stats() for name, channel in self.channels.items()}
+    
+    def close(self):
+        """关闭所有渠道的HTTP会话"""
+        for channel in self.channels.values():
+            channel.close_session()
 
 
 # 创建全局渠道管理器实例
 channel_manager = ChannelManager()
+atexit.register(channel_manager.close)
 
@@ -0,0 +1,59 @@
+"""
+自动选择渠道
+按各渠道最近的上传耗时和成功率依次尝试，失败时换下一个渠道重试
+"""
+from .base import BaseChannel, is_cancelled
+
+# 一次上传最多尝试的渠道数
+AUTO_MAX_ATTEMPTS = 3
+
+
+class AutoChannel(BaseChannel):
+    """自动选择渠道，由渠道管理器创建，不注册为普通渠道"""
+    
+    def __init__(self, manager):
+        super().__init__()
+        self.manager = manager
+    
+    def get_channel_name(self):
+        return self.manager.AUTO_CHANNEL
+    
+    def get_max_file_size(self):
+        """取各渠道限制中最宽松的一个，超出某个渠道限制时只是不选择该渠道"""
+        limits = [channel.get_max_file_size() for channel in self.manager.get_all_channels().values()]
+        if not limits or None in limits:
+            return None
+        return max(limits)
+    
+    def upload(self, file_stream, file):
+        """
+        依次上传到当前最快的可用渠道，成功后返回结果
+        
+        返回:
+            dict or None - 成功返回 {'file_url', 'width', 'height', 'channel'}，channel 为实际使用的渠道；
+                           所有尝试都失败时返回None
+        """
+        attempts = 0
+        for channel in self.manager.rank_channels(file.size):
+            if attempts >= AUTO_MAX_ATTEMPTS:
+                break
+            name = channel.get_channel_name()
+            # 熔断恢复期的渠道只允许一个试探上传，可能已被其他请求占用
+            if not self.manager.get_health(name).acquire():
+                continue
+            attempts += 1
+            file_stream.seek(0)
+            try:
+                result = self.manager.upload(channel, file_stream, file)
+            except Exception as e:
+                self.log_error(f"渠道 {name} 上传异常: {e}")
+                result = None
+            if result:
+                if attempts > 1:
+                    self.log_info(f"第 {attempts} 次尝试成功，使用渠道 {name}")
+                return dict(result, channel=name)
+            if is_cancelled():
+                return None
+            self.log_error(f"渠道 {name} 上传失败，尝试下一个渠道")
+        self.log_error(f"没有可用的渠道，已尝试 {attempts} 个")
+        return None
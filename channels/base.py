@@ -3,10 +3,108 @@
 定义所有上传渠道需要实现的接口
 """
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http.cookiejar import DefaultCookiePolicy
 import logging
+import os
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger('image_uploader')
 
+# 每个主机保持的keep-alive连接数，对应gunicorn的--threads(4)加上批量上传线程池(4)
+HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '8'))
+# 每个渠道缓存的主机连接池数量（米游社需要API和OSS两个主机）
+HTTP_POOL_CONNECTIONS = 4
+
+# 当前线程的取消事件，见 cancel_scope
+_cancel_state = threading.local()
+
+
+class UploadCancelled(Exception):
+    """上传已被调用方取消"""
+
+
+@contextmanager
+def cancel_scope(event):
+    """
+    在当前线程中设置取消事件
+    
+    事件被设置后，本线程中渠道发出的下一个HTTP请求直接抛出 UploadCancelled，
+    多步骤的上传（如米游社先获取参数再上传OSS）会在步骤之间停止；已经发出的请求不会被中断
+    """
+    previous = getattr(_cancel_state, 'event', None)
+    _cancel_state.event = event
+    try:
+        yield
+    finally:
+        _cancel_state.event = previous
+
+
+def is_cancelled():
+    """当前线程的上传是否已被取消"""
+    event = getattr(_cancel_state, 'event', None)
+    return event is not None and event.is_set()
+
+
+class ChannelHTTPAdapter(HTTPAdapter):
+    """
+    渠道专用的HTTPAdapter
+    
+    只对建立连接失败进行重试（此时请求尚未发出，重试不会造成重复上传），
+    并统计连接的新建与复用次数
+    """
+    
+    def __init__(self):
+        retry = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.3, raise_on_status=False)
+        super().__init__(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+        self._stats_lock = threading.Lock()
+        self._seen_connections = weakref.WeakSet()
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.errors = 0
+    
+    def send(self, request, **kwargs):
+        if is_cancelled():
+            raise UploadCancelled('上传已取消')
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            with self._stats_lock:
+                self.requests += 1
+                self.errors += 1
+            raise
+        
+        # 连接对象在释放回连接池后仍是同一个实例，见过即为复用
+        connection = getattr(response.raw, 'connection', None)
+        with self._stats_lock:
+            self.requests += 1
+            if connection is None:
+                pass
+            elif connection in self._seen_connections:
+                self.reused_connections += 1
+            else:
+                self._seen_connections.add(connection)
+                self.new_connections += 1
+        return response
+    
+    def get_stats(self):
+        """获取连接统计"""
+        with self._stats_lock:
+            observed = self.new_connections + self.reused_connections
+            return {
+                'requests': self.requests,
+                'new_connections': self.new_connections,
+                'reused_connections': self.reused_connections,
+                'errors': self.errors,
+                'reuse_rate': round(self.reused_connections / observed, 4) if observed else 0.0
+            }
+
 
 class BaseChannel(ABC):
     """上传渠道基类"""
@@ -14,8 +112,60 @@ class BaseChannel(ABC):
     # 默认最大文件大小限制（字节），None 表示无限制
     MAX_FILE_SIZE = None
     
+    # 默认的上传前压缩方案（见 image_optimizer.OPTIMIZE_PROFILES），None 表示不处理；请求中的 optimize 参数优先
+    OPTIMIZE_PROFILE = None
+    
     def __init__(self):
         self.name = self.__class__.__name__
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+    
+    @property
+    def session(self):
+        """
+        渠道共享的keep-alive会话，首次使用时创建
+        
+        fork后的子进程不能复用父进程的连接，按pid重新创建
+        """
+        session = self._session
+        if session is not None and self._session_pid == os.getpid():
+            return session
+        with self._session_lock:
+            if self._session is None or self._session_pid != os.getpid():
+                self._session = self._create_session()
+                self._session_pid = os.getpid()
+            return self._session
+    
+    def _create_session(self):
+        """创建会话并挂载连接池"""
+        session = requests.Session()
+        # 不在会话中保存服务端下发的Cookie，每次请求的Cookie仍由调用方显式传入
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = ChannelHTTPAdapter()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+    
+    def close_session(self):
+        """关闭会话，释放所有keep-alive连接"""
+        with self._session_lock:
+            session, self._session = self._session, None
+            pid, self._session_pid = self._session_pid, None
+        if session is not None and pid == os.getpid():
+            session.close()
+    
+    def get_http_stats(self):
+        """
+        获取连接复用统计
+        
+        返回:
+            dict - {requests, new_connections, reused_connections, errors, reuse_rate}
+        """
+        session = self._session
+        if session is None or self._session_pid != os.getpid():
+            return {'requests': 0, 'new_connections': 0, 'reused_connections': 0, 'errors': 0, 'reuse_rate': 0.0}
+        return session.get_adapter('https://').get_stats()
     
     def get_max_file_size(self):
         """
@@ -26,22 +176,44 @@ class BaseChannel(ABC):
         """
         return self.MAX_FILE_SIZE
     
-    def check_file_size(self, file_path):
+    def get_optimize_profile(self):
+        """
+        获取默认的上传前压缩方案
+        
+        返回:
+            str or None - 压缩方案名称，None表示不处理
+        """
+        return self.OPTIMIZE_PROFILE
+    
+    def transform_url(self, url, width=None, height=None, image_format=None, quality=None):
+        """
+        获取由图床缩放/转码后的图片地址
+        
+        参数:
+            url: str - 本渠道上传得到的图片地址
+            width, height: int - 缩放到不超过该尺寸（保持宽高比），None 表示不缩放
+            image_format: str - 目标格式（如 'webp'），None 表示保持原格式
+            quality: int - 编码质量（1-100），None 表示使用图床默认值
+            
+        返回:
+            str or None - 处理后的地址；图床不支持图片处理或地址不是本渠道的图片时返回None，由调用方使用原图
+        """
+        return None
+    
+    def check_file_size(self, file_size):
         """
         检查文件大小是否超出限制
         
         参数:
-            file_path: str - 文件路径
+            file_size: int - 文件大小（字节）
             
         返回:
             tuple - (是否通过, 错误信息或None)
         """
-        import os
         max_size = self.get_max_file_size()
         if max_size is None:
             return True, None
         
-        file_size = os.path.getsize(file_path)
         if file_size > max_size:
             max_size_mb = max_size / (1024 * 1024)
             file_size_mb = file_size / (1024 * 1024)
@@ -50,13 +222,13 @@ class BaseChannel(ABC):
         return True, None
     
     @abstractmethod
-    def upload(self, temp_file_path, file):
+    def upload(self, file_stream, file):
         """
         上传文件到图床
         
         参数:
-            temp_file_path: str - 临时文件路径
-            file: ValidatedFile - 包含filename, content_type, width, height的文件对象
+            file_stream: 可读取的二进制文件对象，已定位到文件开头
+            file: ValidatedFile - 包含filename, content_type, width, height, extension, size, md5, sha256的文件对象
             
         返回:
             dict or None - 成功返回 {'file_url': str, 'width': int, 'height': int}，失败返回None
@@ -1,7 +1,6 @@
 """
 ChatGLM图床上传渠道
 """
-import requests
 from .base import BaseChannel
 
 
@@ -16,13 +15,13 @@ class ChatGLMChannel(BaseChannel):
         """获取渠道名称"""
         return "chatglm"
     
-    def upload(self, temp_file_path, file):
+    def upload(self, file_stream, file):
         """
         上传到ChatGLM图床
         
         参数:
-            temp_file_path: str - 临时文件路径
-            file: ValidatedFile - 包含filename, content_type, width, height的文件对象
+            file_stream: 可读取的二进制文件对象，已定位到文件开头
+            file: ValidatedFile - 包含filename, content_type, width, height, extension, size, md5, sha256的文件对象
             
         返回:
             dict or None - 成功返回 {'file_url': str, 'width': int, 'height': int}，失败返回None
@@ -31,20 +30,19 @@ class ChatGLMChannel(BaseChannel):
         response = None
         
         try:
-            with open(temp_file_path, 'rb') as file_handle:
-                files = [
-                    ('file', (file.filename, file_handle, file.content_type))
-                ]
-                headers = {
-                    'Accept': 'application/json, text/plain, */*',
-                    'Accept-Language': 'zh-CN,zh;q=0.9',
-                    'App-Name': 'chatglm',
-                    'Connection': 'keep-alive',
-                    'DNT': '1',
-                    'Origin': 'https://chatglm.cn',
-                }
-                
-                response = requests.request("POST", self.upload_url, headers=headers, data=payload, files=files, timeout=60)
+            files = [
+                ('file', (file.filename, file_stream, file.content_type))
+            ]
+            headers = {
+                'Accept': 'application/json, text/plain, */*',
+                'Accept-Language': 'zh-CN,zh;q=0.9',
+                'App-Name': 'chatglm',
+                'Connection': 'keep-alive',
+                'DNT': '1',
+                'Origin': 'https://chatglm.cn',
+            }
+            
+            response = self.session.post(self.upload_url, headers=headers, data=payload, files=files, timeout=60)
         except Exception as e:
             self.log_error(f"上传请求失败: {str(e)}")
             return None
@@ -0,0 +1,179 @@
+"""
+渠道健康统计
+记录每个渠道最近的上传耗时和结果，用于自动选择渠道和熔断
+"""
+import math
+import threading
+import time
+from collections import deque
+
+# 每个渠道保留的最近上传记录数
+HEALTH_SAMPLES = 100
+# 只统计该时间内的记录（秒），更早的记录不再反映渠道当前状态
+HEALTH_WINDOW = 600
+# 没有成功记录时假定的上传耗时（秒），使新渠道排在有记录的快速渠道之后、失败渠道之前
+DEFAULT_LATENCY = 5.0
+# 超过该时间没有被尝试的渠道视为统计过期（秒），可能被优先试探一次，使排名靠后的渠道的统计能随其实际状态更新
+PROBE_INTERVAL = 60
+# 自动选择时优先试探统计过期的渠道的概率，其余时候按预计耗时选择，
+# 流量较低时大部分上传仍交给当前最快的渠道
+PROBE_PROBABILITY = 0.05
+
+# 连续失败达到该次数时熔断，熔断期间自动选择会跳过该渠道
+BREAKER_FAILURE_THRESHOLD = 5
+# 熔断时长（秒），恢复后再次失败时加倍，最长 BREAKER_MAX_COOLDOWN
+BREAKER_COOLDOWN = 60
+BREAKER_MAX_COOLDOWN = 600
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+def percentile(sorted_values, ratio):
+    """已排序列表的百分位数（最近秩法）"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(ratio * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class ChannelHealth:
+    """
+    单个渠道的健康状态
+
+    熔断器状态：
+        closed - 正常
+        open - 连续失败达到阈值，冷却期间不参与自动选择
+        half_open - 冷却结束，允许一次试探上传，成功后恢复，失败后重新熔断并加倍冷却时间
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=HEALTH_SAMPLES)  # (完成时间, 耗时, 是否成功, 字节数)
+        self.consecutive_failures = 0
+        self.state = STATE_CLOSED
+        self.open_until = 0
+        self.cooldown = BREAKER_COOLDOWN
+        self._trial_running = False
+        self.last_attempt = 0
+
+    def record(self, success, duration, size=0):
+        """记录一次上传结果"""
+        now = time.time()
+        with self._lock:
+            self._samples.append((now, duration, success, size))
+            self._trial_running = False
+            if success:
+                self.consecutive_failures = 0
+                self.state = STATE_CLOSED
+                self.cooldown = BREAKER_COOLDOWN
+                return
+            self.consecutive_failures += 1
+            if self.state == STATE_HALF_OPEN:
+                # 试探失败，重新熔断并加倍冷却时间
+                self.cooldown = min(self.cooldown * 2, BREAKER_MAX_COOLDOWN)
+                self._open(now)
+            elif self.state == STATE_CLOSED and self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = STATE_OPEN
+        self.open_until = now + self.cooldown
+
+    def _refresh_state(self, now):
+        if self.state == STATE_OPEN and now >= self.open_until:
+            self.state = STATE_HALF_OPEN
+
+    def is_available(self):
+        """是否可以参与自动选择：正常，或冷却结束且没有正在进行的试探"""
+        with self._lock:
+            self._refresh_state(time.time())
+            return self.state == STATE_CLOSED or (self.state == STATE_HALF_OPEN and not self._trial_running)
+
+    def needs_probe(self, explore=True):
+        """
+        是否应优先试探：冷却结束的熔断渠道，或 explore 为真时较长时间没有被尝试的正常渠道
+        """
+        with self._lock:
+            now = time.time()
+            self._refresh_state(now)
+            if self.state == STATE_HALF_OPEN:
+                return not self._trial_running
+            return explore and self.state == STATE_CLOSED and now - self.last_attempt >= PROBE_INTERVAL
+
+    def acquire(self):
+        """
+        开始一次自动选择的上传
+
+        返回:
+            bool - 是否可以使用该渠道；半开状态下只允许一个试探上传
+        """
+        with self._lock:
+            now = time.time()
+            self._refresh_state(now)
+            if self.state == STATE_CLOSED:
+                self.last_attempt = now
+                return True
+            if self.state == STATE_HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                self.last_attempt = now
+                return True
+            return False
+
+    def mark_attempt(self):
+        """记录一次指定渠道的上传（不经过自动选择），其结果同样是新的统计样本"""
+        with self._lock:
+            self.last_attempt = time.time()
+    
+    def release(self):
+        """放弃已开始的试探（上传被取消，没有结果）"""
+        with self._lock:
+            self._trial_running = False
+
+    def _recent(self, now):
+        return [sample for sample in self._samples if now - sample[0] <= HEALTH_WINDOW]
+
+    def score(self):
+        """
+        预计上传耗时（秒），越小越好
+
+        取最近成功上传耗时的中位数，除以平滑后的成功率：失败越多，预计耗时越长
+        """
+        with self._lock:
+            samples = self._recent(time.time())
+        durations = sorted(duration for _, duration, success, _ in samples if success)
+        successes = len(durations)
+        latency = percentile(durations, 0.5) if durations else DEFAULT_LATENCY
+        success_rate = (successes + 1) / (len(samples) + 2)
+        return latency / success_rate
+
+    def get_stats(self):
+        """
+        获取统计信息
+
+        返回:
+            dict - {state, samples, success_rate, p50, p90, p99, throughput, consecutive_failures, open_for}
+        """
+        now = time.time()
+        with self._lock:
+            self._refresh_state(now)
+            samples = self._recent(now)
+            state = self.state
+            consecutive_failures = self.consecutive_failures
+            open_until = self.open_until
+        successes = [(duration, size) for _, duration, success, size in samples if success]
+        durations = sorted(duration for duration, _ in successes)
+        total_time = sum(durations)
+        return {
+            'state': state,
+            'samples': len(samples),
+            'success_rate': round(len(successes) / len(samples), 4) if samples else None,
+            'p50': round(percentile(durations, 0.5), 3) if durations else None,
+            'p90': round(percentile(durations, 0.9), 3) if durations else None,
+            'p99': round(percentile(durations, 0.99), 3) if durations else None,
+            # 成功上传的平均吞吐量（字节/秒）
+            'throughput': round(sum(size for _, size in successes) / total_time) if total_time > 0 else None,
+            'consecutive_failures': consecutive_failures,
+            'open_for': round(max(0, open_until - now), 1) if state == STATE_OPEN else 0
+        }
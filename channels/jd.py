@@ -1,7 +1,8 @@
 """
 京东图床上传渠道
 """
-import requests
+from urllib.parse import urlparse
+
 from .base import BaseChannel
 
 
@@ -16,32 +17,55 @@ class JDChannel(BaseChannel):
         """获取渠道名称"""
         return "jd"
     
-    def upload(self, temp_file_path, file):
+    def transform_url(self, url, width=None, height=None, image_format=None, quality=None):
+        """
+        使用京东图片服务的地址规则缩放/转码
+        
+        例如 .../openfeedback/s800x600_jfs/t1/.../a.png!q80.webp：
+        s{宽}x{高}_ 等比缩放到指定宽高内，!q{质量} 设置编码质量，末尾追加 .webp 转为WebP
+        """
+        parsed = urlparse(url)
+        if not (parsed.hostname or '').endswith('360buyimg.com') or '/jfs/' not in parsed.path:
+            return None
+        if parsed.query or '!' in parsed.path or '/s' in parsed.path.split('/jfs/')[0]:
+            # 已经带有处理参数
+            return None
+        
+        path = parsed.path
+        # 缩放必须同时指定宽高
+        if width and height:
+            path = path.replace('/jfs/', f'/s{int(width)}x{int(height)}_jfs/', 1)
+        if quality:
+            path += f'!q{int(quality)}'
+        if image_format == 'webp':
+            path += '.webp'
+        return parsed._replace(path=path).geturl()
+    
+    def upload(self, file_stream, file):
         """
         上传到京东图床
         
         参数:
-            temp_file_path: str - 临时文件路径
-            file: ValidatedFile - 包含filename, content_type, width, height的文件对象
+            file_stream: 可读取的二进制文件对象，已定位到文件开头
+            file: ValidatedFile - 包含filename, content_type, width, height, extension, size, md5, sha256的文件对象
             
         返回:
             dict or None - 成功返回 {'file_url': str, 'width': int, 'height': int}，失败返回None
         """
         try:
-            with open(temp_file_path, 'rb') as file_handle:
-                files = {
-                    'file': (file.filename, file_handle, file.content_type)
-                }
-                headers = {
-                    'Accept': 'application/json, text/javascript, */*; q=0.01',
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36',
-                    'Origin': 'https://feedback.jd.com',
-                    'Referer': 'https://feedback.jd.com/',
-                    'Sec-Ch-Ua-Platform': 'Windows',
-                    'Sec-Ch-Ua-Mobile': '?0'
-                }
-                
-                response = requests.post(self.upload_url, headers=headers, files=files, timeout=60)
+            files = {
+                'file': (file.filename, file_stream, file.content_type)
+            }
+            headers = {
+                'Accept': 'application/json, text/javascript, */*; q=0.01',
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36',
+                'Origin': 'https://feedback.jd.com',
+                'Referer': 'https://feedback.jd.com/',
+                'Sec-Ch-Ua-Platform': 'Windows',
+                'Sec-Ch-Ua-Mobile': '?0'
+            }
+            
+            response = self.session.post(self.upload_url, headers=headers, files=files, timeout=60)
         except Exception as e:
             self.log_error(f"上传请求失败: {str(e)}")
             return None
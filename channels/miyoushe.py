@@ -2,18 +2,72 @@
 米游社图床上传渠道
 基于 miyoushe.com 的图片上传 API 实现
 """
-import hashlib
+import base64
+import json
 import os
-import requests
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlparse
+
 from .base import BaseChannel
 
 
+class ExpiringCache:
+    """带过期时间的进程内LRU缓存，max_size 为0时不缓存"""
+    
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (value, 过期时间)
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+    
+    def set(self, key, value, expires_at):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
 class MiyousheChannel(BaseChannel):
     """米游社图床上传渠道"""
     
     # 最大文件大小限制：20MB
     MAX_FILE_SIZE = 20 * 1024 * 1024
     
+    # 本地链接缓存：相同内容（MD5+扩展名）再次上传时直接返回已知链接，不访问米游社
+    URL_CACHE_SIZE = int(os.environ.get('MIYOUSHE_URL_CACHE_SIZE', '10000'))
+    URL_CACHE_TTL = 7 * 24 * 3600
+    # 上传参数缓存：参数（OSS key、policy、签名）与MD5绑定，在签名过期前可以重复使用
+    PARAMS_CACHE_SIZE = 1000
+    # 距离签名过期不足该时间（秒）的参数不再使用，避免上传过程中过期
+    PARAMS_EXPIRY_MARGIN = 60
+    # OSS 因签名或 policy 拒绝上传时的错误码，此时缓存的参数已不可用；其他失败（网络、服务端错误）保留参数供重试
+    PARAMS_REJECTED_CODES = ('SignatureDoesNotMatch', 'InvalidPolicyDocument', 'AccessDenied',
+                             'InvalidAccessKeyId', 'RequestTimeTooSkewed')
+    
+    # 上传得到的图片所在的域名，支持 OSS 图片处理参数
+    IMAGE_HOSTS = ('miyoushe.com', 'mihoyo.com')
+    
     # API 端点
     GET_UPLOAD_PARAMS_URL = "https://bbs-api.miyoushe.com/apihub/wapi/getUploadParams"
     
@@ -51,26 +105,13 @@ class MiyousheChannel(BaseChannel):
         """
         super().__init__()
         self.cookie = cookie or os.environ.get('MIYOUSHE_COOKIE', '')
+        self._url_cache = ExpiringCache(self.URL_CACHE_SIZE)
+        self._params_cache = ExpiringCache(self.PARAMS_CACHE_SIZE)
     
     def get_channel_name(self):
         """获取渠道名称"""
         return "miyoushe"
     
-    @staticmethod
-    def _calculate_md5(file_path: str) -> str:
-        """计算文件的 MD5 哈希值"""
-        md5_hash = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                md5_hash.update(chunk)
-        return md5_hash.hexdigest()
-    
-    @staticmethod
-    def _get_file_extension(file_path: str) -> str:
-        """获取文件扩展名（小写，不带点）"""
-        _, ext = os.path.splitext(file_path)
-        return ext.lower().lstrip(".")
-    
     def _parse_cookie(self) -> dict:
         """解析 Cookie 字符串为字典"""
         cookies = {}
@@ -102,7 +143,7 @@ class MiyousheChannel(BaseChannel):
         }
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 self.GET_UPLOAD_PARAMS_URL,
                 headers=headers,
                 json=payload,
@@ -121,7 +162,43 @@ class MiyousheChannel(BaseChannel):
             self.log_error(f"请求上传参数异常: {e}")
             return None
     
-    def _upload_to_oss(self, file_path: str, params: dict):
+    @staticmethod
+    def _params_expires_at(params: dict):
+        """
+        获取上传参数的过期时间（Unix时间戳），无法确定时返回None
+        
+        优先使用参数中的 expire，否则解析 policy 中的 expiration
+        """
+        oss_params = params.get("params", params.get("oss", {}))
+        try:
+            expire = float(oss_params.get("expire") or 0)
+            if expire:
+                # 兼容毫秒时间戳
+                return expire / 1000 if expire > 1e12 else expire
+        except (TypeError, ValueError):
+            pass
+        try:
+            policy = json.loads(base64.b64decode(oss_params.get("policy") or ""))
+            return datetime.fromisoformat(policy["expiration"].replace("Z", "+00:00")).timestamp()
+        except Exception:
+            return None
+    
+    def _get_cached_upload_params(self, md5: str, ext: str):
+        """获取上传参数，签名未过期时使用缓存"""
+        key = (md5, ext)
+        params = self._params_cache.get(key)
+        if params:
+            self.log_info("使用缓存的上传参数")
+            return params
+        
+        params = self._get_upload_params(md5, ext)
+        if params:
+            expires_at = self._params_expires_at(params)
+            if expires_at:
+                self._params_cache.set(key, params, expires_at - self.PARAMS_EXPIRY_MARGIN)
+        return params
+    
+    def _upload_to_oss(self, file_stream, file, params: dict):
         """上传文件到阿里云 OSS"""
         oss_params = params.get("params", params.get("oss", {}))
         host = oss_params.get("host")
@@ -130,9 +207,8 @@ class MiyousheChannel(BaseChannel):
             self.log_error("未获取到 OSS Host")
             return None
         
-        # 获取文件名和扩展名
-        file_name = os.path.basename(file_path)
-        ext = self._get_file_extension(file_path)
+        # 获取扩展名（小写，不带点）
+        ext = file.extension.lower().lstrip(".")
         content_type = self.MIME_TYPES.get(ext, f"image/{ext}")
         
         # 构建表单数据
@@ -156,11 +232,8 @@ class MiyousheChannel(BaseChannel):
             if key and value is not None:
                 form_data[key] = (None, value)
         
-        # 读取文件内容
-        with open(file_path, "rb") as f:
-            file_content = f.read()
-        
-        form_data["file"] = (file_name, file_content, content_type)
+        # 直接传入文件对象，不再整体读入内存
+        form_data["file"] = (file.filename, file_stream, content_type)
         
         headers = {
             "accept": "*/*",
@@ -177,12 +250,21 @@ class MiyousheChannel(BaseChannel):
         }
         
         try:
-            response = requests.post(
+            response = self.session.post(
                 host,
                 headers=headers,
                 files=form_data,
                 timeout=60
             )
+            if not response.ok:
+                # OSS 的错误响应为XML，Code 元素给出原因
+                match = re.search(r'<Code>([^<]+)</Code>', response.text)
+                code = match.group(1) if match else str(response.status_code)
+                self.log_error(f"OSS 上传失败: {code}")
+                if code in self.PARAMS_REJECTED_CODES:
+                    # 参数已失效，下次重新获取
+                    self._params_cache.pop((file.md5, ext))
+                return None
             result = response.json()
             
             if result.get("retcode") == 0:
@@ -195,13 +277,38 @@ class MiyousheChannel(BaseChannel):
             self.log_error(f"OSS 上传异常: {e}")
             return None
     
-    def upload(self, temp_file_path, file):
+    def transform_url(self, url, width=None, height=None, image_format=None, quality=None):
+        """使用阿里云 OSS 图片处理参数（x-oss-process）缩放/转码"""
+        host = urlparse(url).hostname or ''
+        if not host.endswith(self.IMAGE_HOSTS) or 'x-oss-process=' in url:
+            return None
+        
+        actions = []
+        if width or height:
+            # m_lfit: 等比缩放到指定宽高内，图片小于目标尺寸时不放大
+            resize = 'resize,m_lfit'
+            if width:
+                resize += f',w_{int(width)}'
+            if height:
+                resize += f',h_{int(height)}'
+            actions.append(resize)
+        if quality:
+            actions.append(f'quality,q_{int(quality)}')
+        if image_format:
+            actions.extend(['interlace,1', f'format,{image_format}'])
+        if not actions:
+            return url
+        
+        process = 'x-oss-process=image/' + '/'.join(actions)
+        return f"{url}&{process}" if '?' in url else f"{url}?{process}"
+    
+    def upload(self, file_stream, file):
         """
         上传到米游社图床
         
         参数:
-            temp_file_path: str - 临时文件路径
-            file: ValidatedFile - 包含filename, content_type, width, height的文件对象
+            file_stream: 可读取的二进制文件对象，已定位到文件开头
+            file: ValidatedFile - 包含filename, content_type, width, height, extension, size, md5, sha256的文件对象
             
         返回:
             dict or None - 成功返回 {'file_url': str, 'width': int, 'height': int}，失败返回None
@@ -210,32 +317,43 @@ class MiyousheChannel(BaseChannel):
             self.log_error("未配置米游社 Cookie，请设置环境变量 MIYOUSHE_COOKIE")
             return None
         
-        ext = self._get_file_extension(temp_file_path)
+        ext = file.extension.lower().lstrip(".")
         
-        # 计算 MD5
-        md5 = self._calculate_md5(temp_file_path)
+        # MD5 已在接收文件时计算
+        md5 = file.md5
         self.log_info(f"文件 MD5: {md5}")
         
+        # 获取图片尺寸
+        width = file.width if hasattr(file, 'width') else 0
+        height = file.height if hasattr(file, 'height') else 0
+        
+        # 相同内容已上传过时直接返回，省去获取参数和上传OSS两次请求
+        cache_key = (md5, ext)
+        file_url = self._url_cache.get(cache_key)
+        if file_url:
+            self.log_info(f"命中本地链接缓存: {file_url}")
+            return {'file_url': file_url, 'width': width, 'height': height}
+        
         # 第一步：获取上传参数
-        params = self._get_upload_params(md5, ext)
+        params = self._get_cached_upload_params(md5, ext)
         if not params:
             return None
         
         self.log_info(f"上传目标: {params.get('file_name')}")
         
         # 第二步：上传到 OSS
-        result = self._upload_to_oss(temp_file_path, params)
+        result = self._upload_to_oss(file_stream, file, params)
         if not result:
             return None
         
         self.log_info("上传成功")
         
-        # 获取图片尺寸
-        width = file.width if hasattr(file, 'width') else 0
-        height = file.height if hasattr(file, 'height') else 0
+        file_url = result.get("url", "")
+        if file_url:
+            self._url_cache.set(cache_key, file_url, time.time() + self.URL_CACHE_TTL)
         
         return {
-            'file_url': result.get("url", ""),
+            'file_url': file_url,
             'width': width,
             'height': height
         }
@@ -0,0 +1,11 @@
+"""
+gunicorn 配置
+
+gunicorn 启动时自动读取当前目录下的本文件。
+"""
+
+
+def post_worker_init(worker):
+    """每个worker进程加载应用后启动后台任务线程（master进程中不启动）"""
+    from app import start_background_workers
+    start_background_workers()
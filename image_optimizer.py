@@ -0,0 +1,140 @@
+"""
+上传前的图片压缩/转码
+在独立进程中执行（见 app.py 中的 optimize_upload），本模块只依赖 Pillow，导入时没有副作用
+"""
+import io
+import os
+import threading
+import time
+
+from PIL import Image, ImageOps
+
+PARENT_CHECK_INTERVAL = 5  # 子进程检查父进程是否存活的间隔（秒）
+
+# 预设的压缩方案
+#   format: 目标格式，None 表示保持原格式
+#   quality: 有损编码质量
+#   strip_exif: 去除EXIF等元数据（会先按EXIF方向旋转图片）
+OPTIMIZE_PROFILES = {
+    'lossless': {'format': None, 'quality': None, 'strip_exif': True},
+    'webp': {'format': 'webp', 'quality': 85, 'strip_exif': True},
+    'avif': {'format': 'avif', 'quality': 60, 'strip_exif': True},
+}
+
+# 各格式在 Pillow 中的名称
+PIL_FORMATS = {
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+    'gif': 'GIF',
+    'webp': 'WEBP',
+    'bmp': 'BMP',
+    'avif': 'AVIF',
+}
+
+
+def init_worker(parent_pid):
+    """进程池子进程的初始化函数：父进程被强制结束时子进程随之退出，不留下孤儿进程"""
+    def watch_parent():
+        while os.getppid() == parent_pid:
+            time.sleep(PARENT_CHECK_INTERVAL)
+        os._exit(0)
+    threading.Thread(target=watch_parent, name='watch-parent', daemon=True).start()
+
+
+def is_format_supported(image_format):
+    """当前 Pillow 是否能编码该格式（AVIF 需要安装 pillow-avif-plugin）"""
+    pil_format = PIL_FORMATS.get(image_format)
+    if pil_format == 'AVIF':
+        try:
+            import pillow_avif  # noqa: F401
+        except ImportError:
+            return False
+    # Image.SAVE 在首次打开或保存图片时才注册完整
+    Image.init()
+    return pil_format is not None and pil_format in Image.SAVE
+
+
+def optimize_image_bytes(data, image_format, options):
+    """
+    按选项压缩/转码图片
+
+    参数:
+        data: bytes - 原图内容
+        image_format: str - 原图格式（validate_image 返回的 format）
+        options: dict - {format, quality, strip_exif, max_dimension}
+
+    返回:
+        tuple or None - (新内容, 格式, 宽, 高)；没有可做的处理或结果不比原图小时返回None
+    """
+    target_format = options.get('format') or image_format
+    max_dimension = options.get('max_dimension')
+    if not is_format_supported(target_format):
+        return None
+
+    with Image.open(io.BytesIO(data)) as img:
+        # 动图逐帧处理代价高且容易丢失动画，保持原样
+        if getattr(img, 'is_animated', False):
+            return None
+
+        resized = bool(max_dimension) and max(img.size) > max_dimension
+        reencode = target_format != image_format or resized
+        # 保持原格式且不缩放时，只有PNG能无损地重新压缩，其他格式重新编码会损失画质
+        if not reencode and image_format != 'png':
+            return None
+
+        image = ImageOps.exif_transpose(img) if options.get('strip_exif') else img
+        if resized:
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        save_params = {}
+        if target_format == 'png':
+            save_params['optimize'] = True
+        elif target_format in ('jpeg', 'webp', 'avif'):
+            save_params['quality'] = options.get('quality') or (90 if target_format == 'jpeg' else 85)
+            if target_format == 'jpeg' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+        elif target_format == 'gif' and image.mode not in ('P', 'L'):
+            image = image.convert('P', palette=Image.ADAPTIVE)
+        if not options.get('strip_exif') and img.info.get('exif') and target_format in ('jpeg', 'webp', 'png'):
+            save_params['exif'] = img.info['exif']
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=PIL_FORMATS[target_format], **save_params)
+        width, height = image.size
+
+    output = buffer.getvalue()
+    # 只缩放了尺寸时即使体积更大也使用新图；否则只保留更小的结果
+    if len(output) >= len(data) and not resized:
+        return None
+    return output, target_format, width, height
+
+
+def create_thumbnail(data, max_size, quality):
+    """
+    生成缩略图
+
+    参数:
+        data: bytes - 原图内容
+        max_size: int - 长边最大像素数
+        quality: int - 编码质量
+
+    返回:
+        tuple - (缩略图内容, 格式)；支持WebP时输出WebP，否则输出JPEG
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        # JPEG 可以在解码时直接按比例缩小，大图只解码需要的分辨率
+        img.draft('RGB', (max_size, max_size))
+        # 动图只取第一帧
+        image = ImageOps.exif_transpose(img)
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+        if is_format_supported('webp'):
+            image_format = 'webp'
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        else:
+            image_format = 'jpeg'
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, format=PIL_FORMATS[image_format], quality=quality)
+    return buffer.getvalue(), image_format
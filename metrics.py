@@ -0,0 +1,308 @@
+"""
+运行指标
+每个进程在内存中累计计数器、直方图和仪表，后台线程定期写入共享的 SQLite 数据库，
+导出时汇总所有gunicorn worker的数据，输出 Prometheus 文本格式（0.0.4）
+"""
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger('image_uploader')
+
+FLUSH_INTERVAL = 5  # 各进程写入共享数据库的间隔（秒）
+# 超过该时间没有写入的进程视为已退出（秒）：其计数器和直方图并入历史累计，仪表不再计入。
+# 远大于 gunicorn 的worker超时，正常运行的worker不会被误判
+INSTANCE_TIMEOUT = 60
+
+# 默认的直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 已退出进程的计数器和直方图并入该实例，保证导出的累计值单调递增
+RETIRED_INSTANCE = 'retired'
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """
+    一个指标及其各标签组合的值
+
+    kind:
+        counter - 只增不减，导出时累加所有进程（包括已退出的进程）
+        gauge - 当前值，导出时按 aggregate（sum/max）汇总仍在运行的进程
+        histogram - 按 buckets 分桶计数，导出时累加所有进程
+    """
+
+    def __init__(self, registry, kind, name, documentation, labelnames=(), buckets=None,
+                 aggregate='sum', callback=None):
+        self.registry = registry
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+        self.aggregate = aggregate
+        # 仪表的取值函数，返回 {标签值元组: 值}，在写入共享数据库和导出时调用
+        self.callback = callback
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        """计数器加 amount"""
+        self.registry._update(self, self._key(labels), lambda value: (value or 0) + amount)
+
+    def add(self, amount, **labels):
+        """仪表加 amount（可为负数）"""
+        self.registry._update(self, self._key(labels), lambda value: (value or 0) + amount)
+
+    def set(self, value, **labels):
+        """设置仪表的值"""
+        self.registry._update(self, self._key(labels), lambda _: value)
+
+    def observe(self, value, **labels):
+        """直方图记录一次观测值"""
+        index = bisect.bisect_left(self.buckets, value)
+
+        def update(state):
+            # [各分桶计数（不累积）..., 超出最大分桶的计数, 总和, 次数]
+            state = state or [0] * (len(self.buckets) + 3)
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+            return state
+        self.registry._update(self, self._key(labels), update)
+
+
+class MetricsRegistry:
+    """
+    进程间共享的指标注册表
+
+    fork后的子进程清空继承的数据，以新的实例标识重新累计，
+    并在首次记录时启动写入线程
+    """
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.metrics = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = None
+        self._values = {}
+        self._instance = None
+        self._flushed = False
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Metric(self, 'counter', name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), aggregate='sum', callback=None):
+        return self._register(Metric(self, 'gauge', name, documentation, labelnames,
+                                     aggregate=aggregate, callback=callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Metric(self, 'histogram', name, documentation, labelnames, buckets=buckets))
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"指标已存在: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._values = {}
+            self._instance = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            self._flushed = False
+            self._pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def _update(self, metric, key, update):
+        self._ensure_started()
+        with self._lock:
+            self._values[(metric.name, key)] = update(self._values.get((metric.name, key)))
+
+    def _connection(self):
+        """当前线程的数据库连接（独立于业务数据库，写入指标不会计入数据库耗时）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS metric_values (
+                    instance TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    labels TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (instance, name, labels)
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS metric_instances (
+                    instance TEXT PRIMARY KEY,
+                    updated_at REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _flush_loop(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"写入运行指标失败: {str(e)}")
+
+    def _snapshot(self):
+        """本进程的所有值，包括仪表取值函数的当前结果"""
+        self._ensure_started()
+        with self._lock:
+            values = {key: list(value) if isinstance(value, list) else value for key, value in self._values.items()}
+        for metric in self.metrics.values():
+            if metric.callback is None:
+                continue
+            try:
+                for labelvalues, value in metric.callback().items():
+                    values[(metric.name, tuple(str(v) for v in labelvalues))] = value
+            except Exception as e:
+                logger.error(f"获取指标 {metric.name} 失败: {str(e)}")
+        return values
+
+    def flush(self):
+        """将本进程的累计值写入共享数据库"""
+        values = self._snapshot()
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if self._flushed and conn.execute('SELECT 1 FROM metric_instances WHERE instance = ?',
+                                              (self._instance,)).fetchone() is None:
+                # 长时间没有写入被误判为已退出，已写入的部分已并入历史累计；
+                # 换用新的实例标识重新累计，避免重复计数（丢失上次写入之后的增量）
+                logger.warning(f"运行指标实例 {self._instance} 已被视为退出，重新开始累计")
+                with self._lock:
+                    self._values = {key: value for key, value in self._values.items()
+                                    if self.metrics[key[0]].kind == 'gauge'}
+                    self._instance = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+                values = {key: value for key, value in values.items() if self.metrics[key[0]].kind == 'gauge'}
+            conn.executemany(
+                'INSERT OR REPLACE INTO metric_values (instance, name, labels, value) VALUES (?, ?, ?, ?)',
+                [(self._instance, name, json.dumps(key), json.dumps(value)) for (name, key), value in values.items()]
+            )
+            conn.execute('INSERT OR REPLACE INTO metric_instances (instance, updated_at) VALUES (?, ?)',
+                         (self._instance, time.time()))
+        self._flushed = True
+
+    def _retire_instances(self, conn):
+        """将已退出进程的计数器和直方图并入历史累计，删除其仪表"""
+        deadline = time.time() - INSTANCE_TIMEOUT
+        retired = [row[0] for row in conn.execute(
+            'SELECT instance FROM metric_instances WHERE updated_at < ?', (deadline,))]
+        if not retired:
+            return
+        merged = {}
+        for name, labels, value in conn.execute(
+                'SELECT name, labels, value FROM metric_values WHERE instance = ?', (RETIRED_INSTANCE,)):
+            merged[(name, labels)] = json.loads(value)
+        for instance in retired:
+            for name, labels, value in conn.execute(
+                    'SELECT name, labels, value FROM metric_values WHERE instance = ?', (instance,)):
+                metric = self.metrics.get(name)
+                if metric is None or metric.kind == 'gauge':
+                    continue
+                merged[(name, labels)] = self._merge(metric, merged.get((name, labels)), json.loads(value))
+            conn.execute('DELETE FROM metric_values WHERE instance = ?', (instance,))
+            conn.execute('DELETE FROM metric_instances WHERE instance = ?', (instance,))
+        conn.executemany(
+            'INSERT OR REPLACE INTO metric_values (instance, name, labels, value) VALUES (?, ?, ?, ?)',
+            [(RETIRED_INSTANCE, name, labels, json.dumps(value)) for (name, labels), value in merged.items()]
+        )
+
+    @staticmethod
+    def _merge(metric, total, value):
+        if total is None:
+            return value
+        if metric.kind == 'histogram':
+            return [a + b for a, b in zip(total, value)]
+        if metric.kind == 'gauge' and metric.aggregate == 'max':
+            return max(total, value)
+        return total + value
+
+    def collect(self):
+        """
+        汇总所有进程的值
+
+        返回:
+            dict - {指标名: {标签值元组: 值}}
+        """
+        self.flush()
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            self._retire_instances(conn)
+            rows = conn.execute('SELECT name, labels, value FROM metric_values').fetchall()
+
+        totals = {}
+        for name, labels, value in rows:
+            metric = self.metrics.get(name)
+            if metric is None:
+                continue
+            key = tuple(json.loads(labels))
+            series = totals.setdefault(name, {})
+            series[key] = self._merge(metric, series.get(key), json.loads(value))
+        return totals
+
+    def export(self):
+        """导出 Prometheus 文本格式"""
+        totals = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            for labelvalues, value in sorted(totals.get(name, {}).items()):
+                if metric.kind != 'histogram':
+                    lines.append(f'{name}{_format_labels(metric.labelnames, labelvalues)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-2]):
+                    cumulative += count
+                    labels = _format_labels(metric.labelnames, labelvalues, ('le', _format_value(bound)))
+                    lines.append(f'{name}_bucket{labels} {cumulative}')
+                labels = _format_labels(metric.labelnames, labelvalues)
+                lines.append(f'{name}_sum{labels} {_format_value(value[-2])}')
+                lines.append(f'{name}_count{labels} {value[-1]}')
+        return '\n'.join(lines) + '\n'
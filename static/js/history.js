@@ -38,7 +38,8 @@ const confirmCancelBtn = document.getElementById('confirm-cancel-btn');
 let currentPage = 1;
 let totalPages = 1;
 let itemsPerPage = 6; // 每页显示6条记录
-let allHistoryItems = []; // 存储所有历史记录
+let pageCursors = { 1: null }; // 已知页码对应的游标，用于服务端键集分页
+let currentPageItems = []; // 当前页的历史记录
 
 // 图片查看器实例
 let imageViewer = null;
@@ -84,8 +85,8 @@ function parallelInitialize() {
         body: JSON.stringify({ token: token })
     }, 10000);
     
-    // 同时预加载历史数据
-    preloadHistoryPromise = fetchWithTimeout('/history', {
+    // 同时预加载第一页历史数据
+    preloadHistoryPromise = fetchWithTimeout(buildHistoryUrl(1), {
         headers: {
             'X-Verification-Token': token
         }
@@ -132,17 +133,13 @@ function setupEventListeners() {
     // 分页控制事件
     prevPageBtn.addEventListener('click', () => {
         if (currentPage > 1) {
-            currentPage--;
-            renderHistoryPage();
-            updatePaginationControls();
+            loadHistory(currentPage - 1);
         }
     });
     
     nextPageBtn.addEventListener('click', () => {
         if (currentPage < totalPages) {
-            currentPage++;
-            renderHistoryPage();
-            updatePaginationControls();
+            loadHistory(currentPage + 1);
         }
     });
     
@@ -159,14 +156,15 @@ function setupEventListeners() {
         }
     });
     
-    // 刷新历史记录
+    // 刷新历史记录（丢弃已知游标，按页码重新定位）
     refreshHistoryBtn.addEventListener('click', () => {
-        loadHistory();
+        resetPageCursors();
+        loadHistory(currentPage);
     });
     
     // 重试按钮
     retryBtn.addEventListener('click', () => {
-        loadHistory();
+        loadHistory(currentPage);
     });
     
     // 清空历史记录
@@ -208,25 +206,56 @@ function showHistoryList() {
     historyList.hidden = false;
 }
 
+// 构建历史记录分页请求URL
+// 已知游标的页使用游标定位（服务端走索引），否则按页码跳转
+function buildHistoryUrl(page) {
+    const params = new URLSearchParams({ limit: itemsPerPage });
+    // 缩略图显示尺寸，服务端据此请求合适大小的缩略图
+    const thumbSize = getThumbnailDisplaySize();
+    params.set('thumb_w', thumbSize.width);
+    params.set('thumb_h', thumbSize.height);
+    const cursor = pageCursors[page];
+    if (cursor) {
+        params.set('cursor', cursor);
+    } else if (page > 1) {
+        params.set('page', page);
+    }
+    return `/history?${params.toString()}`;
+}
+
+// 清空已知游标（数据发生变化后页边界可能移动）
+function resetPageCursors() {
+    pageCursors = { 1: null };
+}
+
 // 处理历史数据（公共逻辑）
-function processHistoryData(data) {
+function processHistoryData(data, page) {
     if (data.status === 0) {
-        // 存储所有历史记录
-        allHistoryItems = data.result;
+        const result = data.result;
+        currentPageItems = result.items;
+        totalPages = Math.ceil(result.total / itemsPerPage);
         
-        if (allHistoryItems.length === 0) {
+        // 当前页已无记录（例如删除了最后一页的最后一条），回退到上一页
+        if (currentPageItems.length === 0 && page > 1) {
+            resetPageCursors();
+            loadHistory(page - 1);
+            return;
+        }
+        
+        if (currentPageItems.length === 0) {
             // 显示空状态
             showEmpty();
             return;
         }
         
-        // 计算总页数
-        totalPages = Math.ceil(allHistoryItems.length / itemsPerPage);
+        currentPage = page;
         
-        // 如果当前页超出范围，重置为第一页
-        if (currentPage > totalPages) {
-            currentPage = 1;
+        // 记录下一页的游标
+        if (result.next_cursor) {
+            pageCursors[page + 1] = result.next_cursor;
         }
+        // 总数可能有缓存延迟，以实际是否有下一页为准
+        totalPages = result.has_more ? Math.max(totalPages, page + 1) : page;
         
         // 显示历史列表
         showHistoryList();
@@ -249,7 +278,7 @@ function loadHistoryFromPreload() {
     
     if (!preloadHistoryPromise) {
         // 如果没有预加载的请求，回退到普通加载
-        loadHistory();
+        loadHistory(1);
         return;
     }
     
@@ -263,7 +292,7 @@ function loadHistoryFromPreload() {
             return response.json();
         })
         .then(data => {
-            processHistoryData(data);
+            processHistoryData(data, 1);
         })
         .catch(error => {
             if (error.message !== '验证已过期') {
@@ -281,14 +310,14 @@ function loadHistoryFromPreload() {
         });
 }
 
-// 加载历史记录（用于刷新按钮）
-function loadHistory() {
+// 按需加载指定页的历史记录
+function loadHistory(page = currentPage) {
     const token = localStorage.getItem('verificationToken');
     
     // 显示加载状态
     showLoading();
     
-    fetchWithTimeout('/history', {
+    fetchWithTimeout(buildHistoryUrl(page), {
         headers: {
             'X-Verification-Token': token
         }
@@ -300,10 +329,14 @@ function loadHistory() {
             redirectToVerify();
             throw new Error('验证已过期');
         }
+        if (response.status === 400) {
+            // 游标失效，回到按页码定位
+            resetPageCursors();
+        }
         return response.json();
     })
     .then(data => {
-        processHistoryData(data);
+        processHistoryData(data, page);
     })
     .catch(error => {
         if (error.message !== '验证已过期') {
@@ -317,23 +350,17 @@ function loadHistory() {
     });
 }
 
-// 生成阿里云OSS缩略图URL
-// 米游社渠道的图片存储在阿里云OSS，可以使用OSS图片处理功能生成缩略图以加快加载
-function getOssThumbnailUrl(originalUrl, channel) {
-    // 只有米游社渠道的图片才使用OSS图片处理
-    if (channel !== 'miyoushe') {
-        return originalUrl;
-    }
-    
-    // OSS图片处理参数：宽度600px，质量80%
-    const ossProcess = 'x-oss-process=image/resize,s_600/quality,q_80/interlace,1/format,webp';
-   
-    // 检查URL是否已包含查询参数
-    if (originalUrl.includes('?')) {
-        return `${originalUrl}&${ossProcess}`;
-    } else {
-        return `${originalUrl}?${ossProcess}`;
-    }
+// 历史记录缩略图的显示尺寸（已乘以设备像素比）
+function getThumbnailDisplaySize() {
+    // 与样式表一致：窄屏固定两列、缩略图高90px，否则每列至少200px、缩略图高120px
+    const narrow = window.innerWidth <= 768;
+    const listWidth = historyList.parentElement.clientWidth || window.innerWidth;
+    const columns = narrow ? 2 : Math.max(1, Math.floor(listWidth / 200));
+    const ratio = window.devicePixelRatio || 1;
+    return {
+        width: Math.round(listWidth / columns * ratio),
+        height: Math.round((narrow ? 90 : 120) * ratio)
+    };
 }
 
 // 渲染历史记录列表
@@ -348,14 +375,14 @@ function renderHistoryList(history) {
     };
     
     history.forEach(item => {
-        // 获取缩略图URL（米游社渠道使用OSS图片处理）
-        const thumbnailUrl = getOssThumbnailUrl(item.file_url, item.channel);
+        // 获取缩略图URL：服务端按显示尺寸选择本地缩略图或图床缩放后的图片，都没有时使用原图
+        const thumbnailUrl = item.thumb_url || item.file_url;
         
         const historyItem = document.createElement('div');
         historyItem.className = 'history-item';
         historyItem.innerHTML = `
             <div class="history-item-img-container">
-                <img class="history-item-img" src="${thumbnailUrl}" alt="${item.file_name}" data-original="${item.file_url}" loading="lazy">
+                <img class="history-item-img" src="${thumbnailUrl}" alt="${item.file_name}" data-original="${item.file_url}" loading="lazy" decoding="async">
                 <div class="img-loading-placeholder">
                     <div class="img-spinner"></div>
                 </div>
@@ -363,7 +390,7 @@ function renderHistoryList(history) {
             <div class="history-item-info">
                 <div class="history-item-name" title="${item.file_name}">${item.file_name}</div>
                 <div class="history-item-time">${item.upload_time}</div>
-                <div class="history-item-channel">${channelMap[item.channel] || item.channel || '未知'}${item.file_size ? ' · ' + formatFileSize(item.file_size) : ''}</div>
+                <div class="history-item-channel" title="${(item.mirrors || []).map(m => `${channelMap[m.channel] || m.channel}: ${m.file_url}`).join('\n')}">${channelMap[item.channel] || item.channel || '未知'}${item.mirrors && item.mirrors.length ? ' +' + item.mirrors.length + '镜像' : ''}${item.file_size ? ' · ' + formatFileSize(item.file_size) : ''}</div>
             </div>
             <div class="history-item-actions">
                 <button class="btn copy-url-btn" title="复制链接" data-url="${item.file_url}">复制链接</button>
@@ -382,6 +409,12 @@ function renderHistoryList(history) {
         });
         
         imgEl.addEventListener('error', () => {
+            // 本地缩略图加载失败时退回原图（原图只在这种情况和打开查看器时加载）
+            const fallbackUrl = getOssThumbnailUrl(item.file_url, item.channel);
+            if (imgEl.getAttribute('src') !== fallbackUrl) {
+                imgEl.src = fallbackUrl;
+                return;
+            }
             placeholderEl.innerHTML = '<span class="img-error-text">加载失败</span>';
         });
         
@@ -492,14 +525,6 @@ function initImageViewer() {
 
 // 渲染当前页的历史记录
 function renderHistoryPage() {
-    // 计算当前页的起始和结束索引
-    const startIndex = (currentPage - 1) * itemsPerPage;
-    const endIndex = Math.min(startIndex + itemsPerPage, allHistoryItems.length);
-    
-    // 获取当前页的记录
-    const currentPageItems = allHistoryItems.slice(startIndex, endIndex);
-    
-    // 渲染当前页记录
     renderHistoryList(currentPageItems);
 }
 
@@ -534,9 +559,7 @@ function updatePaginationControls() {
 function jumpToPage() {
     const page = parseInt(pageJumpInput.value, 10);
     if (page >= 1 && page <= totalPages) {
-        currentPage = page;
-        renderHistoryPage();
-        updatePaginationControls();
+        loadHistory(page);
     } else {
         showToast('请输入有效的页码', 'warning');
     }
@@ -565,8 +588,11 @@ function deleteHistoryItem(id) {
         })
         .then(data => {
             if (data.status === 0) {
-                // 刷新历史记录，但尝试保持在当前页
-                loadHistory();
+                // 删除后后续页的边界会移动，丢弃其游标，保持在当前页刷新
+                const currentCursor = pageCursors[currentPage];
+                resetPageCursors();
+                pageCursors[currentPage] = currentCursor;
+                loadHistory(currentPage);
                 showToast('删除成功', 'success');
             } else {
                 showToast(`删除失败: ${data.message}`, 'error');
@@ -606,7 +632,8 @@ function clearHistory() {
             if (data.status === 0) {
                 // 清空历史后，重置为第一页
                 currentPage = 1;
-                loadHistory();
+                resetPageCursors();
+                loadHistory(1);
                 showToast('历史记录已清空', 'success');
             } else {
                 showToast(`清空失败: ${data.message}`, 'error');
@@ -18,6 +18,13 @@ const copyUrlBtn = document.getElementById('copy-url-btn');
 const copyHtmlBtn = document.getElementById('copy-html-btn');
 const copyMdBtn = document.getElementById('copy-md-btn');
 const uploadAnotherBtn = document.getElementById('upload-another-btn');
+// 批量上传结果
+const resultTitle = document.getElementById('result-title');
+const resultSingle = document.getElementById('result-single');
+const batchResults = document.getElementById('batch-results');
+const batchResultsList = document.getElementById('batch-results-list');
+const copyAllUrlsBtn = document.getElementById('copy-all-urls-btn');
+const copyAllMdBtn = document.getElementById('copy-all-md-btn');
 const toast = document.getElementById('toast');
 // 图片链接上传
 const imageUrlInput = document.getElementById('image-url-input');
@@ -27,6 +34,8 @@ const urlUploadContainer = document.querySelector('.url-upload-container');
 
 // 上传状态标记
 let isUploading = false;
+// 最近一次批量上传成功的结果
+let batchSuccessItems = [];
 // 鼠标是否在上传区域内
 let isMouseOverDropArea = false;
 
@@ -172,21 +181,23 @@ function setupEventListeners() {
         }
         
         const items = e.clipboardData.items;
-        let imageFile = null;
+        const imageFiles = [];
         
-        // 遍历粘贴的内容
+        // 遍历粘贴的内容，收集所有图片
         for (let i = 0; i < items.length; i++) {
             // 如果是图片类型
             if (items[i].type.indexOf('image') !== -1) {
-                imageFile = items[i].getAsFile();
-                break;
+                const imageFile = items[i].getAsFile();
+                if (imageFile) {
+                    imageFiles.push(imageFile);
+                }
             }
         }
         
         // 如果找到图片，处理上传
-        if (imageFile) {
+        if (imageFiles.length) {
             e.preventDefault(); // 阻止默认粘贴行为
-            handleFiles([imageFile]);
+            handleFiles(imageFiles);
             
             // 显示粘贴上传提示
             showToast('已从剪贴板获取图片，正在上传...');
@@ -253,6 +264,16 @@ function setupEventListeners() {
     copyMdBtn.addEventListener('click', () => {
         copyText(markdownCode, 'Markdown代码已复制');
     });
+    
+    // 批量上传结果复制
+    copyAllUrlsBtn.addEventListener('click', () => {
+        copyToClipboard(batchSuccessItems.map(item => item.url).join('\n'), '全部链接已复制');
+    });
+    
+    copyAllMdBtn.addEventListener('click', () => {
+        const mdText = batchSuccessItems.map(item => `![${item.name}](${item.url})`).join('\n');
+        copyToClipboard(mdText, '全部Markdown已复制');
+    });
 }
 
 // 处理选择的文件
@@ -268,7 +289,8 @@ function handleFileSelect(e) {
 const CHANNEL_SIZE_LIMITS = {
     'miyoushe': 20,
     'chatglm': null,  // null 表示无限制
-    'jd': null
+    'jd': null,
+    'auto': null  // 自动选择时由服务端跳过超出限制的渠道
 };
 
 // 获取当前渠道的文件大小限制
@@ -277,23 +299,12 @@ function getChannelSizeLimit() {
     return CHANNEL_SIZE_LIMITS[channel] || null;
 }
 
-// 处理文件上传
-function handleFiles(files) {
-    // 防止重复上传
-    if (isUploading) {
-        return;
-    }
-    
-    const file = files[0]; // 只处理第一个文件
-    if (!file) {
-        return;
-    }
-    
+// 检查单个文件的类型和大小，返回错误信息，通过时返回null
+function checkFile(file) {
     // 验证文件类型
     const validTypes = ['image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'image/bmp', 'image/webp'];
     if (!validTypes.includes(file.type)) {
-        showToast('请选择支持的图片格式：JPG, PNG, GIF, BMP, WEBP', 'error');
-        return;
+        return '请选择支持的图片格式：JPG, PNG, GIF, BMP, WEBP';
     }
     
     // 验证文件大小
@@ -301,11 +312,48 @@ function handleFiles(files) {
     if (sizeLimit) {
         const fileSizeMB = file.size / (1024 * 1024);
         if (fileSizeMB > sizeLimit) {
-            showToast(`文件大小 ${fileSizeMB.toFixed(2)}MB 超出限制 ${sizeLimit}MB`, 'error');
+            return `文件大小 ${fileSizeMB.toFixed(2)}MB 超出限制 ${sizeLimit}MB`;
+        }
+    }
+    return null;
+}
+
+// 处理文件上传（单个文件走 /upload，多个文件走 /upload/batch）
+function handleFiles(files) {
+    // 防止重复上传
+    if (isUploading) {
+        return;
+    }
+    
+    const fileList = Array.from(files);
+    if (!fileList.length) {
+        return;
+    }
+    
+    if (fileList.length === 1) {
+        const error = checkFile(fileList[0]);
+        if (error) {
+            showToast(error, 'error');
             return;
         }
+        uploadSingleFile(fileList[0]);
+        return;
     }
     
+    // 多个文件：跳过不符合要求的文件
+    const validFiles = fileList.filter(file => !checkFile(file));
+    if (!validFiles.length) {
+        showToast('没有符合要求的图片文件', 'error');
+        return;
+    }
+    if (validFiles.length < fileList.length) {
+        showToast(`已跳过 ${fileList.length - validFiles.length} 个不支持或超出大小限制的文件`, 'warning');
+    }
+    uploadBatch(validFiles);
+}
+
+// 上传单个文件
+function uploadSingleFile(file) {
     // 标记上传状态
     isUploading = true;
     
@@ -452,7 +500,9 @@ function handleUploadSuccess(result, originalFileName) {
     const fileUrl = result.file_url;
     const width = result.width || 0;
     const height = result.height || 0;
-    const channelName = document.getElementById('channel-select').options[document.getElementById('channel-select').selectedIndex].text;
+    // 自动选择渠道时显示实际使用的渠道
+    const channelOption = result.channel && channelSelect.querySelector(`option[value="${result.channel}"]`);
+    const channelName = channelOption ? channelOption.text : channelSelect.options[channelSelect.selectedIndex].text;
     
     // 显示结果区域
     resultImg.src = fileUrl;
@@ -469,6 +519,11 @@ function handleUploadSuccess(result, originalFileName) {
     
     uploadChannel.textContent = channelName || '未知';
     
+    // 单图结果视图
+    resultTitle.textContent = '上传成功';
+    resultSingle.hidden = false;
+    batchResults.hidden = true;
+    
     // 隐藏上传区域，显示结果区域
     dropArea.hidden = true;
     urlUploadContainer.hidden = true; // 隐藏链接上传区域
@@ -481,6 +536,145 @@ function handleUploadSuccess(result, originalFileName) {
     showToast('上传成功！', 'success');
 }
 
+// 批量上传：结果以NDJSON逐行返回，每完成一个文件更新一次进度
+function uploadBatch(files) {
+    isUploading = true;
+    
+    // 显示进度条（按已完成的文件数计算）
+    uploadProgress.hidden = false;
+    progressBarInner.style.width = '0%';
+    progressPercentage.textContent = `0/${files.length}`;
+    
+    const formData = new FormData();
+    files.forEach(file => formData.append('files', file));
+    formData.append('channel', channelSelect.value);
+    
+    const token = localStorage.getItem('verificationToken');
+    const results = [];
+    let summary = null;
+    
+    const handleLine = (line) => {
+        if (!line.trim()) {
+            return;
+        }
+        const data = JSON.parse(line);
+        if (data.done) {
+            summary = data;
+            return;
+        }
+        results.push(data);
+        const percent = Math.round((results.length / files.length) * 100);
+        progressBarInner.style.width = `${percent}%`;
+        progressPercentage.textContent = `${results.length}/${files.length}`;
+    };
+    
+    fetch('/upload/batch', {
+        method: 'POST',
+        headers: {
+            'X-Verification-Token': token
+        },
+        body: formData
+    })
+    .then(async response => {
+        if (response.status === 401) {
+            localStorage.removeItem('verificationToken');
+            redirectToVerify();
+            throw new Error('验证已过期');
+        }
+        if (!response.ok) {
+            let message = `HTTP错误 ${response.status}`;
+            try {
+                const json = await response.json();
+                message = json.message || message;
+            } catch (e) {}
+            throw new Error(message);
+        }
+        
+        // 逐块读取响应，按行解析
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            lines.forEach(handleLine);
+        }
+        handleLine(buffer + decoder.decode());
+    })
+    .then(() => {
+        results.sort((a, b) => a.index - b.index);
+        handleBatchUploadSuccess(results, summary);
+    })
+    .catch(error => {
+        if (error.message !== '验证已过期') {
+            console.error('批量上传失败:', error);
+            showToast(`上传失败: ${error.message || '网络连接错误'}`, 'error');
+        }
+    })
+    .finally(() => {
+        isUploading = false;
+        uploadProgress.hidden = true;
+        fileInput.value = '';
+    });
+}
+
+// 处理批量上传结果
+function handleBatchUploadSuccess(results, summary) {
+    const succeeded = results.filter(item => item.status === 0);
+    batchSuccessItems = succeeded.map(item => ({ name: item.file_name, url: item.result.file_url }));
+    
+    batchResultsList.innerHTML = '';
+    results.forEach(item => {
+        const row = document.createElement('div');
+        row.className = 'url-group';
+        
+        const label = document.createElement('label');
+        label.textContent = item.file_name;
+        label.title = item.file_name;
+        row.appendChild(label);
+        
+        if (item.status === 0) {
+            const input = document.createElement('input');
+            input.type = 'text';
+            input.readOnly = true;
+            input.value = item.result.file_url;
+            const button = document.createElement('button');
+            button.className = 'btn';
+            button.textContent = '复制链接';
+            button.addEventListener('click', () => copyText(input, '图片链接已复制'));
+            row.appendChild(input);
+            row.appendChild(button);
+        } else {
+            const error = document.createElement('span');
+            error.className = 'batch-result-error';
+            error.textContent = item.message;
+            row.appendChild(error);
+        }
+        batchResultsList.appendChild(row);
+    });
+    
+    const total = summary ? summary.total : results.length;
+    resultTitle.textContent = `上传完成：成功 ${succeeded.length} 张，失败 ${total - succeeded.length} 张`;
+    resultSingle.hidden = true;
+    batchResults.hidden = false;
+    copyAllUrlsBtn.disabled = !succeeded.length;
+    copyAllMdBtn.disabled = !succeeded.length;
+    
+    // 隐藏上传区域，显示结果区域
+    dropArea.hidden = true;
+    urlUploadContainer.hidden = true;
+    resultSection.hidden = false;
+    resultSection.scrollIntoView({ behavior: 'smooth', block: 'start' });
+    
+    showToast(succeeded.length === total ? '全部上传成功！' : `${total - succeeded.length} 张图片上传失败`,
+        succeeded.length === total ? 'success' : 'warning');
+}
+
 // 重置上传表单
 function resetUploadForm() {
     dropArea.hidden = false;